@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import struct
+import argparse
+import tempfile
+from PIL import Image
+from rrtex_to_tga import (BLOCK_SIZES, ENCODER_PRESETS, DEFAULT_PRESET, RAW_TGA_PRESETS, parse_rrtex_header, read_mip_level,
+                          decode_block_data, decode_rrtex_pixels, encode_image, encode_tga_pixels)
+
+# Benchmark for the conversion pipeline of rrtex_to_tga.py.
+# Synthetic .rrtex files are generated for every combination of texture compression (BC1, BC3, BC7),
+# size (from small icons up to 4K map images) and mipped / non-mipped layout. Each stage of the
+# conversion is timed on its own: header parse, inflate, BC decode, image encode and write.
+# Every case runs with each encoder preset, the cases of presets other than balanced are named e.g.
+# bc7_1024_mipped:fast, and the size of the encoded outputs shows what the faster presets cost.
+# Results can be stored as a baseline and later runs compared against it, so regressions show up.
+# Before a mipped case is timed, it is decoded without its mip table to check that a requested mip level
+# which the scan can not find fails instead of decoding another level.
+#
+# Usage:
+#   python scripts/benchmark.py --save-baseline bench_baseline.json
+#   python scripts/benchmark.py --baseline bench_baseline.json
+
+COMPRESSION_TYPES = {'bc1': 19, 'bc3': 22, 'bc7': 28}
+DEFAULT_SIZES = [64, 256, 1024, 4096]
+DEFAULT_FORMATS = ['tga', 'png', 'webp']
+
+# Uncompressed size of the chunks a non-mipped texture is split into
+CHUNK_SIZE = 256 * 1024
+
+STAGES = ['parse', 'inflate', 'decode', 'encode', 'write']
+
+
+def make_block_data(num_blocks, block_size, rng):
+    """
+    Generates BC block data. Blocks are drawn from a small set of random blocks with runs of
+    repeated blocks, which compresses roughly like real UI textures rather than like noise.
+    """
+    palette = [rng.randbytes(block_size) for _ in range(64)]
+    blocks = []
+    while len(blocks) < num_blocks:
+        blocks.extend([rng.choice(palette)] * rng.randint(1, 16))
+    return b''.join(blocks[:num_blocks])
+
+
+def chunk(tag, data, version=1, name=b''):
+    """Builds a Relic chunky chunk: tag, version, size, name length, name, data"""
+    return tag + struct.pack('<iii', version, len(data), len(name)) + name + data
+
+
+def build_rrtex(width, height, texture_compression, mipped=True, seed=0, mip_table=True, raw_levels=None):
+    """
+    Builds a synthetic .rrtex file with the layout read by rrtex_to_tga.py:
+    a TMAN chunk with the mip table and a TDAT chunk with the mip levels stored smallest first.
+    Chunks which do not get smaller when compressed are stored as is, like in the game files.
+
+    Args:
+        width (int): Width of mip level 0.
+        height (int): Height of mip level 0.
+        texture_compression (int): Texture compression type (19/18 BC1, 22 BC3, 28 BC7).
+        mipped (bool): Store the full mip chain, otherwise a single level split into chunks.
+        seed (int): Seed of the generated block data.
+        mip_table (bool): Write the mip table, without it the chunks are found by scanning.
+        raw_levels (list): Mip levels stored as is, all others are compressed (default: the levels whose
+            chunks do not get smaller when compressed).
+
+    Returns:
+        bytes: The content of the .rrtex file.
+    """
+    rng = random.Random(seed)
+    block_size = BLOCK_SIZES[texture_compression]
+    mip_count = max(width, height).bit_length() if mipped else 1
+
+    mip_chunks = []
+    for mip_level in reversed(range(mip_count)):
+        mip_width, mip_height = max(1, width >> mip_level), max(1, height >> mip_level)
+        data_size = ((mip_width + 3) // 4) * ((mip_height + 3) // 4) * block_size
+        level = struct.pack('<IIII', mip_level, mip_width, mip_height, data_size) + \
+            make_block_data(data_size // block_size, block_size, rng)
+        parts = [level[i:i + CHUNK_SIZE] for i in range(0, len(level), CHUNK_SIZE)] if not mipped else [level]
+        stored = []
+        for part in parts:
+            compressed = zlib.compress(part, 9)
+            raw = len(compressed) >= len(part) if raw_levels is None else mip_level in raw_levels
+            stored.append((len(part), part if raw else compressed))
+        mip_chunks.append(stored)
+
+    tman = struct.pack('<7i', 6, width, height, 1, 2, texture_compression, mip_count) + b'\x00'
+    if mip_table:
+        tman += struct.pack('<i', mip_count) + struct.pack(f'<{mip_count}i', *[len(c) for c in mip_chunks])
+        for chunks in mip_chunks:
+            for size_uncompressed, data in chunks:
+                tman += struct.pack('<ii', size_uncompressed, len(data))
+    tdat = struct.pack('<i', 6) + b''.join(data for chunks in mip_chunks for _, data in chunks)
+
+    name = f'synthetic_{width}x{height}'.encode() + b'\x00'
+    texture = chunk(b'FOLDTXTR', chunk(b'DATATMAN', tman, 2) + chunk(b'DATATDAT', tdat, 1), 2, name)
+    return b'Relic Chunky\r\n\x1a\x00' + struct.pack('<ii', 4, 1) + chunk(b'FOLDTSET', texture)
+
+
+def get_cases(sizes, compressions):
+    """Yields (name, width, height, texture_compression, mipped) for every benchmark case"""
+    for compression in compressions:
+        for size in sizes:
+            for mipped in (True, False):
+                name = f"{compression}_{size}_{'mipped' if mipped else 'single'}"
+                yield name, size, size, COMPRESSION_TYPES[compression], mipped
+
+
+def check_mip_levels(width, height, texture_compression):
+    """
+    Decodes a mipped file without a mip table whose mip level 1 is stored as is, so the scan can not find it.
+    Requesting that level has to fail instead of decoding another level, a thumbnail of that size is scaled
+    down from level 0.
+
+    Returns:
+        list: the problems found, empty if there are none.
+    """
+    buff = build_rrtex(width, height, texture_compression, mip_table=False, raw_levels=[1])
+    problems = []
+    try:
+        mip_width, _, _ = decode_rrtex_pixels(buff, 'check_mipped.rrtex', 1)
+        problems.append(f"mip level 1 decoded {mip_width} pixels wide instead of failing")
+    except Exception:
+        pass
+    try:
+        decode_rrtex_pixels(buff, 'check_mipped.rrtex', max_dimension=max(1, max(width, height) // 2))
+    except Exception as e:
+        problems.append(f"the thumbnail failed: {' '.join(str(e).split())}")
+    return problems
+
+
+def run_case(buff, image_formats, out_dir, min_time, preset=DEFAULT_PRESET):
+    """
+    Runs the conversion stages on one file until `min_time` seconds are spent (at least once).
+
+    Returns:
+        dict: average seconds per stage (encode/write summed over all formats), iterations
+        and the size of the encoded outputs.
+    """
+    totals = dict.fromkeys(STAGES, 0.0)
+    iterations = 0
+    start = time.perf_counter()
+    while iterations == 0 or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        header = parse_rrtex_header(buff)
+        t1 = time.perf_counter()
+        decompressed_data = read_mip_level(buff, header, 0)
+        t2 = time.perf_counter()
+        decoded_data = decode_block_data(decompressed_data, header['width'], header['height'], header['texture_compression'])
+        t3 = time.perf_counter()
+        payloads = []
+        dec_img = None
+        for image_format in image_formats:
+            if image_format == 'tga' and preset in RAW_TGA_PRESETS:
+                payloads.append(encode_tga_pixels(header['width'], header['height'], decoded_data))
+                continue
+            if dec_img is None:
+                dec_img = Image.frombytes("RGBA", (header['width'], header['height']), decoded_data, 'raw', ("BGRA"))
+            payloads.append(encode_image(dec_img, image_format, preset))
+        t4 = time.perf_counter()
+        for image_format, payload in zip(image_formats, payloads):
+            with open(os.path.join(out_dir, 'benchmark.' + image_format), 'wb') as f:
+                f.write(payload)
+        t5 = time.perf_counter()
+
+        for stage, seconds in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            totals[stage] += seconds
+        iterations += 1
+
+    result = {stage: totals[stage] / iterations for stage in STAGES}
+    result['iterations'] = iterations
+    result['output_size'] = sum(len(payload) for payload in payloads)
+    return result
+
+
+def format_rate(size_bytes, seconds):
+    return f"{size_bytes / seconds / 1e6:8.1f}" if seconds > 0 else "     inf"
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the total time per file of every case against the baseline.
+
+    Returns:
+        list: names of the cases slower than the baseline by more than `threshold` percent.
+    """
+    regressions = []
+    print(f"\n{'case':<31} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        old_total = sum(baseline['results'][name][stage] for stage in STAGES)
+        new_total = sum(result[stage] for stage in STAGES)
+        change = (new_total - old_total) / old_total * 100 if old_total > 0 else 0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<31} {old_total * 1000:12.2f} {new_total * 1000:12.2f} {change:+7.1f}%{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the rrtex conversion stages on synthetic RRTEX files.')
+    parser.add_argument('--sizes', metavar='sizes', type=str, default=','.join(map(str, DEFAULT_SIZES)),
+                        help=f"comma separated texture sizes (default: {','.join(map(str, DEFAULT_SIZES))})")
+    parser.add_argument('--compressions', metavar='compressions', type=str, default='bc1,bc3,bc7',
+                        help='comma separated texture compressions: bc1, bc3, bc7 (default: bc1,bc3,bc7)')
+    parser.add_argument('--format', metavar='format', type=str, default=','.join(DEFAULT_FORMATS),
+                        help=f"comma separated output formats to encode (default: {','.join(DEFAULT_FORMATS)})")
+    parser.add_argument('--presets', metavar='presets', type=str, default=','.join(ENCODER_PRESETS),
+                        help=f"comma separated encoder presets (default: {','.join(ENCODER_PRESETS)})")
+    parser.add_argument('--min-time', metavar='min_time', type=float, default=0.5,
+                        help='minimum seconds spent on every case (default: 0.5)')
+    parser.add_argument('--baseline', metavar='baseline', type=str, default=None,
+                        help='compare the results against this baseline file')
+    parser.add_argument('--save-baseline', metavar='save_baseline', type=str, default=None,
+                        help='save the results as a baseline file')
+    parser.add_argument('--threshold', metavar='threshold', type=float, default=10.0,
+                        help='slowdown in percent reported as a regression (default: 10)')
+    parser.add_argument('--write-fixtures', metavar='write_fixtures', type=str, default=None,
+                        help='also write the synthetic .rrtex files to this directory, e.g. to run main.py on them')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    compressions = [compression.strip().lower() for compression in args.compressions.split(',')]
+    image_formats = [image_format.strip().lower() for image_format in args.format.split(',')]
+    presets = [preset.strip().lower() for preset in args.presets.split(',')]
+    for preset in presets:
+        if preset not in ENCODER_PRESETS:
+            print(f"Error: Unknown preset '{preset}', presets: {', '.join(ENCODER_PRESETS)}")
+            sys.exit(1)
+
+    results = {}
+    print(f"{'case':<31} {'file KB':>8} {'parse ms':>9} {'inflate ms':>11} {'decode ms':>10} {'encode ms':>10} "
+          f"{'write ms':>9} {'in MB/s':>8} {'px MB/s':>8} {'files/s':>8} {'out KB':>9}")
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name, width, height, texture_compression, mipped in get_cases(sizes, compressions):
+            buff = build_rrtex(width, height, texture_compression, mipped)
+            problems = check_mip_levels(width, height, texture_compression) if mipped else []
+            if problems:
+                print(f"Error: {name} without a mip table: {'; '.join(problems)}")
+                sys.exit(1)
+            if args.write_fixtures:
+                os.makedirs(args.write_fixtures, exist_ok=True)
+                with open(os.path.join(args.write_fixtures, name + '.rrtex'), 'wb') as f:
+                    f.write(buff)
+
+            for preset in presets:
+                case_name = name if preset == DEFAULT_PRESET else f"{name}:{preset}"
+                result = run_case(buff, image_formats, out_dir, args.min_time, preset)
+                result['file_size'] = len(buff)
+                result['pixels'] = width * height
+                results[case_name] = result
+
+                total = sum(result[stage] for stage in STAGES)
+                print(f"{case_name:<31} {len(buff) / 1024:8.1f} " +
+                      ' '.join(f"{result[stage] * 1000:{width_}.2f}" for stage, width_ in zip(STAGES, (9, 11, 10, 10, 9))) +
+                      f" {format_rate(len(buff), total)} {format_rate(width * height * 4, total)} "
+                      f"{1 / total if total > 0 else 0:8.1f} {result['output_size'] / 1024:9.1f}")
+
+    report = {
+        'formats': image_formats,
+        'presets': presets,
+        'python': sys.version.split()[0],
+        'results': results,
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0f}%")
+            sys.exit(1)
+        print("\nNo regressions")
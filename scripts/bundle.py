@@ -0,0 +1,192 @@
+import io
+import os
+import time
+import queue
+import tarfile
+import zipfile
+import threading
+from rrtex_to_tga import lap
+
+# Writes all outputs of a run into a single zip or tar file (--bundle) instead of a folder tree. Thousands of
+# small files are slow to create on network filesystems, and a single file is what artifact uploads want.
+# The workers only encode the outputs in memory and put them on a bounded queue; one writer thread appends
+# them to the bundle, so encoding and I/O overlap and no folders are created. The bundle is written to a
+# temporary file and moved into place when it is complete; a run which fails or is interrupted removes it.
+#
+# Entries are named by the output path relative to the destination folder. PNG and WebP are already
+# compressed and are stored as they are by default, other formats are deflated in zip bundles.
+
+BUNDLE_EXTENSIONS = ['.zip', '.tar', '.tar.gz', '.tgz']
+BUNDLE_COMPRESSIONS = ['auto', 'store', 'deflate']
+
+# formats which do not get smaller when they are compressed again
+COMPRESSED_FORMATS = ['.png', '.webp']
+
+# number of output files waiting for the writer thread before the workers are held back
+QUEUE_SIZE = 256
+
+
+def bundle_kind(path):
+    """Bundle type by the file extension: zip, tar or tar.gz, None if the extension is not supported"""
+    name = path.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith('.tar.gz') or name.endswith('.tgz'):
+        return 'tar.gz'
+    if name.endswith('.tar'):
+        return 'tar'
+    return None
+
+
+class BundleWriter:
+    """Appends encoded outputs to a zip or tar file on a dedicated writer thread"""
+    def __init__(self, path, root, compression='auto', queue_size=QUEUE_SIZE):
+        """
+        Args:
+            path (str): path of the bundle, its extension selects the type (see BUNDLE_EXTENSIONS).
+            root (str): output paths are stored relative to this folder (the destination directory).
+            compression (str): zip entry compression: store, deflate, or auto (store PNG and WebP, deflate the others).
+            queue_size (int): maximum number of outputs waiting to be written.
+        """
+        self.kind = bundle_kind(path)
+        if self.kind is None:
+            raise ValueError(f"Unsupported bundle '{path}', supported extensions: {', '.join(BUNDLE_EXTENSIONS)}")
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.root = root
+        self.compression = compression
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.entries = 0
+        self.closed = False
+
+        if self.kind == 'zip':
+            self.archive = zipfile.ZipFile(self.tmp_path, 'w')
+        else:
+            self.archive = tarfile.open(self.tmp_path, 'w:gz' if self.kind == 'tar.gz' else 'w')
+        self.thread = threading.Thread(target=self._run, name='bundle-writer', daemon=True)
+        self.thread.start()
+
+    def arcname(self, dest_file):
+        """Entry name of an output path"""
+        return os.path.relpath(dest_file, self.root).replace(os.sep, '/')
+
+    def write_outputs(self, dest_files, payloads, profile=None):
+        """
+        Queues the encoded outputs of one file, blocks while the queue is full.
+        The write stage and the written bytes are added to the optional profile by the writer thread.
+        """
+        for dest_file, payload in zip(dest_files.values(), payloads):
+            self._put(('file', self.arcname(dest_file), payload, profile))
+
+    def link(self, src, dest):
+        """
+        Queues an entry with the content of an output already queued (the output of a duplicate source).
+        Tar bundles store a hard link, zip bundles a copy.
+
+        Returns:
+            str: hardlink or copy, None if both are the same entry
+        """
+        if self.arcname(src) == self.arcname(dest):
+            return None
+        self._put(('link', self.arcname(dest), self.arcname(src), None))
+        return 'hardlink' if self.kind != 'zip' else 'copy'
+
+    def _put(self, item):
+        if self.error is not None:
+            raise Exception(f"Writing the bundle failed: {self.error}")
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining, so the workers are not blocked on a full queue
+                continue
+            kind, name, data, profile = item
+            try:
+                if profile is not None:
+                    t = time.perf_counter()
+                if kind == 'file':
+                    self._add(name, data)
+                else:
+                    self._add_link(name, data)
+                if profile is not None:
+                    # the profile records are built after the bundle is closed (ThreadSafeStats.get_profiles)
+                    lap(profile, 'write', t)
+                    profile['bytes_written'] += len(data)
+            except Exception as e:
+                self.error = e
+
+    def _compress_type(self, name):
+        if self.compression == 'store':
+            return zipfile.ZIP_STORED
+        if self.compression == 'auto' and os.path.splitext(name)[1].lower() in COMPRESSED_FORMATS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def _add(self, name, payload):
+        if self.kind == 'zip':
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = self._compress_type(name)
+            info.external_attr = 0o644 << 16
+            self.archive.writestr(info, payload)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(payload)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self.archive.addfile(info, io.BytesIO(payload))
+        self.entries += 1
+
+    def _add_link(self, name, target):
+        if self.kind == 'zip':
+            # zip has no links, the entry is read back from the bundle being written
+            self._add(name, self.archive.read(target))
+            return
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.LNKTYPE
+        info.linkname = target
+        info.mtime = time.time()
+        info.mode = 0o644
+        self.archive.addfile(info)
+        self.entries += 1
+
+    def _stop(self):
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.archive.close()
+
+    def close(self):
+        """
+        Waits for the queued outputs and finishes the bundle. A bundle whose writing failed is removed.
+
+        Returns:
+            dict: path, type, number of entries and bytes of the bundle.
+        """
+        self._stop()
+        if self.error is not None:
+            os.remove(self.tmp_path)
+            raise Exception(f"Writing the bundle failed: {self.error}")
+        os.replace(self.tmp_path, self.path)
+        return {'path': self.path, 'type': self.kind, 'entries': self.entries, 'bytes': os.path.getsize(self.path)}
+
+    def abort(self):
+        """Stops the writer thread without finishing the bundle and removes the temporary file"""
+        if not self.closed:
+            # the writer thread drops the outputs still queued
+            self.error = self.error or Exception("the run was aborted")
+            self._stop()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        # a bundle which was not closed when the run failed or was interrupted is not complete
+        if exc_type is not None:
+            self.abort()
@@ -0,0 +1,202 @@
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from manifest import stat_source, hash_source
+
+# Content-addressed deduplication of the files to convert. The UI archive contains many byte-identical
+# .rrtex files in different folders (shared icons, faction copies). Files are grouped by size first and
+# only files sharing a size are hashed; each unique content is converted once and the outputs of the other
+# copies are created as hardlinks, reflinks or byte copies of the converted files.
+# Sources mapping to the same output path (e.g. with --flatten) with different content are real
+# name collisions: the later one is reported and skipped instead of overwriting the first.
+# When the conversion starts during the scan, DuplicateTracker groups the files as they are found instead.
+
+LINK_MODES = ['auto', 'hardlink', 'reflink', 'copy']
+
+# ioctl cloning a file on copy-on-write filesystems (Btrfs, XFS), from linux/fs.h
+FICLONE = 0x40049409
+
+
+def source_digests(sources, digests, num_threads=4):
+    """
+    Hashes the sources missing from `digests` (keyed by str(source)) in parallel, hashlib releases the GIL.
+
+    Returns:
+        dict: the updated `digests`.
+    """
+    missing = [src_file for src_file in sources if str(src_file) not in digests]
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        for src_file, digest in zip(missing, executor.map(hash_source, missing)):
+            digests[str(src_file)] = digest
+    return digests
+
+
+def find_duplicates(file_tasks, digests, num_threads=4):
+    """
+    Groups the files to convert by content.
+
+    Args:
+        file_tasks (list): file_info tuples (src_file, dest_subdir, file_name).
+        digests (dict): SHA-1 digests by str(source), filled for the hashed files.
+        num_threads (int): number of hashing threads.
+
+    Returns:
+        tuple: (file_info of every unique content in scan order,
+                dict of the duplicate file_infos by str(source) of the file converted in their place)
+    """
+    sizes = {str(file_info[0]): stat_source(file_info[0]).st_size for file_info in file_tasks}
+    size_counts = defaultdict(int)
+    for size in sizes.values():
+        size_counts[size] += 1
+
+    # only files sharing their size with another file can be identical
+    source_digests([file_info[0] for file_info in file_tasks if size_counts[sizes[str(file_info[0])]] > 1],
+                   digests, num_threads)
+
+    unique_tasks = []
+    duplicates = {}
+    primaries = {}
+    for file_info in file_tasks:
+        key = str(file_info[0])
+        if size_counts[sizes[key]] == 1:
+            unique_tasks.append(file_info)
+            continue
+        primary = primaries.setdefault((sizes[key], digests[key]), file_info)
+        if primary is file_info:
+            unique_tasks.append(file_info)
+        else:
+            duplicates.setdefault(str(primary[0]), []).append(file_info)
+    return unique_tasks, duplicates
+
+
+class DuplicateTracker:
+    """
+    Groups the files to convert by content while the source tree is still being scanned (streaming version
+    of `find_duplicates`). A file is only hashed once another file of its size was seen; the first file of
+    every content is converted and the later ones become its duplicates. Used from one thread only.
+    """
+    def __init__(self, digests):
+        """
+        Args:
+            digests (dict): SHA-1 digests by str(source), filled for the hashed files.
+        """
+        self.digests = digests
+        self.primaries = defaultdict(list)
+        self.duplicates = {}
+
+    def add(self, file_info):
+        """
+        Returns:
+            bool: True if the file is converted, False if it is a duplicate of a file added before.
+        """
+        src_file = file_info[0]
+        primaries = self.primaries[stat_source(src_file).st_size]
+        if primaries:
+            for source in [primary[0] for primary in primaries] + [src_file]:
+                if str(source) not in self.digests:
+                    self.digests[str(source)] = hash_source(source)
+            for primary in primaries:
+                if self.digests[str(primary[0])] == self.digests[str(src_file)]:
+                    self.duplicates.setdefault(str(primary[0]), []).append(file_info)
+                    return False
+        primaries.append(file_info)
+        return True
+
+    def count(self):
+        return sum(len(copies) for copies in self.duplicates.values())
+
+
+def find_collisions(claimed, file_tasks, dest_files_of, digests):
+    """
+    Finds files to convert whose output path is already taken by a source with different content.
+
+    Args:
+        claimed (dict): source by output path of the files which keep their outputs (e.g. unchanged files),
+            the files to convert are added in scan order.
+        file_tasks (list): file_info tuples of the files to convert.
+        dest_files_of (function): returns the output paths by variant of a file_info.
+        digests (dict): SHA-1 digests by str(source), filled for the compared files.
+
+    Returns:
+        tuple: (file_infos without collisions, list of (file_info, output path, source owning the path))
+    """
+    kept = []
+    collisions = []
+    for file_info in file_tasks:
+        src_file = file_info[0]
+        dest_files = dest_files_of(file_info).values()
+        collision = None
+        for dest_file in dest_files:
+            owner = claimed.get(os.path.normcase(dest_file))
+            if owner is None or str(owner) == str(src_file):
+                continue
+            source_digests([owner, src_file], digests)
+            if digests[str(owner)] != digests[str(src_file)]:
+                collision = (file_info, dest_file, owner)
+                break
+        if collision is not None:
+            collisions.append(collision)
+            continue
+        for dest_file in dest_files:
+            claimed.setdefault(os.path.normcase(dest_file), src_file)
+        kept.append(file_info)
+    return kept, collisions
+
+
+def reflink(src, dest):
+    """Clones `src` to `dest` sharing the data blocks (copy-on-write), raises OSError where unsupported"""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, 'rb') as f_src, open(dest, 'wb') as f_dest:
+        fcntl.ioctl(f_dest.fileno(), FICLONE, f_src.fileno())
+
+
+def link_output(src, dest, link_mode='auto'):
+    """
+    Creates `dest` with the content of the output file `src`, replacing an existing file.
+
+    Args:
+        src (str): the converted output file.
+        dest (str): the output file of a duplicate source.
+        link_mode (str): hardlink, reflink, copy or auto (the first of these the filesystem supports).
+
+    Returns:
+        str: the mode used, or None if both paths are the same file.
+    """
+    if os.path.normcase(os.path.abspath(src)) == os.path.normcase(os.path.abspath(dest)):
+        return None
+    modes = LINK_MODES[1:] if link_mode == 'auto' else [link_mode]
+    tmp_path = dest + '.tmp'
+    for mode in modes:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            if mode == 'hardlink':
+                os.link(src, tmp_path)
+            elif mode == 'reflink':
+                reflink(src, tmp_path)
+            else:
+                shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, dest)
+            return mode
+        except OSError:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            if mode == modes[-1]:
+                raise
+    return None
+
+
+def break_link(path):
+    """
+    Removes an output file which is hardlinked to other outputs before it is written again,
+    so rewriting it does not change the content of its duplicates.
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except OSError:
+        pass
@@ -1,16 +1,32 @@
+import io
 import os
 import json
 import argparse
 import threading
 import time
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from rrtex_to_tga import convert_rrtex
+from collections import namedtuple
+from itertools import islice
+from contextlib import nullcontext, ExitStack
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from rrtex_to_tga import (pixels_to_image, save_image, encode_image, resize_image, decode_source, source_name,
+                          save_tga_pixels, encode_tga_pixels, new_profile, lap, estimate_decode_memory, open_source_buffer,
+                          pack_rrtex_bytes, decode_rrtex_bands, write_bands, SUPPORTED_FORMATS, ENCODER_PRESETS, DEFAULT_PRESET,
+                          RAW_TGA_PRESETS, STRATEGY_CACHE, BAND_FORMATS, DEFAULT_BAND_HEIGHT)
+from texture_containers import CONTAINER_FORMATS
+from manifest import Manifest, stat_source, hash_source, source_key
+from rrtex_index import (read_index_record, read_source_header, write_index, load_index, find_index, lookup_record,
+                         matches_filters)
+from profiling import make_record, summarize, print_summary
+from dedup import LINK_MODES, DuplicateTracker, find_duplicates, find_collisions, link_output, break_link
+from sharding import parse_shard, assign_shards
+from watcher import make_watcher, wait_for_changes
+from bundle import BUNDLE_COMPRESSIONS, BUNDLE_EXTENSIONS, BundleWriter, bundle_kind
+from scanner import scan_sources, is_archive
 
 # Configure stdout to use UTF-8 encoding to handle Unicode characters
 # This prevents UnicodeEncodeError when printing special characters
 if sys.platform == 'win32':
-    import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
@@ -23,9 +39,53 @@ if sys.platform == 'win32':
 # If the conversion is successful, the script increments the relevant statistics, and if not, it logs the details of the failure.
 # Files that are not .rrtex are skipped and logged accordingly.
 
+# Files are processed either by a thread pool (default), by a process pool working on chunks of files,
+# or in a hybrid mode where processes decode/encode and threads write the results to disk.
+# Files are submitted through a bounded in-flight window (--max-in-flight, --memory-budget), so only a
+# limited number of files and their decoded images are held in memory, however large the source tree is.
+
+# Instead of a folder exported with Essence editor, --src can point to a .sga archive: its table of contents
+# is read through a memory-mapped reader and every .rrtex entry is converted straight from memory.
+
+# With --index only the headers of the .rrtex files are read and written to a catalog (JSON Lines or SQLite),
+# which later runs use to filter the files to convert by texture compression or size.
+
+# Every texture is decoded once; all requested formats and size variants (--format tga,png,webp@256)
+# are encoded from the same decoded image.
+
+# With --profile the time spent in every stage (read, parse, inflate, decode, resize, encode, write)
+# is recorded for every file and summarized in the log report.
+
+# Byte-identical sources are converted once, the outputs of the other copies are hardlinked, reflinked or copied.
+# Sources which would overwrite each other's outputs with different content (e.g. with --flatten) are reported.
+
+# With --shard K/N every machine scans the same sources and converts only its share, balanced by file size.
+# The log reports of the shards are combined with merge_logreports.py.
+
+# With --watch the script keeps running after the conversion, keeps the worker pool alive and converts
+# new or changed files as soon as they are written (inotify on Linux, polling elsewhere).
+
+# --format dds and --format ktx2 write the BC blocks of the texture into GPU containers as they are, without
+# decoding them ("ktx2:mips" adds the smaller mip levels), for engines and WebGL viewers uploading them directly.
+
+# With --bundle all outputs are written into a single zip or tar file by a dedicated writer thread,
+# no folders are created.
+
+# A manifest in the destination directory records every converted source (size, mtime, hash, output),
+# so subsequent runs only convert new or changed files and remove outputs of deleted sources.
+
 # Finally, the script outputs the statistics of the conversion process and saves
 #  the log report as a JSON file to the specified destination directory.
 
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 1.0
+
+# Files per process pool task when the conversion starts during the scan and the number of files is not known yet
+STREAM_CHUNK_SIZE = 8
+
+# Output folders created by this process, every folder is created when the first output is written to it
+created_dirs = set()
+
 def save_dict_to_json(dictionary, path, file_name, indent=4):
     """
     Saves a dictionary as JSON to a specified path with a specified file name.
@@ -58,11 +118,23 @@ class ThreadSafeStats:
         self.stats = {
             'rrtex': 0,
             'converted': 0,
-            'failed': 0
+            'failed': 0,
+            'unchanged': 0,
+            'removed': 0,
+            'filtered': 0,
+            'deduplicated': 0,
+            'collisions': 0,
+            'fallbacks': 0
         }
         self.details = {
-            'failed': []
+            'failed': [],
+            'collisions': [],
+            'fallbacks': []
         }
+        self.profiles = []
+        self.total_files = None
+        self.worker_cpu_seconds = 0.0
+        self.worker_peak_rss_mb = None
 
     def increment_rrtex(self):
         with self.lock:
@@ -72,11 +144,76 @@ class ThreadSafeStats:
         with self.lock:
             self.stats['converted'] += 1
 
+    def increment_unchanged(self):
+        with self.lock:
+            self.stats['unchanged'] += 1
+
+    def requeue_unchanged(self):
+        """An unchanged file is converted again after all (its output went missing)"""
+        with self.lock:
+            self.stats['unchanged'] -= 1
+
+    def increment_filtered(self):
+        with self.lock:
+            self.stats['filtered'] += 1
+
+    def increment_deduplicated(self):
+        with self.lock:
+            self.stats['deduplicated'] += 1
+
+    def add_collision(self, filepath, output, conflicts_with):
+        with self.lock:
+            self.stats['collisions'] += 1
+            self.details['collisions'].append({"path": filepath, "output": output, "conflicts_with": conflicts_with})
+
+    def set_total_files(self, count):
+        """Number of files to process, known once the source tree is scanned"""
+        with self.lock:
+            self.total_files = count
+
+    def get_total_files(self):
+        with self.lock:
+            return self.total_files
+
+    def add_worker_usage(self, usage):
+        """Adds the CPU time and peak memory a worker process reported for a chunk of files (see convert_batch)"""
+        with self.lock:
+            self.worker_cpu_seconds += usage['cpu_seconds']
+            if usage['peak_rss_mb'] is not None:
+                self.worker_peak_rss_mb = max(self.worker_peak_rss_mb or 0, usage['peak_rss_mb'])
+
+    def get_worker_usage(self):
+        """
+        Returns:
+            tuple: (CPU seconds of the worker processes, peak resident memory in MB of the largest one or None)
+        """
+        with self.lock:
+            return self.worker_cpu_seconds, self.worker_peak_rss_mb
+
+    def set_removed(self, count):
+        with self.lock:
+            self.stats['removed'] = count
+
     def increment_failed(self, filepath, exception):
         with self.lock:
             self.stats['failed'] += 1
             self.details['failed'].append({"path": filepath, "exception": exception})
 
+    def add_fallback(self, filepath, fallback):
+        with self.lock:
+            self.stats['fallbacks'] += 1
+            self.details['fallbacks'].append(dict(path=filepath, **fallback))
+
+    def add_profile(self, src_file, profile):
+        # the record is built in get_profiles, a bundle writer thread still adds the write stage to the profile
+        with self.lock:
+            self.profiles.append((src_file, profile))
+
+    def get_profiles(self):
+        """Profile records of the converted files, with a bundle only complete once it is closed"""
+        with self.lock:
+            return [make_record(src_file, profile) for src_file, profile in self.profiles]
+
     def get_stats(self):
         with self.lock:
             return self.stats.copy()
@@ -84,78 +221,932 @@ class ThreadSafeStats:
     def get_details(self):
         with self.lock:
             return {
-                'failed': self.details['failed'].copy()
+                'failed': self.details['failed'].copy(),
+                'collisions': self.details['collisions'].copy(),
+                'fallbacks': self.details['fallbacks'].copy()
             }
 
-def process_file(file_info, image_format, flatten, dest_dir, thread_stats):
+class InFlightWindow:
     """
-    Process a single .rrtex file in a worker thread
+    Limits the files submitted to the executor but not finished yet, by count and by estimated memory.
+    Used from the main thread only. A task is always admitted when nothing is in flight, so files
+    larger than the memory budget are still converted, one at a time.
+    """
+    def __init__(self, max_files, memory_budget=None):
+        self.max_files = max_files
+        self.memory_budget = memory_budget
+        self.files = 0
+        self.memory = 0
+
+    def admits(self, files, memory):
+        if self.files == 0:
+            return True
+        if self.files + files > self.max_files:
+            return False
+        return self.memory_budget is None or self.memory + memory <= self.memory_budget
+
+    def acquire(self, files, memory):
+        self.files += files
+        self.memory += memory
+
+    def release(self, files, memory):
+        self.files -= files
+        self.memory -= memory
+
+def estimate_memory(file_info, decode_options=None, band_height=None):
+    """
+    Estimated peak memory in bytes of converting a file, from its header (0 for unreadable files, they fail early).
+    With band_height all image outputs are decoded band by band (--tiled)
+    """
+    src_file = file_info[0]
+    try:
+        header = read_source_header(src_file)
+        return estimate_decode_memory(header, stat_source(src_file).st_size, band_height=band_height, **(decode_options or {}))
+    except Exception:
+        return 0
+
+def submit_bounded(tasks, submit, window, task_cost):
+    """
+    Submit tasks while the in-flight window has room and yield (task, future) as they complete.
+
+    Args:
+        tasks: iterable of tasks
+        submit: function submitting a task to the executor and returning its future
+        window: InFlightWindow
+        task_cost: function returning (files, estimated memory) of a task
+    """
+    tasks = iter(tasks)
+
+    def take():
+        task = next(tasks, None)
+        return (task, task_cost(task) if task is not None else None)
+
+    next_task, next_cost = take()
+    pending = {}
+    while next_task is not None or pending:
+        while next_task is not None and window.admits(*next_cost):
+            window.acquire(*next_cost)
+            pending[submit(next_task)] = (next_task, next_cost)
+            next_task, next_cost = take()
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            task, cost = pending.pop(future)
+            window.release(*cost)
+            yield task, future
+
+# One requested output: format, optional maximum size, the suffix added to the file name
+# and the variant string recorded in the manifest (e.g. "webp@256"). band_height is set for outputs
+# decoded and written band by band (--tiled)
+OutputSpec = namedtuple('OutputSpec', ['image_format', 'max_dimension', 'name_suffix', 'variant', 'mips', 'preset', 'band_height'])
+
+def parse_output_specs(format_arg, thumbnail=None, mip_level=None, preset=DEFAULT_PRESET, band_height=None):
+    """
+    Parse the --format argument: a comma separated list of formats, each optionally
+    with a size variant, e.g. "tga,png,webp@256". GPU container formats can include
+    the smaller mip levels, e.g. "ktx2:mips"
+
+    Args:
+        format_arg: value of --format
+        thumbnail: default maximum size for formats without a size variant (--thumbnail)
+        mip_level: decoded mip level (--mip-level), recorded in the variant
+        preset: encoder preset of the image outputs (--preset)
+        band_height: rows per band of the full size TGA and PNG outputs (--tiled), the same files are written
+            so it is not part of the variant
+
+    Returns:
+        list: OutputSpec for every requested output
+    """
+    outputs = []
+    for spec in format_arg.lower().split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        image_format, _, size = spec.partition('@')
+        image_format, _, option = image_format.partition(':')
+        if image_format not in SUPPORTED_FORMATS + CONTAINER_FORMATS:
+            raise ValueError(f"Unsupported format '{image_format}'. "
+                             f"Supported formats: {', '.join(SUPPORTED_FORMATS + CONTAINER_FORMATS)}")
+        if size and not size.isdigit():
+            raise ValueError(f"Invalid size '{size}' in '{spec}', expected e.g. {image_format}@256")
+        if option and (option != 'mips' or image_format not in CONTAINER_FORMATS):
+            raise ValueError(f"Invalid option '{option}' in '{spec}', only {' and '.join(CONTAINER_FORMATS)} support ':mips'")
+        mips = option == 'mips'
+
+        max_dimension = int(size) if size else thumbnail
+        name_suffix = f"@{size}" if size else ''
+        variant = image_format
+        if mips:
+            variant += ":mips"
+        if preset != DEFAULT_PRESET and image_format not in CONTAINER_FORMATS:
+            # other encoder settings make other files, switching the preset converts the files again
+            variant += f":{preset}"
+        if mip_level is not None:
+            variant += f":mip{mip_level}"
+        if max_dimension is not None:
+            variant += f"@{max_dimension}"
+        banded = band_height is not None and image_format in BAND_FORMATS and max_dimension is None
+        outputs.append(OutputSpec(image_format, max_dimension, name_suffix, variant, mips, preset,
+                                  band_height if banded else None))
+    if not outputs:
+        raise ValueError("No output format given")
+    return outputs
+
+def get_decode_options(outputs, mip_level=None):
+    """
+    Decode options shared by all outputs: every output is fed from a single decoded image, so it is
+    decoded at the largest requested size (the full resolution if any output has no size limit).
+    GPU container outputs and outputs written band by band are decoded separately and do not count
+    """
+    sizes = [output.max_dimension for output in split_outputs(outputs)[0] if output.band_height is None]
+    max_dimension = None if not sizes or None in sizes else max(sizes)
+    return {'mip_level': mip_level, 'max_dimension': max_dimension}
+
+def decode_outputs(src_file, outputs, decode_options=None, profile=None):
+    """
+    Decode a file once for its image outputs. TGA outputs of presets writing raw TGA files get the decoded
+    BGRA pixels as they are when they need no scaling, the other outputs are encoded from one decoded image.
+
+    Returns:
+        tuple: (decoded image or None, outputs encoded from it, (width, height, pixels) or None, raw TGA outputs)
+    """
+    decode_options = decode_options or {}
+    raw_outputs = [output for output in outputs if output.image_format == 'tga' and output.preset in RAW_TGA_PRESETS]
+    if not raw_outputs:
+        return decode_source(src_file, decode_options, profile), outputs, None, []
+
+    pixels = decode_source(src_file, decode_options, profile, pixels=True)
+    width, height, _ = pixels
+    raw_outputs = [output for output in raw_outputs if output.max_dimension is None or max(width, height) <= output.max_dimension]
+    image_outputs = [output for output in outputs if output not in raw_outputs]
+    dec_img = None
+    if image_outputs:
+        if profile is not None:
+            t = time.perf_counter()
+        dec_img = resize_image(pixels_to_image(*pixels), decode_options.get('max_dimension'))
+        if profile is not None:
+            lap(profile, 'resize', t)
+    return dec_img, image_outputs, pixels, raw_outputs
+
+def pack_source(src_file, outputs, decode_options=None, profile=None):
+    """
+    Wrap the BC data of a .rrtex file path or .sga archive entry in the GPU container outputs (dds, ktx2),
+    without decoding it. The mip_level of decode_options is the first level of every container.
+
+    Returns:
+        list: the container file contents, in the order of outputs
+    """
+    mip_level = (decode_options or {}).get('mip_level')
+    if profile is not None:
+        t = time.perf_counter()
+    with open_source_buffer(src_file) as buff:
+        if profile is not None:
+            lap(profile, 'read', t)
+            profile['bytes_read'] += len(buff)
+        return [pack_rrtex_bytes(buff, output.image_format, source_name(src_file), mip_level, output.max_dimension, output.mips,
+                                 profile)
+                for output in outputs]
+
+def band_source(src_file, outputs, targets, decode_options=None, profile=None):
+    """
+    Decode a .rrtex file path or .sga archive entry band by band and stream it to the outputs written band by band,
+    targets are the binary files of the outputs in the same order. See decode_rrtex_bands
+    """
+    mip_level = (decode_options or {}).get('mip_level')
+    if profile is not None:
+        t = time.perf_counter()
+    with open_source_buffer(src_file) as buff:
+        if profile is not None:
+            lap(profile, 'read', t)
+            profile['bytes_read'] += len(buff)
+        width, height, bands = decode_rrtex_bands(buff, source_name(src_file), mip_level, outputs[0].band_height, profile)
+        write_bands(width, height, bands, [(output.image_format, f) for output, f in zip(outputs, targets)],
+                    outputs[0].preset, profile)
+
+def split_banded(image_outputs):
+    """Split the image outputs into outputs decoded at once and outputs written band by band (--tiled)"""
+    return ([output for output in image_outputs if output.band_height is None],
+            [output for output in image_outputs if output.band_height is not None])
+
+def split_outputs(outputs):
+    """Split the outputs into image outputs (decoded and encoded) and GPU container outputs (BC data passed through)"""
+    return ([output for output in outputs if output.image_format not in CONTAINER_FORMATS],
+            [output for output in outputs if output.image_format in CONTAINER_FORMATS])
+
+def get_dest_files(file_info, outputs, flatten, dest_dir):
+    """
+    Determine the output file paths of a .rrtex file
 
     Args:
         file_info: tuple of (src_file, dest_subdir, file_name)
-        image_format: output image format (tga, png, etc.)
+        outputs: list of OutputSpec
+        flatten: whether to flatten directory structure
+        dest_dir: base destination directory
+
+    Returns:
+        dict: path of the output file by output variant
+    """
+    _, dest_subdir, file_name = file_info
+    dest_files = {}
+    for output in outputs:
+        dest_name = file_name + output.name_suffix + '.' + output.image_format
+        if flatten:
+            dest_files[output.variant] = os.path.join(dest_dir, dest_name)
+        else:
+            dest_files[output.variant] = os.path.join(dest_subdir, dest_name)
+    return dest_files
+
+def save_outputs(dec_img, outputs, dest_files, profile=None):
+    """Encode and save every requested output of one decoded image"""
+    if profile is None:
+        for output in outputs:
+            break_link(dest_files[output.variant])
+            save_image(resize_image(dec_img, output.max_dimension), dest_files[output.variant], output.preset)
+        return
+    # encode in memory and write separately, so encoding and disk time are told apart
+    write_outputs({output.variant: dest_files[output.variant] for output in outputs},
+                  encode_outputs(dec_img, outputs, profile), profile)
+
+def encode_outputs(dec_img, outputs, profile=None):
+    """Encode every requested output of one decoded image in memory"""
+    if profile is None:
+        return [encode_image(resize_image(dec_img, output.max_dimension), output.image_format, output.preset) for output in outputs]
+    payloads = []
+    for output in outputs:
+        t = time.perf_counter()
+        img = resize_image(dec_img, output.max_dimension)
+        t = lap(profile, 'resize', t)
+        payloads.append(encode_image(img, output.image_format, output.preset))
+        lap(profile, 'encode', t)
+    return payloads
+
+def make_dest_dirs(dest_files):
+    """Create the folders of the output files, the scan creates none"""
+    for folder in {os.path.dirname(dest_file) for dest_file in dest_files.values()}:
+        if folder not in created_dirs:
+            os.makedirs(folder, exist_ok=True)
+            created_dirs.add(folder)
+
+def convert_outputs(src_file, outputs, dest_files, decode_options=None, profile=None):
+    """Write every requested output of one file: containers from the BC data, images from a single decode"""
+    make_dest_dirs(dest_files)
+    image_outputs, container_outputs = split_outputs(outputs)
+    image_outputs, banded_outputs = split_banded(image_outputs)
+    if container_outputs:
+        write_outputs({output.variant: dest_files[output.variant] for output in container_outputs},
+                      pack_source(src_file, container_outputs, decode_options, profile), profile)
+    if banded_outputs:
+        banded_files = [dest_files[output.variant] for output in banded_outputs]
+        try:
+            with ExitStack() as stack:
+                targets = []
+                for dest_file in banded_files:
+                    break_link(dest_file)
+                    targets.append(stack.enter_context(open(dest_file, 'wb')))
+                band_source(src_file, banded_outputs, targets, decode_options, profile)
+                if profile is not None:
+                    profile['bytes_written'] += sum(f.tell() for f in targets)
+        except Exception:
+            # the files are written while decoding, do not leave truncated outputs behind
+            for dest_file in banded_files:
+                if os.path.exists(dest_file):
+                    os.remove(dest_file)
+            raise
+    if image_outputs:
+        dec_img, encoded_outputs, pixels, raw_outputs = decode_outputs(src_file, image_outputs, decode_options, profile)
+        if raw_outputs:
+            if profile is not None:
+                t = time.perf_counter()
+            for output in raw_outputs:
+                break_link(dest_files[output.variant])
+                save_tga_pixels(*pixels, dest_files[output.variant])
+            if profile is not None:
+                lap(profile, 'write', t)
+                profile['bytes_written'] += len(raw_outputs) * len(pixels[2])
+        if encoded_outputs:
+            save_outputs(dec_img, encoded_outputs, dest_files, profile)
+
+def encode_source(src_file, outputs, decode_options=None, profile=None):
+    """Encode every requested output of one file in memory, in the order of outputs (see convert_outputs)"""
+    image_outputs, container_outputs = split_outputs(outputs)
+    image_outputs, banded_outputs = split_banded(image_outputs)
+    payloads = {}
+    if container_outputs:
+        payloads.update(zip((output.variant for output in container_outputs),
+                            pack_source(src_file, container_outputs, decode_options, profile)))
+    if banded_outputs:
+        # the decoded pixels are still held one band at a time, only the encoded files are kept
+        targets = [io.BytesIO() for _ in banded_outputs]
+        band_source(src_file, banded_outputs, targets, decode_options, profile)
+        payloads.update((output.variant, f.getvalue()) for output, f in zip(banded_outputs, targets))
+    if image_outputs:
+        dec_img, encoded_outputs, pixels, raw_outputs = decode_outputs(src_file, image_outputs, decode_options, profile)
+        if raw_outputs:
+            if profile is not None:
+                t = time.perf_counter()
+            payloads.update((output.variant, encode_tga_pixels(*pixels)) for output in raw_outputs)
+            if profile is not None:
+                lap(profile, 'encode', t)
+        if encoded_outputs:
+            payloads.update(zip((output.variant for output in encoded_outputs), encode_outputs(dec_img, encoded_outputs, profile)))
+    return [payloads[output.variant] for output in outputs]
+
+def process_file(file_info, outputs, flatten, dest_dir, thread_stats, manifest=None, decode_options=None, profiling=False,
+                 bundle=None):
+    """
+    Process a single .rrtex file in a worker thread
+
+    Args:
+        file_info: tuple of (src_file, dest_subdir, file_name), src_file is a path or SgaEntry
+        outputs: list of OutputSpec, all encoded from the same decoded image
         flatten: whether to flatten directory structure
         dest_dir: base destination directory
         thread_stats: ThreadSafeStats instance for tracking results
+        manifest: optional Manifest instance the successful conversion is recorded in
+        decode_options: optional dict with the mip_level / max_dimension to decode
+        profiling: record the stage timings of the file in thread_stats
+        bundle: optional BundleWriter the encoded outputs are queued to instead of writing files
 
     Returns:
         tuple: (success: bool, file_name: str, error_msg: str or None)
     """
-    src_file, dest_subdir, file_name = file_info
+    src_file, _, file_name = file_info
 
     try:
         thread_stats.increment_rrtex()
 
-        # Determine output file path
-        if flatten:
-            dest_file = os.path.join(dest_dir, file_name + '.' + image_format)
-        else:
-            dest_file = os.path.join(dest_subdir, file_name + '.' + image_format)
+        # Determine output file paths
+        dest_files = get_dest_files(file_info, outputs, flatten, dest_dir)
 
-        # Convert the file
-        convert_rrtex(src_file, dest_file)
+        # Stat and hash the source before converting, so a change during conversion is picked up next run
+        if manifest is not None:
+            src_stat = stat_source(src_file)
+            digest = hash_source(src_file)
+
+        # Decode once, then encode every output
+        profile = new_profile() if profiling else None
+        if bundle is not None:
+            bundle.write_outputs(dest_files, encode_source(src_file, outputs, decode_options, profile), profile)
+        else:
+            convert_outputs(src_file, outputs, dest_files, decode_options, profile)
         thread_stats.increment_converted()
+        if profiling:
+            thread_stats.add_profile(src_file, profile)
+        fallback = STRATEGY_CACHE.pop_fallback(source_name(src_file))
+        if fallback is not None:
+            thread_stats.add_fallback(str(src_file), fallback)
+
+        if manifest is not None:
+            manifest.record(src_file, src_stat, digest, dest_files)
 
         return True, file_name, None
 
     except Exception as e:
-        # Safely convert exception to string, handling any encoding issues
+        error_msg = exception_message(e)
+        STRATEGY_CACHE.pop_fallback(source_name(src_file))
+        thread_stats.increment_failed(str(src_file), error_msg)
+        return False, file_name, error_msg
+
+def exception_message(e):
+    """Safely convert exception to string, handling any encoding issues"""
+    try:
+        return str(e)
+    except Exception:
+        return "Unknown error (could not convert exception to string)"
+
+def convert_batch(batch, outputs, flatten, dest_dir, encode_only=False, decode_options=None, profiling=False):
+    """
+    Convert a chunk of .rrtex files in a worker process. Results are returned to the
+    main process instead of being tracked in shared statistics.
+
+    Args:
+        batch: list of file_info tuples (src_file, dest_subdir, file_name)
+        outputs: list of OutputSpec, all encoded from the same decoded image
+        flatten: whether to flatten directory structure
+        dest_dir: base destination directory
+        encode_only: return the encoded file contents instead of writing them (hybrid mode)
+        decode_options: optional dict with the mip_level / max_dimension to decode
+        profiling: collect the stage timings of every file
+
+    Returns:
+        tuple: (results, usage). results is a list of tuples of (file_info, success, error_msg, dest_files,
+        manifest_record, payloads, profile, fallback), where manifest_record is (src_stat, digest), payloads the
+        encoded outputs or None, profile the stage timings or None and fallback the failed decompression attempts
+        (see StrategyCache) or None. usage is a dict with the cpu_seconds of the chunk and the peak_rss_mb of the
+        worker, measured in the worker as a pool kept open (watch mode) is not reaped
+    """
+    start_cpu = get_cpu_seconds()
+    results = []
+    for file_info in batch:
+        src_file = file_info[0]
         try:
-            error_msg = str(e)
-        except Exception:
-            error_msg = "Unknown error (could not convert exception to string)"
+            dest_files = get_dest_files(file_info, outputs, flatten, dest_dir)
+            manifest_record = (stat_source(src_file), hash_source(src_file))
+            profile = new_profile() if profiling else None
+            if encode_only:
+                payloads = encode_source(src_file, outputs, decode_options, profile)
+            else:
+                convert_outputs(src_file, outputs, dest_files, decode_options, profile)
+                payloads = None
+            fallback = STRATEGY_CACHE.pop_fallback(source_name(src_file))
+            results.append((file_info, True, None, dest_files, manifest_record, payloads, profile, fallback))
+        except Exception as e:
+            STRATEGY_CACHE.pop_fallback(source_name(src_file))
+            results.append((file_info, False, exception_message(e), None, None, None, None, None))
+    return results, {'cpu_seconds': get_cpu_seconds() - start_cpu, 'peak_rss_mb': get_peak_rss_mb()}
 
-        thread_stats.increment_failed(src_file, error_msg)
-        return False, file_name, error_msg
+def write_outputs(dest_files, payloads, profile=None):
+    """Write the encoded outputs of one file to disk (hybrid mode writer thread)"""
+    if profile is not None:
+        t = time.perf_counter()
+    make_dest_dirs(dest_files)
+    for dest_file, payload in zip(dest_files.values(), payloads):
+        break_link(dest_file)
+        with open(dest_file, 'wb') as f:
+            f.write(payload)
+    if profile is not None:
+        lap(profile, 'write', t)
+        profile['bytes_written'] += sum(len(payload) for payload in payloads)
+
+def record_result(thread_stats, manifest, file_info, success, error_msg, dest_files=None, manifest_record=None, profile=None,
+                  fallback=None):
+    """Track the result of a file converted by a worker process (called from the main thread only)"""
+    thread_stats.increment_rrtex()
+    if success:
+        thread_stats.increment_converted()
+        src_stat, digest = manifest_record
+        manifest.record(file_info[0], src_stat, digest, dest_files)
+        if profile is not None:
+            thread_stats.add_profile(file_info[0], profile)
+        if fallback is not None:
+            thread_stats.add_fallback(str(file_info[0]), fallback)
+    else:
+        thread_stats.increment_failed(str(file_info[0]), error_msg)
+
+def make_batches(file_tasks, chunk_size):
+    """Split a list or stream of file_info tuples into lists of `chunk_size` files"""
+    file_tasks = iter(file_tasks)
+    return iter(lambda: list(islice(file_tasks, chunk_size)), [])
+
+def run_threads(file_tasks, num_workers, outputs, flatten, dest_dir, thread_stats, manifest, decode_options=None, profiling=False,
+                window=None, file_cost=None, pool=None, bundle=None):
+    """
+    Convert files on a thread pool, submitting them through the in-flight window.
+    An existing pool (watch mode) is used as is and stays open. With a bundle the outputs are queued to its writer thread.
+
+    Yields:
+        tuple: (file_info, success, processed_name, error_msg) for every completed file
+    """
+    window = window or InFlightWindow(num_workers * 2)
+    file_cost = file_cost or (lambda file_info: 0)
+    with nullcontext(pool) if pool is not None else ThreadPoolExecutor(max_workers=num_workers) as executor:
+        def submit(file_info):
+            return executor.submit(process_file, file_info, outputs, flatten, dest_dir, thread_stats, manifest, decode_options, profiling,
+                                   bundle)
+
+        for file_info, future in submit_bounded(file_tasks, submit, window, lambda file_info: (1, file_cost(file_info))):
+            try:
+                success, processed_name, error_msg = future.result()
+                yield file_info, success, processed_name, error_msg
+            except Exception as e:
+                yield file_info, False, file_info[2], f"Unexpected error: {e}"
+
+def run_processes(file_tasks, num_workers, chunk_size, outputs, flatten, dest_dir, thread_stats, manifest, decode_options=None,
+                  profiling=False, window=None, file_cost=None, pool=None, bundle=None):
+    """
+    Convert files on a process pool, submitting them in chunks of `chunk_size` files through the in-flight window.
+    An existing pool (watch mode) is used as is and stays open. With a bundle the workers return the encoded
+    outputs, which are queued to its writer thread.
+
+    Yields:
+        tuple: (file_info, success, processed_name, error_msg) for every completed file
+    """
+    window = window or InFlightWindow(num_workers * chunk_size * 2)
+    file_cost = file_cost or (lambda file_info: 0)
+    with nullcontext(pool) if pool is not None else ProcessPoolExecutor(max_workers=num_workers) as executor:
+        def submit(batch):
+            return executor.submit(convert_batch, batch, outputs, flatten, dest_dir, bundle is not None, decode_options, profiling)
+
+        def batch_cost(batch):
+            return len(batch), sum(file_cost(file_info) for file_info in batch)
+
+        for batch, future in submit_bounded(make_batches(file_tasks, chunk_size), submit, window, batch_cost):
+            try:
+                results, usage = future.result()
+                thread_stats.add_worker_usage(usage)
+            except Exception as e:
+                results = [(file_info, False, f"Unexpected error: {e}", None, None, None, None, None)
+                           for file_info in batch]
+
+            for file_info, success, error_msg, dest_files, manifest_record, payloads, profile, fallback in results:
+                if success and bundle is not None:
+                    try:
+                        bundle.write_outputs(dest_files, payloads, profile)
+                    except Exception as e:
+                        success, error_msg = False, exception_message(e)
+                record_result(thread_stats, manifest, file_info, success, error_msg, dest_files, manifest_record, profile, fallback)
+                yield file_info, success, file_info[2], error_msg
+
+def run_hybrid(file_tasks, num_workers, num_writers, chunk_size, outputs, flatten, dest_dir, thread_stats, manifest, decode_options=None,
+               profiling=False, window=None, file_cost=None):
+    """
+    Decode and encode files on a process pool and write the results on a thread pool.
+    Files stay in the in-flight window until they are written, so encoded results waiting
+    for a writer thread hold back the next batches.
+
+    Yields:
+        tuple: (file_info, success, processed_name, error_msg) for every completed file
+    """
+    window = window or InFlightWindow(num_workers * chunk_size * 2)
+    file_cost = file_cost or (lambda file_info: 0)
+    batches = make_batches(file_tasks, chunk_size)
+
+    def take():
+        batch = next(batches, None)
+        return (batch, [file_cost(file_info) for file_info in batch] if batch is not None else None)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as processes, ThreadPoolExecutor(max_workers=num_writers) as writers:
+        # pending futures map to ('decode', (batch, costs))
+        # or ('write', (file_info, dest_files, manifest_record, profile, fallback, cost))
+        pending = {}
+        next_batch, next_costs = take()
+
+        while next_batch is not None or pending:
+            while next_batch is not None and window.admits(len(next_batch), sum(next_costs)):
+                window.acquire(len(next_batch), sum(next_costs))
+                decode_future = processes.submit(convert_batch, next_batch, outputs, flatten, dest_dir, True, decode_options, profiling)
+                pending[decode_future] = ('decode', (next_batch, next_costs))
+                next_batch, next_costs = take()
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, task = pending.pop(future)
+
+                if kind == 'decode':
+                    batch, costs = task
+                    try:
+                        results, usage = future.result()
+                        thread_stats.add_worker_usage(usage)
+                    except Exception as e:
+                        results = [(file_info, False, f"Unexpected error: {e}", None, None, None, None, None) for file_info in batch]
+
+                    for (file_info, success, error_msg, dest_files, manifest_record, payloads, profile, fallback), cost in zip(results, costs):
+                        if success:
+                            write_future = writers.submit(write_outputs, dest_files, payloads, profile)
+                            pending[write_future] = ('write', (file_info, dest_files, manifest_record, profile, fallback, cost))
+                        else:
+                            window.release(1, cost)
+                            record_result(thread_stats, manifest, file_info, False, error_msg)
+                            yield file_info, False, file_info[2], error_msg
+                else:
+                    file_info, dest_files, manifest_record, profile, fallback, cost = task
+                    window.release(1, cost)
+                    try:
+                        future.result()
+                        record_result(thread_stats, manifest, file_info, True, None, dest_files, manifest_record, profile, fallback)
+                        yield file_info, True, file_info[2], None
+                    except Exception as e:
+                        error_msg = exception_message(e)
+                        record_result(thread_stats, manifest, file_info, False, error_msg)
+                        yield file_info, False, file_info[2], error_msg
+
+def with_duplicates(results, duplicates, digests, outputs, flatten, dest_dir, thread_stats, manifest, link_mode='auto',
+                    bundle=None):
+    """
+    Pass the results of the converted files through and create the outputs of their duplicates
+    right after each one, linked or copied from its outputs (called from the main thread only).
+    With a bundle the entries of the duplicates are linked or copied inside the bundle.
+    Duplicates added while the files are converted (DuplicateTracker) after their file finished follow at the end
+
+    Yields:
+        tuple: (file_info, success, processed_name, error_msg) for every converted file and duplicate
+    """
+    def link_duplicates(file_info, success, processed_name, error_msg):
+        primary_files = get_dest_files(file_info, outputs, flatten, dest_dir)
+        for duplicate in duplicates.pop(str(file_info[0]), []):
+            thread_stats.increment_rrtex()
+            if not success:
+                thread_stats.increment_failed(str(duplicate[0]), error_msg)
+                yield duplicate, False, duplicate[2], error_msg
+                continue
+            try:
+                dest_files = get_dest_files(duplicate, outputs, flatten, dest_dir)
+                if bundle is not None:
+                    link = bundle.link
+                else:
+                    make_dest_dirs(dest_files)
+                    link = lambda src, dest: link_output(src, dest, link_mode)
+                modes = {link(primary_files[variant], dest_file) for variant, dest_file in dest_files.items()} - {None}
+                manifest.record(duplicate[0], stat_source(duplicate[0]), digests[str(duplicate[0])], dest_files)
+                thread_stats.increment_converted()
+                thread_stats.increment_deduplicated()
+                how = '/'.join(sorted(modes)) or 'same output'
+                yield duplicate, True, f"{duplicate[2]} ({how} of {processed_name})", None
+            except Exception as e:
+                error = exception_message(e)
+                thread_stats.increment_failed(str(duplicate[0]), error)
+                yield duplicate, False, duplicate[2], error
+
+    finished = {}
+    for result in results:
+        yield result
+        finished[str(result[0][0])] = result
+        yield from link_duplicates(*result)
+    for primary in list(duplicates):
+        if primary in finished:
+            yield from link_duplicates(*finished[primary])
+
+def make_file_info(src_file, src_dir, dest_dir):
+    """Build the file_info tuple (src_file, dest_subdir, file_name) of a file in the source directory, None if it is not a .rrtex file"""
+    dirpath, file = os.path.split(src_file)
+    if '.' not in file:  # ensure file has extension
+        return None
+    file_extension = file.split('.')[-1]  # get last extension part
+    file_name = '.'.join(file.split('.')[:-1])  # get name without extension
+    if file_extension != 'rrtex':
+        return None
+    return (src_file, dirpath.replace(src_dir, dest_dir, 1), file_name)
+
+def build_index(src_dir, dest_dir, index_format, num_threads):
+    """
+    Read the headers of all .rrtex files and write the index catalog
+
+    Returns:
+        tuple: (path of the catalog, list of records)
+    """
+    sources = [file_info[0] for file_info in scan_sources(src_dir, dest_dir, num_threads)]
+    if not is_archive(src_dir):
+        sources.sort()
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        records = list(executor.map(lambda src_file: read_index_record(src_file, source_key(src_file, src_dir)), sources))
+    return write_index(records, dest_dir, index_format), records
+
+def print_results(results, total_files, thread_stats, quiet=False):
+    """
+    Print every failed file and the progress at most every PROGRESS_INTERVAL seconds and at the end.
+    total_files is None when the files are converted while the source tree is scanned, the total is then read from
+    thread_stats once the scan is complete. With quiet only the failed files are printed
+
+    Returns:
+        int: number of completed files
+    """
+    start_time = time.time()
+    last_progress = start_time
+    completed_files = 0
+
+    def print_progress():
+        current_stats = thread_stats.get_stats()
+        elapsed = time.time() - start_time
+        rate = completed_files / elapsed if elapsed > 0 else 0
+        total = total_files if total_files is not None else thread_stats.get_total_files()
+        print(f"Progress: {completed_files}/{total if total is not None else '?'} files, "
+              f"{current_stats['converted']} converted, "
+              f"{current_stats['failed']} failed, "
+              f"{rate:.1f} files/sec")
+
+    for file_info, success, processed_name, error_msg in results:
+        completed_files += 1
+
+        if not success:
+            try:
+                print(f"[{completed_files}] ✗ {processed_name} - {error_msg}")
+            except Exception:
+                # Fallback to ASCII-safe characters if Unicode fails
+                print(f"[{completed_files}] FAIL {processed_name} - {error_msg}")
+
+        if not quiet and time.time() - last_progress >= PROGRESS_INTERVAL:
+            print_progress()
+            last_progress = time.time()
+
+    if not quiet and completed_files:
+        print_progress()
+    return completed_files
+
+def watch_sources(src_dir, dest_dir, outputs, flatten, thread_stats, manifest, convert, save_report,
+                  accept=None, debounce=0.2, poll_interval=None, quiet=False):
+    """
+    Convert new and changed .rrtex files of the source directory until interrupted (--watch)
+
+    Args:
+        convert: function converting a list of file_info tuples, returning the results like run_threads
+        save_report: function called with the watch statistics after every batch of changes
+        accept: optional function returning False for files excluded by the filters
+        debounce: seconds without further changes before a burst of changes is converted
+        poll_interval: scan for changes every this many seconds instead of using inotify
+        quiet: only print the failed files of every batch, see print_results
+    """
+    watcher = make_watcher(src_dir, poll_interval)
+    print(f"Watching {src_dir} for changes, press Ctrl+C to stop")
+    watch_stats = {'batches': 0, 'files': 0, 'removed': 0, 'seconds': 0.0}
+    try:
+        while True:
+            changed, removed = wait_for_changes(watcher, debounce)
+
+            removed_outputs = []
+            for src_file in sorted(removed):
+                if not os.path.exists(src_file):
+                    removed_outputs.extend(manifest.remove(src_file))
+            for removed_output in removed_outputs:
+                print(f"Removed output of deleted source: {removed_output}")
+
+            file_tasks = []
+            for src_file in sorted(changed):
+                file_info = make_file_info(src_file, src_dir, dest_dir)
+                if file_info is None or not os.path.isfile(src_file):
+                    continue
+                if accept is not None and not accept(file_info):
+                    continue
+                # files touched without a content change are skipped
+                if manifest.is_up_to_date(src_file, get_dest_files(file_info, outputs, flatten, dest_dir)):
+                    continue
+                file_tasks.append(file_info)
+            if not file_tasks and not removed_outputs:
+                continue
+
+            start_time = time.time()
+            completed_files = print_results(convert(file_tasks), len(file_tasks), thread_stats, quiet) if file_tasks else 0
+            elapsed_time = time.time() - start_time
+            thread_stats.set_removed(thread_stats.get_stats()['removed'] + len(removed_outputs))
+
+            watch_stats['batches'] += 1
+            watch_stats['files'] += completed_files
+            watch_stats['removed'] += len(removed_outputs)
+            watch_stats['seconds'] += elapsed_time
+            watch_stats['last_batch'] = {'files': completed_files, 'removed': len(removed_outputs),
+                                         'seconds': elapsed_time, 'finished_at': time.time()}
+            try:
+                manifest.save()
+            except Exception as e:
+                print(f"Warning: Failed to save manifest: {e}")
+            save_report(watch_stats)
+            print(f"Converted {completed_files} changed files in {elapsed_time:.2f} seconds, watching for changes...")
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.close()
+
+def get_peak_rss_mb():
+    """Peak resident memory in MB of this process (None where unsupported), worker processes report their own"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def get_cpu_seconds():
+    """CPU time of this process, worker processes report their own (see convert_batch)"""
+    times = os.times()
+    return times.user + times.system
 
 if __name__ == "__main__":
     # Detect available CPU cores for default thread count
     default_threads = os.cpu_count() or 4  # fallback to 4 if cpu_count() returns None
 
     parser = argparse.ArgumentParser(description='Convert rrtex files to image formats (TGA, PNG, WebP).')
-    parser.add_argument('--src', metavar='--src', type=str, help='path to source directory')
+    parser.add_argument('--src', metavar='--src', type=str, help='path to source directory or .sga archive')
     parser.add_argument('--format', metavar='format', type=str, default='tga',
-                       help='image output format: tga (highest quality), png, webp (default: tga)')
+                       help='image output format: tga (highest quality), png, webp, or the GPU containers dds and ktx2 '
+                            '(BC data without decoding, add :mips for the mip chain) (default: tga). Several comma separated '
+                            'formats and size variants are encoded from one decode, e.g. tga,png,webp@256,ktx2:mips')
+    parser.add_argument('--preset', metavar='preset', type=str, default=DEFAULT_PRESET, choices=list(ENCODER_PRESETS),
+                       help='encoder preset: fast (fastest encoding, larger files, TGA written straight from the decoded pixels), '
+                            f'balanced or smallest (slowest encoding, smallest files) (default: {DEFAULT_PRESET})')
     parser.add_argument('--dst', '--destination', metavar='destination', type=str, default='export',
                        help='destination directory for output files (default: export)')
     parser.add_argument('--flatten', dest='flatten', action='store_true', help='description of parameter (default: False)')
     parser.add_argument('--threads', metavar='threads', type=int, default=default_threads,
                        help=f'number of worker threads (default: {default_threads} - detected CPU cores)')
-    parser.set_defaults(flatten=False)
+    parser.add_argument('--executor', metavar='executor', type=str, default='thread', choices=['thread', 'process', 'hybrid'],
+                       help='execution backend: thread, process (process pool working on chunks of files) or hybrid '
+                            '(processes decode, threads write files) (default: thread)')
+    parser.add_argument('--chunk-size', metavar='chunk_size', type=int, default=0,
+                       help='files per task submitted to the process pool (default: auto)')
+    parser.add_argument('--writer-threads', metavar='writer_threads', type=int, default=4,
+                       help='number of file writing threads in hybrid mode (default: 4)')
+    parser.add_argument('--max-in-flight', metavar='max_in_flight', type=int, default=0,
+                       help='maximum number of files submitted but not finished yet (default: auto, 2 tasks per worker)')
+    parser.add_argument('--memory-budget', metavar='memory_budget', type=int, default=None,
+                       help='limit the estimated memory of the files in flight to this many MB, '
+                            'estimated from the texture headers (default: no limit)')
+    parser.add_argument('--mip-level', metavar='mip_level', type=int, default=None,
+                       help='mip level to convert, only this level is decompressed and decoded (default: 0, full resolution)')
+    parser.add_argument('--thumbnail', metavar='thumbnail', type=int, default=None,
+                       help='scale images down so their larger side is at most this many pixels, '
+                            'decoding the smallest mip level which is still large enough')
+    parser.add_argument('--index', dest='index', action='store_true',
+                       help='only read the headers of the files and write an index catalog, nothing is converted (default: False)')
+    parser.add_argument('--index-format', metavar='index_format', type=str, default='jsonl', choices=['jsonl', 'sqlite'],
+                       help='format of the index catalog: jsonl or sqlite (default: jsonl)')
+    parser.add_argument('--from-index', metavar='from_index', type=str, default=None,
+                       help='index catalog used by the filters (default: index catalog in the destination directory)')
+    parser.add_argument('--filter-compression', metavar='filter_compression', type=str, default=None,
+                       help='only convert files with these texture compressions, comma separated: bc1, bc3, bc7')
+    parser.add_argument('--min-dimension', metavar='min_dimension', type=int, default=None,
+                       help='only convert files whose larger side is at least this many pixels')
+    parser.add_argument('--max-dimension', metavar='max_dimension', type=int, default=None,
+                       help='only convert files whose larger side is at most this many pixels')
+    parser.add_argument('--force', dest='force', action='store_true',
+                       help='convert all files, even those the manifest marks as unchanged (default: False)')
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false',
+                       help='convert byte-identical files separately instead of linking the outputs of the copies (default: False)')
+    parser.add_argument('--link-mode', metavar='link_mode', type=str, default='auto', choices=LINK_MODES,
+                       help='how outputs of identical files are created: hardlink, reflink, copy or auto '
+                            '(the first of these the filesystem supports) (default: auto)')
+    parser.add_argument('--shard', metavar='shard', type=str, default=None,
+                       help='only convert shard K of N (e.g. 2/4), the files are split between the shards by size')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                       help='record the time spent in every stage for every file and summarize it in logreport.json (default: False)')
+    parser.add_argument('--profile-top', metavar='profile_top', type=int, default=20,
+                       help='number of slowest files listed in the profile summary (default: 20)')
+    parser.add_argument('--watch', dest='watch', action='store_true',
+                       help='keep running after the conversion and convert new or changed files of the source directory '
+                            'as soon as they are written (default: False)')
+    parser.add_argument('--debounce', metavar='debounce', type=float, default=0.2,
+                       help='seconds without further changes before changed files are converted in watch mode (default: 0.2)')
+    parser.add_argument('--poll-interval', metavar='poll_interval', type=float, default=None,
+                       help='scan the source directory for changes every this many seconds in watch mode, '
+                            'instead of using inotify (default: inotify on Linux, 1 second elsewhere)')
+    parser.add_argument('--bundle', metavar='bundle', type=str, default=None,
+                       help='write all outputs into this zip or tar file (.zip, .tar, .tar.gz) instead of a folder tree, '
+                            'paths inside it are relative to the destination directory (default: no bundle)')
+    parser.add_argument('--bundle-compression', metavar='bundle_compression', type=str, default='auto', choices=BUNDLE_COMPRESSIONS,
+                       help='compression of the zip entries: store, deflate or auto (store PNG and WebP, which are '
+                            'already compressed, deflate the others) (default: auto)')
+    parser.add_argument('--tiled', dest='tiled', action='store_true',
+                       help='decode full size TGA and PNG outputs in bands of rows and stream them to the file, so very large '
+                            'textures (maps) need memory for a band instead of the whole image (default: False)')
+    parser.add_argument('--band-height', metavar='band_height', type=int, default=DEFAULT_BAND_HEIGHT,
+                       help=f'rows per band with --tiled, a multiple of 4 (default: {DEFAULT_BAND_HEIGHT})')
+    parser.add_argument('--quiet', dest='quiet', action='store_true',
+                       help='only print errors and the final summary, no settings and progress (default: False)')
+    parser.set_defaults(flatten=False, force=False, index=False, profile=False, dedup=True, watch=False, quiet=False, tiled=False)
 
     args = parser.parse_args()
 
     src_dir = args.src
-    image_format = args.format.lower()  # normalize to lowercase
     destination = args.dst
     flatten = args.flatten
     num_threads = args.threads
+    force = args.force
+    executor_mode = args.executor
+    chunk_size = args.chunk_size
+    num_writers = args.writer_threads
+    max_in_flight = args.max_in_flight
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    index_mode = args.index
+    profiling = args.profile
+    dedup = args.dedup
+    watch_mode = args.watch
+    bundle_path = os.path.abspath(args.bundle) if args.bundle else None
+    link_mode = args.link_mode
+    index_format = args.index_format
+    filter_compressions = [c.strip().lower() for c in args.filter_compression.split(',')] if args.filter_compression else None
+    min_dimension = args.min_dimension
+    max_dimension = args.max_dimension
+    filters_enabled = filter_compressions is not None or min_dimension is not None or max_dimension is not None
 
-    # Validate image format
-    supported_formats = ['tga', 'png', 'webp']
-    if image_format not in supported_formats:
-        print(f"Error: Unsupported format '{image_format}'. Supported formats: {', '.join(supported_formats)}")
+    if args.tiled and (args.band_height <= 0 or args.band_height % 4):
+        print(f"Error: --band-height must be a positive multiple of 4, got {args.band_height}")
         sys.exit(1)
+    band_height = args.band_height if args.tiled else None
+
+    # Validate image formats
+    try:
+        outputs = parse_output_specs(args.format, args.thumbnail, args.mip_level, args.preset, band_height)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    decode_options = get_decode_options(outputs, args.mip_level)
+    image_outputs = split_outputs(outputs)[0]
+    # the memory estimate only shrinks if no output decodes the whole image
+    tiled_memory = band_height if image_outputs and all(output.band_height for output in image_outputs) else None
+
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if watch_mode and (not src_dir or not os.path.isdir(src_dir) or index_mode or shard is not None):
+        print("Error: --watch needs a source directory and cannot be combined with --index or --shard")
+        sys.exit(1)
+    if bundle_path is not None and bundle_kind(bundle_path) is None:
+        print(f"Error: Unsupported bundle '{args.bundle}', supported extensions: {', '.join(BUNDLE_EXTENSIONS)}")
+        sys.exit(1)
+    if bundle_path is not None and (watch_mode or index_mode):
+        print("Error: --bundle cannot be combined with --watch or --index")
+        sys.exit(1)
+    if bundle_path is not None and executor_mode == 'hybrid':
+        # the bundle writer thread is the write stage, the processes only decode and encode
+        executor_mode = 'process'
+    if band_height is not None and executor_mode == 'hybrid':
+        # the processes write the files band by band, instead of passing whole encoded files to writer threads
+        executor_mode = 'process'
+    if watch_mode and executor_mode == 'hybrid':
+        # changes arrive a few files at a time, the writer threads of the hybrid executor do not pay off
+        executor_mode = 'process'
 
     # Set up destination directory
     if os.path.isabs(destination):
@@ -166,122 +1157,368 @@ if __name__ == "__main__":
     # Ensure destination directory exists
     os.makedirs(dest_dir, exist_ok=True)
 
-    print("Starting image extraction ...")
-    print(f"Source directory: {src_dir}")
-    print(f"Destination directory: {dest_dir}")
-    print(f"CPU cores detected: {os.cpu_count()}")
-    print(f"Worker threads: {num_threads}")
-    print(f"Output format: {image_format}")
-    print(f"Flatten structure: {flatten}")
+    # with --quiet only errors and the final summary are printed
+    log = (lambda *messages: None) if args.quiet else print
+
+    log("Starting image extraction ...")
+    log(f"Source directory: {src_dir}")
+    log(f"Destination directory: {dest_dir}")
+    log(f"CPU cores detected: {os.cpu_count()}")
+    log(f"Executor: {executor_mode}")
+    log(f"Workers: {num_threads}")
+    log(f"Output formats: {', '.join(output.variant for output in outputs)}")
+    log(f"Encoder preset: {args.preset}")
+    if band_height is not None:
+        banded_variants = [output.variant for output in outputs if output.band_height]
+        log(f"Tiled decoding: {', '.join(banded_variants)} in bands of {band_height} rows" if banded_variants
+            else "Tiled decoding: no full size TGA or PNG output, decoded as usual")
+    log(f"Flatten structure: {flatten}")
+    log(f"Force full conversion: {force}")
+    log(f"Deduplication: {link_mode if dedup else False}")
+    log(f"Profiling: {profiling}")
+    log(f"Watch: {watch_mode}")
+    if bundle_path is not None:
+        log(f"Bundle: {bundle_path} (compression: {args.bundle_compression})")
+    if shard is not None:
+        log(f"Shard: {shard[0]}/{shard[1]}")
+
+    if index_mode:
+        log("Indexing .rrtex headers...")
+        start_time = time.time()
+        index_path, records = build_index(src_dir, dest_dir, index_format, num_threads)
+        elapsed_time = time.time() - start_time
+        unreadable = sum(1 for record in records if record['error'])
+        rate = len(records) / elapsed_time if elapsed_time > 0 else 0
+        print(f"Indexed {len(records)} files ({unreadable} unreadable) in {elapsed_time:.2f} seconds ({rate:.0f} files/sec)")
+        print(f"Index catalog: {index_path}")
+        sys.exit(0)
 
     # Initialize thread-safe statistics
     thread_stats = ThreadSafeStats()
 
-    # First pass: collect all .rrtex files and create directory structure
-    print("Scanning for .rrtex files...")
-    file_tasks = []
+    # Load the manifest of the previous run (if any) to skip unchanged files.
+    # A bundle is written from scratch, every file is converted and the manifest is left alone
+    manifest = Manifest(src_dir, dest_dir)
+    if bundle_path is None:
+        manifest.load()
 
-    for dirpath, dirnames, filenames in os.walk(src_dir):
-        # create a corresponding destination directory
-        dest_subdir = dirpath.replace(src_dir, dest_dir, 1)
-        os.makedirs(dest_subdir, exist_ok=True)
+    # First pass: collect the .rrtex files to convert. No folders are created, outputs create theirs when written.
+    # Without --flatten and --shard no decision needs the whole source tree (outputs mirror the source paths,
+    # identical files are grouped as they are found), so the conversion starts with the first files found
+    # while the scan continues. Otherwise the tree is scanned completely first.
+    streaming = not flatten and shard is None
+    log("Scanning for .rrtex files..." + (" (converting while scanning)" if streaming else ""))
+    # output paths owned by unchanged files, a file to convert must not overwrite them with other content
+    claimed = {}
+    unchanged_outputs = {}
+    digests = {}
 
-        # collect all .rrtex files for processing
-        for file in filenames:
-            if '.' in file:  # ensure file has extension
-                file_extension = file.split('.')[-1]  # get last extension part
-                file_name = '.'.join(file.split('.')[:-1])  # get name without extension
+    # Files filtered by texture compression or size are looked up in the index catalog,
+    # files missing from the catalog or changed since it was written have their header read now
+    index_records = {}
+    if filters_enabled:
+        index_path = args.from_index or find_index(dest_dir)
+        if index_path:
+            log(f"Using index catalog: {index_path}")
+            index_records = load_index(index_path)
 
-                if file_extension == 'rrtex':
-                    src_file = os.path.join(dirpath, file)
-                    file_tasks.append((src_file, dest_subdir, file_name))
+    def accept_source(file_info):
+        if filters_enabled:
+            key = source_key(file_info[0], src_dir)
+            record = lookup_record(index_records, file_info[0], key)
+            if not matches_filters(record, filter_compressions, min_dimension, max_dimension):
+                manifest.mark_seen(file_info[0])
+                thread_stats.increment_filtered()
+                return False
+        return True
 
-    total_files = len(file_tasks)
-    print(f"Found {total_files} .rrtex files to process")
+    def needs_conversion(file_info):
+        dest_files = get_dest_files(file_info, outputs, flatten, dest_dir)
+        if force:
+            manifest.mark_seen(file_info[0])
+        elif manifest.is_up_to_date(file_info[0], dest_files):
+            thread_stats.increment_unchanged()
+            for dest_file in dest_files.values():
+                claimed[os.path.normcase(dest_file)] = file_info[0]
+                unchanged_outputs[dest_file] = file_info
+            return False
+        return True
 
-    if total_files == 0:
-        print("No .rrtex files found!")
-        sys.exit(0)
+    def skip_collisions(file_tasks):
+        # Files whose outputs would overwrite those of another file with different content are skipped
+        file_tasks, collisions = find_collisions(claimed, file_tasks,
+                                                 lambda file_info: get_dest_files(file_info, outputs, flatten, dest_dir), digests)
+        for file_info, dest_file, owner in collisions:
+            manifest.mark_seen(file_info[0])
+            thread_stats.add_collision(str(file_info[0]), dest_file, str(owner))
+            print(f"Name collision: {file_info[0]} would overwrite {dest_file} of {owner}, skipped")
+        return file_tasks
 
-    # Second pass: process files with multithreading
-    print(f"Processing files with {num_threads} worker threads...")
-    start_time = time.time()
-    completed_files = 0
+    def print_found(found_files):
+        unchanged_files = thread_stats.get_stats()['unchanged']
+        filtered_files = thread_stats.get_stats()['filtered']
+        log(f"Found {found_files + unchanged_files + filtered_files} .rrtex files, "
+            f"{unchanged_files} unchanged since the last run, {filtered_files} filtered out")
 
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        # Submit all tasks
-        future_to_file = {
-            executor.submit(process_file, file_info, image_format, flatten, dest_dir, thread_stats): file_info
-            for file_info in file_tasks
-        }
+    def remove_stale_outputs():
+        # Remove outputs whose source files are gone
+        removed_outputs = manifest.remove_stale()
+        thread_stats.set_removed(len(removed_outputs))
+        for removed_output in removed_outputs:
+            log(f"Removed stale output: {removed_output}")
+        # an unchanged file whose output is missing now is converted again
+        requeued = {}
+        for dest_file, file_info in unchanged_outputs.items():
+            if str(file_info[0]) not in requeued and not os.path.exists(dest_file):
+                log(f"Output {dest_file} of unchanged {file_info[0]} is missing, converting it again")
+                thread_stats.requeue_unchanged()
+                requeued[str(file_info[0])] = file_info
+        return list(requeued.values())
 
-        # Process completed tasks
-        for future in as_completed(future_to_file):
-            file_info = future_to_file[future]
-            src_file, _, file_name = file_info
+    shard_info = None
+    if streaming:
+        tracker = DuplicateTracker(digests) if dedup else None
+        duplicates = tracker.duplicates if dedup else {}
 
-            try:
-                success, processed_name, error_msg = future.result()
-                completed_files += 1
+        def stream_tasks():
+            found_files = 0
+            for file_info in scan_sources(src_dir, dest_dir, num_threads):
+                if not accept_source(file_info) or not needs_conversion(file_info) or not skip_collisions([file_info]):
+                    continue
+                found_files += 1
+                if tracker is None or tracker.add(file_info):
+                    yield file_info
+            print_found(found_files)
+            if tracker is not None:
+                log(f"{tracker.count()} .rrtex files are identical copies of other files")
+            requeued = remove_stale_outputs()
+            # the progress shows the total from here on
+            thread_stats.set_total_files(found_files + len(requeued))
+            log(f"{found_files + len(requeued)} .rrtex files to process")
+            yield from requeued
 
-                if success:
-                    # Use safe print with error handling
-                    try:
-                        print(f"[{completed_files}/{total_files}] ✓ {processed_name}")
-                    except Exception:
-                        # Fallback to ASCII-safe characters if Unicode fails
-                        print(f"[{completed_files}/{total_files}] OK {processed_name}")
+        file_tasks = stream_tasks()
+        total_files = None
+    else:
+        sources = [file_info for file_info in scan_sources(src_dir, dest_dir, num_threads) if accept_source(file_info)]
+        if not is_archive(src_dir):
+            # the scan order depends on timing, collisions and duplicates are resolved in path order
+            sources.sort(key=lambda file_info: file_info[0])
+
+        # Every shard assigns the same files, whatever the state of its destination folder
+        if shard is not None:
+            keys = [source_key(file_info[0], src_dir) for file_info in sources]
+            sizes = {key: stat_source(file_info[0]).st_size for key, file_info in zip(keys, sources)}
+            assignment = assign_shards(sizes, shard[1])
+            own_sources = []
+            for key, file_info in zip(keys, sources):
+                if assignment[key] == shard[0]:
+                    own_sources.append(file_info)
                 else:
-                    try:
-                        print(f"[{completed_files}/{total_files}] ✗ {processed_name} - {error_msg}")
-                    except Exception:
-                        # Fallback to ASCII-safe characters if Unicode fails
-                        print(f"[{completed_files}/{total_files}] FAIL {processed_name} - {error_msg}")
-
-                # Show progress every 10 files or at the end
-                if completed_files % 10 == 0 or completed_files == total_files:
-                    current_stats = thread_stats.get_stats()
-                    elapsed = time.time() - start_time
-                    rate = completed_files / elapsed if elapsed > 0 else 0
-                    try:
-                        print(f"Progress: {completed_files}/{total_files} files, "
-                              f"{current_stats['converted']} converted, "
-                              f"{current_stats['failed']} failed, "
-                              f"{rate:.1f} files/sec")
-                    except Exception:
-                        # Fallback if print fails
-                        print(f"Progress: {completed_files}/{total_files} files")
+                    # converted by another shard, its outputs are not stale
+                    manifest.mark_seen(file_info[0])
+            shard_info = {
+                'index': shard[0],
+                'count': shard[1],
+                'files': len(own_sources),
+                'bytes': sum(size for key, size in sizes.items() if assignment[key] == shard[0]),
+                'other_shards_files': len(sources) - len(own_sources),
+            }
+            log(f"Shard {shard[0]}/{shard[1]}: {len(own_sources)} of {len(sources)} files ({shard_info['bytes'] / 1e6:.1f} MB)")
+            sources = own_sources
+
+        file_tasks = [file_info for file_info in sources if needs_conversion(file_info)]
+        print_found(len(file_tasks))
+        file_tasks = skip_collisions(file_tasks)
+
+        # Identical files are converted once
+        duplicates = {}
+        if dedup:
+            file_tasks, duplicates = find_duplicates(file_tasks, digests, num_threads)
+            duplicate_files = sum(len(copies) for copies in duplicates.values())
+            log(f"{duplicate_files} .rrtex files are identical copies of other files")
+
+        total_files = len(file_tasks) + sum(len(copies) for copies in duplicates.values())
+        requeued = remove_stale_outputs()
+        file_tasks.extend(requeued)
+        total_files += len(requeued)
+        log(f"{total_files} .rrtex files to process")
 
+        if total_files == 0 and not watch_mode:
+            log("Nothing to convert!")
+            try:
+                if bundle_path is None:
+                    manifest.save()
             except Exception as e:
-                completed_files += 1
-                try:
-                    print(f"[{completed_files}/{total_files}] ✗ {file_name} - Unexpected error: {e}")
-                except Exception:
-                    # Fallback to ASCII-safe characters if Unicode fails
-                    print(f"[{completed_files}/{total_files}] FAIL {file_name} - Unexpected error")
+                print(f"Warning: Failed to save manifest: {e}")
+            if shard_info is not None:
+                # every shard leaves a report, so the merged report accounts for all of them
+                save_dict_to_json({'stats': thread_stats.get_stats(), 'details': thread_stats.get_details(),
+                                   'processing_time_seconds': 0, 'files_per_second': 0, 'shard': shard_info},
+                                  dest_dir, "logreport.json")
+            sys.exit(0)
+
+    # Second pass: process files with the selected executor
+    if chunk_size <= 0:
+        # a few chunks per worker keeps the pool balanced without paying per-file IPC
+        chunk_size = STREAM_CHUNK_SIZE if streaming else max(1, min(64, len(file_tasks) // (num_threads * 4)))
+
+    # Bound the files in flight, so memory does not grow with the size of the source tree
+    if max_in_flight <= 0:
+        max_in_flight = num_threads * 2 * (chunk_size if executor_mode != 'thread' else 1)
+    window = InFlightWindow(max_in_flight, memory_budget)
+    file_cost = (lambda file_info: estimate_memory(file_info, decode_options, tiled_memory)) if memory_budget else None
+    log(f"In-flight window: {max_in_flight} files"
+          + (f", memory budget {args.memory_budget} MB" if memory_budget else ""))
+
+    # In watch mode the worker pool outlives the first conversion, so changed files do not wait for workers to start
+    pool = None
+    if watch_mode:
+        pool = ProcessPoolExecutor(max_workers=num_threads) if executor_mode == 'process' else ThreadPoolExecutor(max_workers=num_threads)
+
+    try:
+        bundle = BundleWriter(bundle_path, dest_dir, args.bundle_compression) if bundle_path is not None else None
+    except OSError as e:
+        print(f"Error: Failed to create the bundle: {e}")
+        sys.exit(1)
+
+    if executor_mode == 'process':
+        log(f"Processing files with {num_threads} worker processes (chunks of {chunk_size} files)...")
+        results = run_processes(file_tasks, num_threads, chunk_size, outputs, flatten, dest_dir, thread_stats, manifest,
+                                decode_options, profiling, window, file_cost, pool, bundle)
+    elif executor_mode == 'hybrid':
+        log(f"Processing files with {num_threads} worker processes (chunks of {chunk_size} files) "
+              f"and {num_writers} writer threads...")
+        results = run_hybrid(file_tasks, num_threads, num_writers, chunk_size, outputs, flatten, dest_dir, thread_stats, manifest,
+                             decode_options, profiling, window, file_cost)
+    else:
+        log(f"Processing files with {num_threads} worker threads...")
+        results = run_threads(file_tasks, num_threads, outputs, flatten, dest_dir, thread_stats, manifest, decode_options, profiling,
+                              window, file_cost, pool, bundle)
+
+    if dedup:
+        results = with_duplicates(results, duplicates, digests, outputs, flatten, dest_dir, thread_stats, manifest, link_mode,
+                                  bundle)
+
+    start_time = time.time()
+    start_cpu = get_cpu_seconds()
+
+    # Process completed tasks, a run which fails or is interrupted removes the unfinished bundle
+    with bundle if bundle is not None else nullcontext():
+        completed_files = print_results(results, total_files, thread_stats, args.quiet)
+
+    # Wait for the writer thread to finish the bundle
+    bundle_info = None
+    if bundle is not None:
+        try:
+            bundle_info = bundle.close()
+            print(f"Bundle written: {bundle_info['path']} ({bundle_info['entries']} entries, {bundle_info['bytes'] / 1e6:.1f} MB)")
+        except Exception as e:
+            print(f"Error: {e}")
+            bundle_info = {'path': bundle_path, 'error': exception_message(e)}
 
     # Final statistics
     final_stats = thread_stats.get_stats()
     final_details = thread_stats.get_details()
     elapsed_time = time.time() - start_time
+    # the worker processes may still be running (watch mode), their usage is what they reported
+    worker_cpu_seconds, worker_peak_rss_mb = thread_stats.get_worker_usage()
+    cpu_seconds = get_cpu_seconds() - start_cpu + worker_cpu_seconds
+    peak_rss_mb = get_peak_rss_mb()
+    if worker_peak_rss_mb is not None:
+        peak_rss_mb = max(peak_rss_mb or 0, worker_peak_rss_mb)
+
+    # Measured scaling: how well the workers were kept busy, to compare executors on a given machine
+    files_per_second = completed_files/elapsed_time if elapsed_time > 0 else 0
+    execution = {
+        'executor': executor_mode,
+        'workers': num_threads,
+        'chunk_size': chunk_size if executor_mode != 'thread' else None,
+        'writer_threads': num_writers if executor_mode == 'hybrid' else None,
+        'max_in_flight': max_in_flight,
+        'memory_budget_mb': args.memory_budget,
+        'peak_rss_mb': peak_rss_mb,
+        'cpu_seconds': cpu_seconds,
+        'files_per_second_per_worker': files_per_second / num_threads,
+        'parallel_efficiency': cpu_seconds / (elapsed_time * num_threads) if elapsed_time > 0 else 0
+    }
 
     try:
         print(f"\n=== Conversion Complete ===")
         print(f"Total time: {elapsed_time:.2f} seconds")
         print(f"Average rate: {completed_files/elapsed_time:.1f} files/sec")
+        print(f"Scaling: {execution['files_per_second_per_worker']:.1f} files/sec per worker, "
+              f"{execution['parallel_efficiency'] * 100:.0f}% parallel efficiency ({cpu_seconds:.1f} CPU seconds)")
         print(f"Final statistics: {final_stats}")
     except Exception as e:
         # Fallback if printing fails
         print("\nConversion Complete")
         print(f"Total time: {elapsed_time:.2f} seconds")
 
+    profile_summary = summarize(thread_stats.get_profiles(), args.profile_top) if profiling else None
+    if profile_summary is not None:
+        print_summary(profile_summary)
+
+    # Save manifest so the next run only converts the delta
+    try:
+        if bundle is None:
+            manifest.save()
+    except Exception as e:
+        print(f"Warning: Failed to save manifest: {e}")
+
     # Save log report with error handling
     try:
         logreport = {}
         logreport['stats'] = final_stats
         logreport['details'] = final_details
         logreport['processing_time_seconds'] = elapsed_time
-        logreport['files_per_second'] = completed_files/elapsed_time if elapsed_time > 0 else 0
+        logreport['files_per_second'] = files_per_second
+        logreport['execution'] = execution
+        logreport['started_at'] = start_time
+        logreport['finished_at'] = start_time + elapsed_time
+        if shard_info is not None:
+            logreport['shard'] = shard_info
+        if profile_summary is not None:
+            logreport['profile'] = profile_summary
+        if bundle_info is not None:
+            logreport['bundle'] = bundle_info
         save_dict_to_json(logreport, dest_dir, "logreport.json")
     except Exception as e:
-        print(f"Warning: Failed to save log report: {e}")
\ No newline at end of file
+        print(f"Warning: Failed to save log report: {e}")
+        logreport = {}
+
+    if watch_mode:
+        def convert_changes(changed_tasks):
+            if executor_mode == 'process':
+                # a handful of files per change: one file per task keeps the latency low
+                return run_processes(changed_tasks, num_threads, 1, outputs, flatten, dest_dir, thread_stats, manifest,
+                                     decode_options, profiling, window, file_cost, pool)
+            return run_threads(changed_tasks, num_threads, outputs, flatten, dest_dir, thread_stats, manifest, decode_options,
+                               profiling, window, file_cost, pool)
+
+        def accept_change(file_info):
+            if not filters_enabled:
+                return True
+            record = read_index_record(file_info[0], source_key(file_info[0], src_dir))
+            if matches_filters(record, filter_compressions, min_dimension, max_dimension):
+                return True
+            thread_stats.increment_filtered()
+            return False
+
+        def save_watch_report(watch_stats):
+            # the log report is updated after every batch of changes with the running totals
+            logreport['stats'] = thread_stats.get_stats()
+            logreport['details'] = thread_stats.get_details()
+            logreport['watch'] = watch_stats
+            if profiling:
+                logreport['profile'] = summarize(thread_stats.get_profiles(), args.profile_top)
+            try:
+                save_dict_to_json(logreport, dest_dir, "logreport.json")
+            except Exception as e:
+                print(f"Warning: Failed to save log report: {e}")
+
+        try:
+            watch_sources(src_dir, dest_dir, outputs, flatten, thread_stats, manifest, convert_changes, save_watch_report,
+                          accept_change, args.debounce, args.poll_interval, args.quiet)
+        finally:
+            pool.shutdown(cancel_futures=True)
\ No newline at end of file
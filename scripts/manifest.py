@@ -0,0 +1,209 @@
+import os
+import json
+import hashlib
+import threading
+
+# The manifest lives next to logreport.json in the destination directory and remembers,
+# for every converted source file, its size, mtime and content hash together with the
+# output paths by output variant (format and size, e.g. "webp@256"). On the next run files whose source and output still
+# match are skipped, and outputs whose source disappeared are removed.
+# Sources are .rrtex file paths or entries of a .sga archive (see sga_reader.SgaEntry).
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Computes the SHA-1 hex digest of a file's content.
+
+    Args:
+        path (str): Path of the file to hash.
+        chunk_size (int): Number of bytes read per iteration.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stat_source(src):
+    """Returns the stat of a source file path or .sga archive entry"""
+    return os.stat(src) if isinstance(src, str) else src.stat()
+
+
+def hash_source(src):
+    """Returns the SHA-1 hex digest of a source file path or .sga archive entry"""
+    return hash_file(src) if isinstance(src, str) else src.sha1()
+
+
+def source_key(src, src_dir):
+    """
+    Returns the key identifying a source in the manifest and the index catalog:
+    its path relative to the source directory, or its path inside the .sga archive.
+    """
+    if not isinstance(src, str):
+        return src.path
+    return os.path.relpath(os.path.abspath(src), os.path.abspath(src_dir)).replace(os.sep, "/")
+
+
+class Manifest:
+    """Thread-safe record of converted source files, persisted as JSON in the destination directory"""
+    def __init__(self, src_dir, dest_dir):
+        self.lock = threading.Lock()
+        self.src_dir = os.path.abspath(src_dir)
+        self.dest_dir = dest_dir
+        self.path = os.path.join(dest_dir, MANIFEST_FILE_NAME)
+        self.entries = {}
+        self.seen = set()
+
+    def key(self, src_file):
+        """Returns the manifest key of a source: its path relative to the source directory or inside the archive"""
+        return source_key(src_file, self.src_dir)
+
+    def mark_seen(self, src_file):
+        """Marks a source as present, so its output is not removed as stale although it was not converted"""
+        with self.lock:
+            self.seen.add(self.key(src_file))
+
+    def load(self):
+        """
+        Loads the manifest from disk. A missing or unreadable manifest, or one written for a
+        different source directory, starts empty so nothing gets skipped or removed by mistake.
+        """
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != MANIFEST_VERSION or data.get("source_dir") != self.src_dir:
+            return
+        self.entries = data.get("files", {})
+
+    def save(self):
+        """Writes the manifest atomically (temp file + rename)"""
+        with self.lock:
+            data = {
+                "version": MANIFEST_VERSION,
+                "source_dir": self.src_dir,
+                "files": self.entries,
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def is_up_to_date(self, src_file, dest_files):
+        """
+        Checks whether a source file was already converted to all `dest_files` and has not changed since.
+        The size/mtime comparison is the fast path; the content hash is only computed when the
+        stat data differs (e.g. the file was touched or re-exported with the same content).
+
+        Args:
+            src_file (str or SgaEntry): The .rrtex source file.
+            dest_files (dict): Paths of the output files for this run by output variant.
+
+        Returns:
+            bool: True if the file can be skipped.
+        """
+        key = self.key(src_file)
+        with self.lock:
+            self.seen.add(key)
+            entry = self.entries.get(key)
+        if entry is None:
+            return False
+        recorded_outputs = entry.get("outputs", {})
+        for variant, dest_file in dest_files.items():
+            if recorded_outputs.get(variant) != self._relative_output(dest_file) or not os.path.exists(dest_file):
+                return False
+
+        src_stat = stat_source(src_file)
+        if entry.get("size") == src_stat.st_size and entry.get("mtime_ns") == src_stat.st_mtime_ns:
+            return True
+        if entry.get("size") != src_stat.st_size:
+            return False
+        if hash_source(src_file) != entry.get("sha1"):
+            return False
+
+        # same content, only the stat data changed - refresh it so the next run takes the fast path
+        with self.lock:
+            entry["mtime_ns"] = src_stat.st_mtime_ns
+        return True
+
+    def record(self, src_file, src_stat, digest, dest_files):
+        """
+        Records a successful conversion.
+
+        Args:
+            src_file (str or SgaEntry): The .rrtex source file.
+            src_stat (os.stat_result): Stat of the source taken before it was hashed.
+            digest (str): SHA-1 hex digest of the source content.
+            dest_files (dict): Paths of the written output files by output variant.
+        """
+        key = self.key(src_file)
+        outputs = {variant: self._relative_output(dest_file) for variant, dest_file in dest_files.items()}
+        with self.lock:
+            self.seen.add(key)
+            previous = self.entries.get(key)
+            if previous is not None and previous.get("sha1") == digest:
+                # outputs of other variants written from the same content are still valid
+                outputs = dict(previous.get("outputs", {}), **outputs)
+            self.entries[key] = {
+                "size": src_stat.st_size,
+                "mtime_ns": src_stat.st_mtime_ns,
+                "sha1": digest,
+                "outputs": outputs,
+            }
+
+    def remove_stale(self):
+        """
+        Removes outputs (and manifest entries) of source files that were not seen during this run.
+        Outputs another entry still references are kept, see `_remove_entries`.
+
+        Returns:
+            list: Paths of the removed output files.
+        """
+        with self.lock:
+            return self._remove_entries([key for key in self.entries if key not in self.seen])
+
+    def remove(self, src_file):
+        """
+        Removes the outputs (and the manifest entry) of a deleted source file.
+
+        Returns:
+            list: Paths of the removed output files.
+        """
+        key = self.key(src_file)
+        with self.lock:
+            self.seen.discard(key)
+            if key not in self.entries:
+                return []
+            return self._remove_entries([key])
+
+    def _remove_entries(self, keys):
+        """
+        Drops manifest entries and deletes their outputs. An output the remaining entries still reference is
+        kept: with --flatten identical sources in different folders record the same output file.
+        """
+        entries = [self.entries.pop(key) for key in keys]
+        referenced = {os.path.normcase(relative_output)
+                      for entry in self.entries.values() for relative_output in entry.get("outputs", {}).values()}
+        removed = []
+        for relative_output in (relative_output for entry in entries for relative_output in entry.get("outputs", {}).values()):
+            if os.path.normcase(relative_output) in referenced:
+                continue
+            output = os.path.join(self.dest_dir, relative_output)
+            if os.path.isfile(output):
+                try:
+                    os.remove(output)
+                    removed.append(output)
+                except OSError:
+                    pass
+        return removed
+
+    def _relative_output(self, dest_file):
+        return os.path.relpath(dest_file, self.dest_dir).replace(os.sep, "/")
@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import argparse
+from profiling import summarize
+
+# Combines the logreport.json files of a sharded run (main.py --shard K/N) into one report.
+# Counts and failure lists are summed, the processing time is the wall-clock time of the run
+# (the shards run in parallel) and the throughput is computed from the combined totals.
+#
+# Usage:
+#   python scripts/merge_logreports.py shard1/logreport.json shard2/logreport.json --output logreport.json
+#   python scripts/merge_logreports.py shard1 shard2 shard3    (folders containing a logreport.json)
+
+
+def load_report(path):
+    """Loads a log report, `path` is the file or the destination folder containing it"""
+    if os.path.isdir(path):
+        path = os.path.join(path, "logreport.json")
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def check_shards(reports):
+    """
+    Checks that the reports are the shards of one run, each exactly once.
+
+    Returns:
+        list: warnings, empty if the set of shards is complete.
+    """
+    shards = [report.get('shard') for report in reports]
+    if all(shard is None for shard in shards):
+        return []
+    if any(shard is None for shard in shards):
+        return ["Some reports are not from a sharded run"]
+    warnings = []
+    counts = {shard['count'] for shard in shards}
+    if len(counts) > 1:
+        warnings.append(f"Reports of runs with different shard counts: {sorted(counts)}")
+    indexes = [shard['index'] for shard in shards]
+    duplicated = sorted({index for index in indexes if indexes.count(index) > 1})
+    if duplicated:
+        warnings.append(f"Shards given more than once: {duplicated}")
+    missing = sorted(set(range(1, max(counts) + 1)) - set(indexes))
+    if missing:
+        warnings.append(f"Missing shards: {missing}")
+    return warnings
+
+
+def merge_reports(reports):
+    """
+    Merges log reports.
+
+    Args:
+        reports (list): the log reports of the shards.
+
+    Returns:
+        dict: the merged log report.
+    """
+    stats = {}
+    details = {}
+    for report in reports:
+        for name, value in report.get('stats', {}).items():
+            stats[name] = stats.get(name, 0) + value
+        for name, items in report.get('details', {}).items():
+            details.setdefault(name, []).extend(items)
+
+    # the shards run in parallel: the run takes as long as its slowest shard, or the span from the
+    # first start to the last finish when the shards did not start at the same time
+    processing_time = max((report.get('processing_time_seconds', 0) for report in reports), default=0)
+    starts = [report['started_at'] for report in reports if 'started_at' in report]
+    ends = [report['finished_at'] for report in reports if 'finished_at' in report]
+    if starts and len(starts) == len(reports) and len(ends) == len(reports):
+        processing_time = max(processing_time, max(ends) - min(starts))
+    completed_files = stats.get('converted', 0) + stats.get('failed', 0)
+    busy_seconds = sum(report.get('processing_time_seconds', 0) for report in reports)
+
+    executions = [dict(report['execution'], shard=report.get('shard', {}).get('index'))
+                  for report in reports if report.get('execution')]
+    cpu_seconds = sum(execution.get('cpu_seconds', 0) for execution in executions)
+    workers = sum(execution.get('workers', 0) for execution in executions)
+
+    merged = {
+        'stats': stats,
+        'details': details,
+        'processing_time_seconds': processing_time,
+        'files_per_second': completed_files / processing_time if processing_time > 0 else 0,
+        'execution': {
+            'shards': len(reports),
+            'workers': workers,
+            'cpu_seconds': cpu_seconds,
+            'shard_seconds': busy_seconds,
+            # how evenly the work was spread: 1.0 if every shard took as long as the slowest one
+            'shard_balance': busy_seconds / (processing_time * len(reports)) if processing_time > 0 else 0,
+            'per_shard': executions,
+        },
+        'shards': [report['shard'] for report in reports if report.get('shard')],
+    }
+    if starts:
+        merged['started_at'] = min(starts)
+    if ends:
+        merged['finished_at'] = max(ends)
+
+    profiles = [report['profile'] for report in reports if report.get('profile')]
+    if profiles:
+        records = [record for profile in profiles for record in profile['files']]
+        top = max(len(profile['slowest']) for profile in profiles)
+        merged['profile'] = summarize(records, top)
+    return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Merge the logreport.json files of a sharded run (main.py --shard K/N).')
+    parser.add_argument('reports', metavar='report', type=str, nargs='+',
+                        help='logreport.json files, or destination folders containing one')
+    parser.add_argument('--output', metavar='output', type=str, default='logreport.json',
+                        help='path of the merged report (default: logreport.json)')
+    args = parser.parse_args()
+
+    try:
+        reports = [load_report(path) for path in args.reports]
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    for warning in check_shards(reports):
+        print(f"Warning: {warning}")
+
+    merged = merge_reports(reports)
+    with open(args.output, 'w') as f:
+        json.dump(merged, f, indent=4)
+
+    print(f"Merged {len(reports)} reports into {args.output}")
+    print(f"Processing time: {merged['processing_time_seconds']:.2f} seconds, "
+          f"{merged['files_per_second']:.1f} files/sec, shard balance {merged['execution']['shard_balance'] * 100:.0f}%")
+    print(f"Final statistics: {merged['stats']}")
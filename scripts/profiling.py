@@ -0,0 +1,79 @@
+import math
+from rrtex_to_tga import COMPRESSION_NAMES
+
+# Per-file profiling of a conversion run (--profile). Every converted file gets a record with the
+# seconds spent in each stage (read, parse, inflate, decode, resize, encode, write), the bytes read
+# and written, its dimensions and texture compression. The records are summarized in logreport.json
+# with p50/p95/max/total per stage and the slowest files, to see where the time of a slow run goes.
+
+STAGES = ['read', 'parse', 'inflate', 'decode', 'resize', 'encode', 'write']
+
+
+def make_record(src_file, profile):
+    """
+    Builds the profile record of one converted file.
+
+    Args:
+        src_file (str or SgaEntry): The .rrtex source file.
+        profile (dict): The profile collected while converting it, see `rrtex_to_tga.new_profile`.
+
+    Returns:
+        dict: the record, with the total seconds of all stages.
+    """
+    record = {'path': str(src_file)}
+    record.update(profile)
+    record['compression'] = COMPRESSION_NAMES.get(profile.get('texture_compression'))
+    record['total'] = sum(profile['stages'].values())
+    return record
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(records, top=20):
+    """
+    Aggregates the profile records of a run.
+
+    Args:
+        records (list): records built by `make_record`.
+        top (int): number of slowest files listed.
+
+    Returns:
+        dict: 'stages' with count/p50/p95/max/total seconds per stage, 'bytes_read', 'bytes_written',
+        'slowest' with the `top` slowest records and 'files' with all records.
+    """
+    stages = {}
+    for stage in STAGES + ['total']:
+        values = sorted(record['total'] if stage == 'total' else record['stages'][stage]
+                        for record in records if stage == 'total' or stage in record['stages'])
+        if not values:
+            continue
+        stages[stage] = {
+            'count': len(values),
+            'p50': percentile(values, 0.50),
+            'p95': percentile(values, 0.95),
+            'max': values[-1],
+            'total': sum(values),
+        }
+    return {
+        'stages': stages,
+        'bytes_read': sum(record['bytes_read'] for record in records),
+        'bytes_written': sum(record['bytes_written'] for record in records),
+        'slowest': sorted(records, key=lambda record: record['total'], reverse=True)[:top],
+        'files': records,
+    }
+
+
+def print_summary(summary):
+    """Prints the per stage aggregates of `summarize`"""
+    print(f"\n{'stage':<8} {'files':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'total s':>9}")
+    for stage, aggregate in summary['stages'].items():
+        print(f"{stage:<8} {aggregate['count']:6d} {aggregate['p50'] * 1000:9.2f} {aggregate['p95'] * 1000:9.2f} "
+              f"{aggregate['max'] * 1000:9.2f} {aggregate['total']:9.2f}")
+    for record in summary['slowest'][:5]:
+        print(f"Slow: {record['total'] * 1000:.1f} ms {record['path']}")
@@ -0,0 +1,199 @@
+import os
+import json
+import sqlite3
+from rrtex_to_tga import HEADER_PREFIX_SIZE, COMPRESSION_NAMES, is_header_complete, parse_rrtex_header, read_rrtex_header
+from manifest import stat_source
+
+# The index catalog lists every .rrtex file with the fields of its TMAN header (dimensions,
+# texture compression, mip count, compressed/uncompressed sizes). Only the header bytes of each
+# file are read, nothing is decompressed. The catalog is written as JSON Lines or SQLite and can
+# be used by later runs to filter the files to convert without opening them again. Records whose
+# file size or mtime differ from the current source are stale, those files have their header read again.
+
+INDEX_FILE_NAMES = {
+    'jsonl': 'index.jsonl',
+    'sqlite': 'index.sqlite',
+}
+
+INDEX_COLUMNS = [
+    ('path', 'TEXT PRIMARY KEY'),
+    ('file_size', 'INTEGER'),
+    ('mtime_ns', 'INTEGER'),
+    ('version', 'INTEGER'),
+    ('width', 'INTEGER'),
+    ('height', 'INTEGER'),
+    ('texture_compression', 'INTEGER'),
+    ('compression', 'TEXT'),
+    ('mip_count', 'INTEGER'),
+    ('size_uncompressed', 'INTEGER'),
+    ('size_compressed', 'INTEGER'),
+    ('error', 'TEXT'),
+]
+
+
+def read_source_header(src_file):
+    """
+    Parses the header of a .rrtex file path or .sga archive entry, reading as few bytes as possible.
+
+    Returns:
+        dict: the header fields, see `rrtex_to_tga.parse_rrtex_header`.
+    """
+    if isinstance(src_file, str):
+        return read_rrtex_header(src_file)
+    size = HEADER_PREFIX_SIZE
+    buff = src_file.read(size)
+    while not is_header_complete(buff) and size < src_file.size:
+        size *= 4
+        buff = src_file.read(size)
+    return parse_rrtex_header(buff)
+
+
+def read_index_record(src_file, key):
+    """
+    Builds the catalog record of a source file. Files with an unreadable header get a record with `error` set.
+
+    Args:
+        src_file (str or SgaEntry): The .rrtex source file.
+        key (str): Path of the source relative to the source directory or inside the archive.
+
+    Returns:
+        dict: the catalog record.
+    """
+    record = dict.fromkeys(name for name, _ in INDEX_COLUMNS)
+    record['path'] = key
+    try:
+        src_stat = stat_source(src_file)
+        record['file_size'] = src_stat.st_size
+        record['mtime_ns'] = src_stat.st_mtime_ns
+        header = read_source_header(src_file)
+        for field in ('version', 'width', 'height', 'texture_compression', 'mip_count',
+                      'size_uncompressed', 'size_compressed'):
+            record[field] = header[field]
+        record['compression'] = COMPRESSION_NAMES.get(header['texture_compression'])
+    except Exception as e:
+        record['error'] = str(e)
+    return record
+
+
+def write_index(records, dest_dir, index_format):
+    """
+    Writes the catalog to the destination directory.
+
+    Args:
+        records (list): catalog records, see `read_index_record`.
+        dest_dir (str): destination directory.
+        index_format (str): jsonl or sqlite.
+
+    Returns:
+        str: path of the written catalog.
+    """
+    index_path = os.path.join(dest_dir, INDEX_FILE_NAMES[index_format])
+    tmp_path = index_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    if index_format == 'sqlite':
+        connection = sqlite3.connect(tmp_path)
+        try:
+            columns = ', '.join(f'{name} {column_type}' for name, column_type in INDEX_COLUMNS)
+            connection.execute(f'CREATE TABLE textures ({columns})')
+            connection.executemany(
+                f"INSERT INTO textures VALUES ({', '.join('?' * len(INDEX_COLUMNS))})",
+                [tuple(record[name] for name, _ in INDEX_COLUMNS) for record in records])
+            connection.execute('CREATE INDEX textures_compression ON textures (compression)')
+            connection.execute('CREATE INDEX textures_dimensions ON textures (width, height)')
+            connection.commit()
+        finally:
+            connection.close()
+    else:
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def load_index(index_path):
+    """
+    Loads a catalog written by `write_index` (JSON Lines or SQLite, detected from the extension).
+
+    Returns:
+        dict: catalog records by path.
+    """
+    if index_path.endswith('.sqlite'):
+        connection = sqlite3.connect(index_path)
+        try:
+            connection.row_factory = sqlite3.Row
+            return {row['path']: dict(row) for row in connection.execute('SELECT * FROM textures')}
+        finally:
+            connection.close()
+
+    records = {}
+    with open(index_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[record['path']] = record
+    return records
+
+
+def find_index(dest_dir):
+    """Returns the path of the most recently written catalog in the destination directory, or None"""
+    index_paths = [os.path.join(dest_dir, file_name) for file_name in INDEX_FILE_NAMES.values()]
+    index_paths = [index_path for index_path in index_paths if os.path.isfile(index_path)]
+    if not index_paths:
+        return None
+    return max(index_paths, key=lambda index_path: os.stat(index_path).st_mtime_ns)
+
+
+def lookup_record(records, src_file, key):
+    """
+    Returns the catalog record of a source file. Records missing from the catalog, or whose file size or mtime
+    differ from the current source (written before the file changed, or by an older version without mtimes),
+    are built again from the header of the source.
+
+    Args:
+        records (dict): catalog records by path, see `load_index`.
+        src_file (str or SgaEntry): The .rrtex source file.
+        key (str): Path of the source relative to the source directory or inside the archive.
+
+    Returns:
+        dict: the catalog record.
+    """
+    record = records.get(key)
+    if record is not None:
+        try:
+            src_stat = stat_source(src_file)
+        except OSError:
+            src_stat = None
+        if (src_stat is not None and record.get('file_size') == src_stat.st_size
+                and record.get('mtime_ns') == src_stat.st_mtime_ns):
+            return record
+    return read_index_record(src_file, key)
+
+
+def matches_filters(record, compressions=None, min_dimension=None, max_dimension=None):
+    """
+    Checks a catalog record against the filters of a conversion run.
+
+    Args:
+        record (dict): catalog record.
+        compressions (list): accepted compression names (bc1, bc3, bc7), None accepts all.
+        min_dimension (int): minimum of max(width, height), None for no limit.
+        max_dimension (int): maximum of max(width, height), None for no limit.
+
+    Returns:
+        bool: True if the file should be converted. Files with unreadable headers are kept,
+        so their failure is reported by the conversion.
+    """
+    if record.get('error'):
+        return True
+    if compressions is not None and record['compression'] not in compressions:
+        return False
+    dimension = max(record['width'], record['height'])
+    if min_dimension is not None and dimension < min_dimension:
+        return False
+    if max_dimension is not None and dimension > max_dimension:
+        return False
+    return True
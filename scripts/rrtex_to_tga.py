@@ -1,12 +1,98 @@
 import struct
 import texture2ddecoder
-from PIL import Image
+from PIL import Image, ImageChops
 import zlib
 import os
+import io
+import re
+import mmap
+import time
+import threading
+import itertools
+from contextlib import contextmanager, nullcontext
+from texture_containers import pack_texture
+
+# Supported output image formats
+SUPPORTED_FORMATS = ['tga', 'png', 'webp']
 
 # WebP conversion quality setting (0-100)
 WEBP_QUALITY = 85
 
+# Pillow save options of every output format by encoder preset (--preset). balanced are the settings
+# used before presets existed, fast trades file size for encoding speed, smallest the other way around.
+ENCODER_PRESETS = {
+    'fast': {
+        'png': {'compress_level': 1},
+        'webp': {'quality': WEBP_QUALITY, 'method': 0, 'lossless': False},
+        'tga': {},
+    },
+    'balanced': {
+        'png': {},
+        'webp': {'quality': WEBP_QUALITY, 'lossless': False},
+        'tga': {},
+    },
+    'smallest': {
+        'png': {'compress_level': 9, 'optimize': True},
+        'webp': {'quality': 80, 'method': 6, 'lossless': False},
+        'tga': {'compression': 'tga_rle'},
+    },
+}
+DEFAULT_PRESET = 'balanced'
+
+# Presets writing uncompressed TGA files straight from the decoded BGRA pixels, without Pillow
+RAW_TGA_PRESETS = ['fast']
+
+# TGA 2.0 footer: no extension or developer area
+TGA_FOOTER = bytes(8) + b'TRUEVISION-XFILE.\0'
+
+# zlib stream header: CMF 0x78 (deflate, 32K window) followed by one of the FLG values zlib writes
+ZLIB_HEADER = re.compile(rb"\x78[\x01\x5e\x9c\xda]")
+
+# Every mip level starts with a 16 byte header: mip_level, width, height, data_size (4 * uint32)
+MIP_HEADER_SIZE = 16
+
+# Size in bytes of a 4x4 block for the supported texture compression types
+BLOCK_SIZES = {
+    28: 16,  # BC7
+    22: 16,  # BC3
+    19: 8,   # BC1
+    18: 8,   # BC1 with alpha?
+}
+
+# Names of the supported texture compression types
+COMPRESSION_NAMES = {
+    28: 'bc7',
+    22: 'bc3',
+    19: 'bc1',
+    18: 'bc1',
+}
+
+# Ways to find the first zlib stream of a mipped file without a mip table. They are tried in this order
+# until one worked for a layout, after that the one which worked last is tried first (see StrategyCache)
+OFFSET_STRATEGIES = ['offset16', 'zlib_scan', 'offset0']
+
+# Fallbacks kept for files nobody asked about (library use), the oldest ones are dropped
+MAX_FALLBACKS = 10000
+
+# Number of bytes read at once when only the header of a file is needed
+HEADER_PREFIX_SIZE = 4096
+
+# Files at least this large are memory-mapped instead of read, smaller ones are cheaper to read in one call
+MMAP_MIN_SIZE = 64 * 1024
+
+# Decoded rows per band in tiled decoding (--tiled), a multiple of the 4 pixel block height
+DEFAULT_BAND_HEIGHT = 256
+
+# Formats which can be written band by band
+BAND_FORMATS = ['tga', 'png']
+
+# Compressed bytes inflated at once in tiled decoding, the output of a piece is limited to 16 times this size
+INFLATE_PIECE_SIZE = 64 * 1024
+
+# PNG file signature and the filter type byte of rows stored as the difference to the row above
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_FILTER_UP = b'\x02'
+
 def print_bytes_data(byte_data):
     for i in range(0, len(byte_data), 4):
         try:
@@ -24,234 +110,1273 @@ def get_data_positions(buffer, data):
     Finds the starting and ending positions of the `data` bytes in the `buffer` bytes.
 
     Args:
-        buffer (bytes): The byte buffer to search.
+        buffer (bytes, mmap or memoryview): The byte buffer to search.
         data (bytes): The bytes to search for in the buffer.
     """
-    found_pos = buffer.find(data)
+    # memoryviews have no find(), a regex search works on bytes, mmap and memoryview alike
+    match = re.search(re.escape(data), buffer)
+    found_pos = match.start() if match else -1
     return (found_pos, found_pos+len(data))
 
 
-def find_zlib_header(bytes_tdat):
+def get_chunk_data(buffer, tag):
+    """
+    Finds the data of the first chunk with the given tag (e.g. b"DATATMAN").
+    The tag is followed by the chunk header (version, size, name length) and the chunk name.
+
+    Args:
+        buffer (bytes): The content of the .rrtex file.
+        tag (bytes): Chunk type and id.
+
+    Returns:
+        tuple: (start, end) positions of the chunk data in `buffer`.
+    """
+    tag_start, tag_end = get_data_positions(buffer, tag)
+    if tag_start < 0 or tag_end + 12 > len(buffer):
+        raise Exception(f"{tag.decode()} chunk not found")
+    _version, size, name_length = struct.unpack_from("<iii", buffer, tag_end)
+    start = tag_end + 12 + name_length
+    return (start, min(start + size, len(buffer)))
+
+
+def find_zlib_header(data, start=0):
     """
-    Find the first zlib header in the data.
+    Find the first zlib header in the data, starting at `start`.
+    The search runs at C speed and works on bytes as well as memoryviews.
     Returns the offset of the first zlib header, or -1 if not found.
     """
-    for i in range(len(bytes_tdat) - 1):
-        if bytes_tdat[i] == 0x78 and bytes_tdat[i+1] in [0x01, 0x5e, 0x9c, 0xda]:
-            return i
-    return -1
+    match = ZLIB_HEADER.search(data, start)
+    return match.start() if match else -1
 
 
-def try_decompress_mipped(bytes_tdat):
+def parse_mip_table(bytes_tman, mip_count):
     """
-    Try multiple decompression strategies for mipped files.
-    Returns: (first_chunk, unused_data) or raises exception if all fail.
+    Reads the mip table which follows the 7 header ints of the TMAN data:
+    a flag byte, the number of mips, the number of chunks of every mip and
+    (size_uncompressed, size_compressed) of every chunk. Mips are listed in the
+    order they are stored in TDAT, smallest mip first.
+
+    The table is only accepted if it accounts exactly for the remaining TMAN bytes,
+    layouts which do not match return None and are handled by scanning.
+
+    Returns:
+        list: for every mip a list of (size_uncompressed, size_compressed) tuples, or None.
     """
-    # Strategy 1: Standard offset 16
-    try:
-        d = zlib.decompressobj()
-        result = d.decompress(bytes_tdat[16:])
-        return (result, d.unused_data)
-    except:
-        pass
+    # older layouts may not have the flag byte
+    for table_start in (29, 28):
+        if len(bytes_tman) < table_start + 4:
+            continue
+        table_mip_count = struct.unpack_from("<i", bytes_tman, table_start)[0]
+        if table_mip_count != mip_count or not 0 < table_mip_count <= 32:
+            continue
+        sizes_start = table_start + 4 + 4 * table_mip_count
+        if len(bytes_tman) < sizes_start:
+            continue
+        chunk_counts = struct.unpack_from(f"<{table_mip_count}i", bytes_tman, table_start + 4)
+        if any(count <= 0 for count in chunk_counts):
+            continue
+        total_chunks = sum(chunk_counts)
+        if sizes_start + 8 * total_chunks != len(bytes_tman):
+            continue
 
-    # Strategy 2: Find first zlib header
-    try:
+        sizes = struct.unpack_from(f"<{2 * total_chunks}i", bytes_tman, sizes_start)
+        mip_chunks = []
+        index = 0
+        for count in chunk_counts:
+            mip_chunks.append([(sizes[i], sizes[i + 1]) for i in range(index, index + 2 * count, 2)])
+            index += 2 * count
+        return mip_chunks
+    return None
+
+
+def parse_rrtex_header(buff):
+    """
+    Parses the TMAN (texture manifest) section of a .rrtex file.
+
+    Args:
+        buff (bytes, mmap or memoryview): The content of the .rrtex file.
+
+    Returns:
+        dict: header fields, the mip table (`mip_chunks`, None if unknown)
+        and the position of the TDAT data.
+    """
+    tman_start, tman_end = get_chunk_data(buff, b"DATATMAN")
+    tdat_start, tdat_end = get_chunk_data(buff, b"DATATDAT")
+    bytes_tman = memoryview(buff)[tman_start:tman_end]
+
+    # Unpack the width and height from the byte data.
+    # version 6 adds the mip table after these fields
+    version, width, height, _uk2, _uk3, texture_compression, mip_count = struct.unpack_from("<iiiiiii", bytes_tman) # unpack to 7 * 32bit ints
+
+    mip_chunks = parse_mip_table(bytes_tman, mip_count)
+    return {
+        'version': version,
+        'width': width,
+        'height': height,
+        'texture_compression': texture_compression,
+        'mip_count': mip_count,
+        'mip_chunks': mip_chunks,
+        'size_uncompressed': sum(u for chunks in mip_chunks for u, _ in chunks) if mip_chunks else None,
+        'size_compressed': sum(c for chunks in mip_chunks for _, c in chunks) if mip_chunks else None,
+        'tdat_start': tdat_start,
+        'tdat_end': tdat_end,
+    }
+
+
+def is_header_complete(buff):
+    """Checks whether a prefix of a .rrtex file contains the whole TMAN section (i.e. the TDAT chunk header)"""
+    tdat_start, tdat_end = get_data_positions(buff, b"DATATDAT")
+    return tdat_start >= 0 and tdat_end + 12 <= len(buff)
+
+
+def read_rrtex_header(file_path_src: str) -> dict:
+    """
+    Parses the header of a .rrtex file without reading (or decompressing) the texture data.
+
+    Args:
+        file_path_src (str): Path of the .rrtex file.
+
+    Returns:
+        dict: the header fields, see `parse_rrtex_header`.
+    """
+    with open(file_path_src, "rb") as f:
+        buff = f.read(HEADER_PREFIX_SIZE)
+        while not is_header_complete(buff):
+            more = f.read(len(buff))
+            if not more:
+                break
+            buff += more
+    return parse_rrtex_header(buff)
+
+
+def read_chunks(view, offset, chunks):
+    """
+    Reads the chunks of one mip level starting at `offset` of the TDAT data. Chunks whose
+    compressed size equals the uncompressed size are stored as is, the others are zlib streams.
+
+    The level is assembled in a buffer preallocated from the uncompressed sizes of the mip table,
+    so every chunk is copied once, however many chunks a large texture is split into.
+
+    Returns:
+        bytearray: the data of the mip level (including the mip header).
+    """
+    level = bytearray(sum(size_uncompressed for size_uncompressed, _ in chunks))
+    position = 0
+    for size_uncompressed, size_compressed in chunks:
+        if offset + size_compressed > len(view):
+            raise Exception("TDAT data is shorter than the mip table")
+        chunk = view[offset:offset + size_compressed]
+        if size_compressed != size_uncompressed:
+            chunk = zlib.decompress(chunk, bufsize=max(size_uncompressed, 1))
+        level[position:position + len(chunk)] = chunk
+        position += len(chunk)
+        offset += size_compressed
+    if position != len(level):
+        # a chunk inflated to less than the table says, keep what was decompressed
+        del level[position:]
+    return level
+
+
+def read_mip_levels(buff, header):
+    """
+    Reads all mip levels using the mip table. The TDAT data starts with a 4 byte int followed by the
+    chunks back to back. Only the first chunk of a mip level contains the mip header.
+
+    Returns:
+        list: the data of every mip level (including the mip header), in storage order.
+    """
+    view = memoryview(buff)[header['tdat_start']:header['tdat_end']]
+    offset = 4
+    levels = []
+    for chunks in header['mip_chunks']:
+        levels.append(read_chunks(view, offset, chunks))
+        offset += sum(size_compressed for _, size_compressed in chunks)
+    return levels
+
+
+def mip_level_offset(header, mip_level):
+    """
+    Returns:
+        tuple: (storage index of a mip level in the mip table, offset of its first chunk in the TDAT data)
+    """
+    mip_chunks = header['mip_chunks']
+    storage_index = len(mip_chunks) - 1 - mip_level
+    return storage_index, 4 + sum(size_compressed for chunks in mip_chunks[:storage_index] for _, size_compressed in chunks)
+
+
+def read_mip_level(buff, header, mip_level):
+    """
+    Reads a single mip level using the mip table, the chunks of the other levels are skipped
+    without being decompressed. Mip levels are stored smallest first.
+
+    Returns:
+        bytes: BC data of the mip level.
+    """
+    storage_index, offset = mip_level_offset(header, mip_level)
+    view = memoryview(buff)[header['tdat_start']:header['tdat_end']]
+    level = read_chunks(view, offset, header['mip_chunks'][storage_index])
+
+    if len(level) >= MIP_HEADER_SIZE and struct.unpack_from('<I', level)[0] == mip_level:
+        return select_mip([level], header, mip_level)
+    # the storage order does not match, look the level up by the mip headers
+    return select_mip(read_mip_levels(buff, header), header, mip_level)
+
+
+def inflate_stream(data, offset):
+    """
+    Decompresses the zlib stream starting at `offset`.
+
+    Returns:
+        tuple: (decompressed bytes, offset of the first byte after the stream)
+    """
+    d = zlib.decompressobj()
+    result = d.decompress(memoryview(data)[offset:])
+    return (result, len(data) - len(d.unused_data))
+
+
+def inflate_first_chunk(bytes_tdat, strategy):
+    """
+    Decompresses the first zlib stream of a mipped file without a mip table, found by one of
+    the OFFSET_STRATEGIES: at offset 16, at the first zlib header, or at offset 0.
+
+    Returns:
+        tuple: (decompressed bytes, offset of the first byte after the stream)
+    """
+    if strategy == 'offset16':
+        return inflate_stream(bytes_tdat, 16)
+    if strategy == 'zlib_scan':
         offset = find_zlib_header(bytes_tdat)
-        if offset >= 0:
-            d = zlib.decompressobj()
-            result = d.decompress(bytes_tdat[offset:])
-            return (result, d.unused_data)
-    except:
-        pass
+        if offset < 0:
+            raise Exception("No zlib header found")
+        return inflate_stream(bytes_tdat, offset)
+    if strategy == 'offset0':
+        return inflate_stream(bytes_tdat, 0)
+    raise Exception(f"Unknown decompression strategy: {strategy}")
+
+
+def get_mip_dimensions(header, mip_level=0):
+    """Width and height of a mip level"""
+    return (max(1, header['width'] >> mip_level), max(1, header['height'] >> mip_level))
+
 
-    # Strategy 3: Offset 0
+def get_mip_size(header, mip_level=0):
+    """Size in bytes of the BC data of a mip level"""
+    texture_compression = header['texture_compression']
+    if texture_compression not in BLOCK_SIZES:
+        raise Exception(f"Unknown texture compression type: {texture_compression}")
+    width_mip, height_mip = get_mip_dimensions(header, mip_level)
+    num_blocks = ((width_mip + 3) // 4) * ((height_mip + 3) // 4)
+    return num_blocks * BLOCK_SIZES[texture_compression]
+
+
+def choose_mip_level(header, mip_level=None, max_dimension=None, available_levels=None):
+    """
+    Chooses the mip level to decode. An explicit `mip_level` wins; with `max_dimension` the smallest
+    level whose larger side is still at least `max_dimension` is used, so it can be scaled down
+    without upscaling artifacts.
+
+    Args:
+        header (dict): the parsed header.
+        mip_level (int): requested mip level.
+        max_dimension (int): requested maximum output size.
+        available_levels (int): number of mip levels which can be read (default: mip count of the header).
+
+    Returns:
+        int: the mip level.
+    """
+    if available_levels is None:
+        available_levels = max(1, header['mip_count'])
+    if mip_level is not None:
+        return max(0, min(mip_level, available_levels - 1))
+    level = 0
+    if max_dimension is not None:
+        while level + 1 < available_levels and max(get_mip_dimensions(header, level + 1)) >= max_dimension:
+            level += 1
+    return level
+
+
+def fit_mip_level(header, mip_level=None, max_dimension=None, available_levels=None):
+    """
+    Chooses the first mip level of a GPU container. Blocks can not be scaled, so with `max_dimension` the
+    largest level whose larger side is at most `max_dimension` is used (the smallest level if none is).
+
+    Returns:
+        int: the mip level.
+    """
+    if available_levels is None:
+        available_levels = max(1, header['mip_count'])
+    level = choose_mip_level(header, mip_level, None, available_levels)
+    if max_dimension is not None:
+        while level + 1 < available_levels and max(get_mip_dimensions(header, level)) > max_dimension:
+            level += 1
+    return level
+
+
+def estimate_decode_memory(header, file_size, mip_level=None, max_dimension=None, band_height=None):
+    """
+    Estimates the peak memory in bytes of converting a file: its content, the decompressed mip level and
+    the decoded pixels, which exist up to three times (decoded BGRA, the image and a resized or encoded copy).
+
+    Args:
+        header (dict): the parsed header.
+        file_size (int): size of the .rrtex file.
+        mip_level (int): requested mip level, see `choose_mip_level`.
+        max_dimension (int): requested maximum output size, see `choose_mip_level`.
+        band_height (int): decoded band by band (see `decode_rrtex_bands`), only one band of the mip level
+            and of the pixels is held at a time.
+
+    Returns:
+        int: the estimated bytes.
+    """
+    level = choose_mip_level(header, mip_level, max_dimension)
+    width, height = get_mip_dimensions(header, level)
+    block_data_size = get_mip_size(header, level) if header['texture_compression'] in BLOCK_SIZES else width * height
+    if band_height is not None and header['mip_chunks'] is not None:
+        # the whole level is only inflated at once for files without a mip table
+        band_height = min(band_height, height)
+        block_data_size = block_data_size * band_height // height + 16 * INFLATE_PIECE_SIZE
+        height = band_height
+    elif band_height is not None:
+        height = min(band_height, height)
+    return file_size + MIP_HEADER_SIZE + block_data_size + 3 * width * height * 4
+
+
+def select_mip(levels, header, mip_level=0):
+    """
+    Picks a mip level from decompressed mip levels, identified by its mip header.
+    Falls back to the largest level if no header matches.
+
+    Returns:
+        memoryview or bytearray: BC data of the mip level (a view of the level, not a copy),
+        padded with zeros if it is too short.
+    """
+    mip_size = get_mip_size(header, mip_level)
+    mip_width, mip_height = get_mip_dimensions(header, mip_level)
+    mip_chunk = None
+    for level in levels:
+        if len(level) >= MIP_HEADER_SIZE:
+            chunk_level, chunk_width, chunk_height = struct.unpack_from('<III', level)
+            if chunk_level == mip_level and chunk_width == mip_width and chunk_height == mip_height:
+                mip_chunk = level
+                break
+    if mip_chunk is None:
+        if mip_level != 0:
+            raise Exception(f"Mip level {mip_level} not found")
+        mip_chunk = max(levels, key=len)
+
+    decompressed_data = memoryview(mip_chunk)[MIP_HEADER_SIZE:MIP_HEADER_SIZE + mip_size]
+    if len(decompressed_data) < mip_size:
+        padded = bytearray(mip_size)
+        padded[:len(decompressed_data)] = decompressed_data
+        return padded
+    return decompressed_data
+
+
+def scan_mipped(buff, header, mip_level=0, strategy='offset16'):
+    """
+    Fallback for mipped files without a readable mip table: finds the zlib streams
+    by scanning for their headers and picks the requested mip level.
+    `strategy` locates the first stream, see `inflate_first_chunk`.
+    """
+    bytes_tdat = memoryview(buff)[header['tdat_start'] - 12:header['tdat_end']]
+    first_chunk, offset = inflate_first_chunk(bytes_tdat, strategy)
+
+    # Process the first chunk - it might have a header
+    # Try to detect if there's a 16-byte header
+    decompressed_chunks = [first_chunk]
+    if len(first_chunk) >= 16:
+        # Check if first 12 bytes look like a mip header (mip_level, width, height)
+        potential_mip_level, potential_width, potential_height = struct.unpack_from('<III', first_chunk)
+        # If values are reasonable, assume it's a header
+        if not (potential_mip_level < 20 and potential_width <= 4096 and potential_height <= 4096):
+            # no header, keep the chunk as mip data
+            decompressed_chunks = [b'\x00' * MIP_HEADER_SIZE + first_chunk]
+
+    # Process remaining chunks
+    chunk_count = 1
+    max_chunks = 20  # Safety limit
+
+    while offset < len(bytes_tdat) and chunk_count < max_chunks:
+        # Find the next zlib header
+        offset = find_zlib_header(bytes_tdat, offset)
+        if offset < 0:
+            break
+        try:
+            chunk, offset = inflate_stream(bytes_tdat, offset)
+        except Exception:
+            break
+        decompressed_chunks.append(chunk)
+        chunk_count += 1
+
+    return select_mip(decompressed_chunks, header, mip_level)
+
+
+def scan_non_mipped(buff, header):
+    """
+    Fallback for non-mipped files without a readable mip table: a single mip level split
+    into consecutive zlib streams, only the first one starts with the mip header.
+    """
+    bytes_tdat = memoryview(buff)[header['tdat_start'] - 12:header['tdat_end']]
+    # get the first decompressed chunk
+    chunk, offset = inflate_stream(bytes_tdat, 16)    # magic shift by 16
+    decompressed_chunks = [memoryview(chunk)[16:]]      # another magic shift by 16
+
+    # while there are still unused data (not decompressed), try decompressing them
     try:
-        d = zlib.decompressobj()
-        result = d.decompress(bytes_tdat)
-        return (result, d.unused_data)
+        while offset < len(bytes_tdat):
+            chunk, offset = inflate_stream(bytes_tdat, offset)
+            decompressed_chunks.append(chunk)
     except:
         pass
 
-    raise Exception("All decompression strategies failed for mipped file")
+    # assemble decompressed_data from decompressed_chunks
+    return b''.join(decompressed_chunks)
+
+
+def is_mipped(header, file_name=""):
+    """Whether the texture has mip levels: by the mip count of the header, the file name is only a hint for old layouts"""
+    return header['mip_count'] > 1 or '_mipped.' in os.path.basename(file_name).lower()
+
+
+def layout_signature(header, file_name=""):
+    """
+    Classifies the layout of the TDAT data by the TMAN header, files with the same signature
+    are decompressed the same way.
+
+    Returns:
+        str: e.g. 'v6/mipped/table' or 'v5/single/scan'.
+    """
+    return (f"v{header['version']}/{'mipped' if is_mipped(header, file_name) else 'single'}/"
+            f"{'scan' if header['mip_chunks'] is None else 'table'}")
+
+
+class StrategyCache:
+    """
+    Remembers per layout signature which offset strategy found the first zlib stream, so the next
+    file of that layout tries it first instead of failing through the others again.
+    Learned during a run (per process) and shared by the threads of the process.
+    Files which only decompressed after other strategies failed are kept until `pop_fallback`.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.winners = {}
+        self.fallbacks = {}
+
+    def order(self, signature, strategies):
+        """The strategies with the last winner of the layout first"""
+        with self.lock:
+            winner = self.winners.get(signature)
+        if winner not in strategies:
+            return list(strategies)
+        return [winner] + [strategy for strategy in strategies if strategy != winner]
+
+    def record(self, signature, strategy, file_name, failed):
+        """Records the strategy which worked for a file, and the (strategy, error) attempts which failed before it"""
+        with self.lock:
+            if strategy in OFFSET_STRATEGIES:
+                self.winners[signature] = strategy
+            if failed:
+                if len(self.fallbacks) >= MAX_FALLBACKS:
+                    del self.fallbacks[next(iter(self.fallbacks))]
+                self.fallbacks[file_name] = {
+                    'layout': signature,
+                    'strategy': strategy,
+                    'failed': [{'strategy': name, 'error': error} for name, error in failed],
+                }
+
+    def pop_fallback(self, file_name):
+        """
+        Returns:
+            dict: layout, strategy and failed attempts of the last decompression of the file, None if the first strategy worked.
+        """
+        with self.lock:
+            return self.fallbacks.pop(file_name, None)
+
+    def get_winners(self):
+        with self.lock:
+            return self.winners.copy()
+
+
+# Learned strategies of this process
+STRATEGY_CACHE = StrategyCache()
+
+
+def read_level_data(buff, header, strategy, mip_level=0):
+    """
+    Decompresses the BC data of a mip level with one strategy: 'mip_table', one of the OFFSET_STRATEGIES,
+    or 'single' (a texture without mip levels, always level 0).
+
+    Returns:
+        tuple: (mip level read, BC data)
+    """
+    if strategy == 'mip_table':
+        return mip_level, read_mip_level(buff, header, mip_level)
+    if strategy == 'single':
+        # the decoders read the full level size, pad it like select_mip does
+        data = scan_non_mipped(buff, header)
+        mip_size = get_mip_size(header, 0)
+        return 0, data[:mip_size] + bytes(max(0, mip_size - len(data)))
+    return mip_level, scan_mipped(buff, header, mip_level, strategy)
+
+
+def decompress_level(buff, header, file_name="", mip_level=0, strategy_cache=None, scaled=False):
+    """
+    Decompresses the BC data of a mip level, trying the strategies until one works. The mip table is
+    exact and always tried first. Without one, mipped layouts try the offset strategies (last winner of
+    the layout first) and then 'single'; non-mipped layouts the other way around. 'single' always reads
+    level 0, so it is only tried for level 0 or when the caller scales the image down anyway.
+
+    Args:
+        buff (bytes, mmap or memoryview): The content of the .rrtex file.
+        header (dict): the parsed header.
+        file_name (str): Name of the file, fallbacks are recorded under it.
+        mip_level (int): Mip level to read.
+        strategy_cache (StrategyCache): learned strategies (default: STRATEGY_CACHE).
+        scaled (bool): The level was chosen for a maximum size and the image is scaled down to it,
+            level 0 may be read instead of a lower level the scan can not find.
+
+    Returns:
+        tuple: (mip level read, BC data, strategy which worked)
+    """
+    cache = STRATEGY_CACHE if strategy_cache is None else strategy_cache
+    signature = layout_signature(header, file_name)
+    offsets = cache.order(signature, OFFSET_STRATEGIES)
+    strategies = offsets + ['single'] if is_mipped(header, file_name) else ['single'] + offsets
+    if mip_level != 0 and not scaled:
+        # an explicitly requested level is never replaced by level 0
+        strategies.remove('single')
+    if header['mip_chunks'] is not None:
+        strategies.insert(0, 'mip_table')
+
+    failed = []
+    for strategy in strategies:
+        try:
+            level, data = read_level_data(buff, header, strategy, mip_level)
+        except Exception as e:
+            failed.append((strategy, str(e)))
+            continue
+        cache.record(signature, strategy, file_name, failed)
+        return level, data, strategy
+    raise Exception(f"All decompression strategies failed ({signature}): "
+                    + "; ".join(f"{strategy}: {error}" for strategy, error in failed))
+
+
+def decode_block_data(decompressed_data, width, height, texture_compression):
+    """
+    Decodes BC compressed data with the correct texture compression.
+
+    Returns:
+        bytes: the decoded pixels in BGRA order.
+    """
+    if texture_compression == 28:
+        return texture2ddecoder.decode_bc7(decompressed_data, width, height)
+    elif texture_compression == 22:
+        return texture2ddecoder.decode_bc3(decompressed_data, width, height)
+    elif texture_compression == 19:
+        return texture2ddecoder.decode_bc1(decompressed_data, width, height) # Bc1
+    elif texture_compression == 18:
+        return texture2ddecoder.decode_bc1(decompressed_data, width, height) # Bc1 with alpha?
+    else:
+        # unsupported 2(R)
+        raise Exception(f"Unknown texture compression type: {texture_compression}")
+
+
+def new_profile():
+    """Creates the dict the stage timings (seconds), byte counts and texture details of one file are collected in"""
+    return {'stages': {}, 'bytes_read': 0, 'bytes_written': 0}
+
+
+def lap(profile, stage, start):
+    """Adds the time since `start` to a stage of the profile and returns the current time"""
+    now = time.perf_counter()
+    profile['stages'][stage] = profile['stages'].get(stage, 0.0) + now - start
+    return now
+
+
+def decode_rrtex_pixels(buff, file_name: str = "", mip_level: int = None, max_dimension: int = None,
+                        profile: dict = None) -> tuple:
+    """
+    Decodes a mip level of a .rrtex file to BGRA pixels, without creating an image.
+    See `decode_rrtex_bytes` for the arguments, the mip level is chosen the same way but not scaled.
+
+    Returns:
+        tuple: (width, height, pixels in BGRA order, top row first)
+    """
+    try:
+        if profile is not None:
+            t = time.perf_counter()
+        header = parse_rrtex_header(buff)
+        if profile is not None:
+            t = lap(profile, 'parse', t)
+
+        # the mip table lists as many levels as the header, without one the levels are found by scanning
+        level = choose_mip_level(header, mip_level, max_dimension)
+        level, decompressed_data, strategy = decompress_level(buff, header, file_name, level, scaled=mip_level is None)
+
+        if profile is not None:
+            t = lap(profile, 'inflate', t)
+
+        # decode with correct texture compression. Data are decoded to BGRA
+        width, height = get_mip_dimensions(header, level)
+        decoded_data = decode_block_data(decompressed_data, width, height, header['texture_compression'])
+        if profile is not None:
+            lap(profile, 'decode', t)
+            profile.update(width=header['width'], height=header['height'], mip_level=level,
+                           texture_compression=header['texture_compression'], strategy=strategy)
+        return width, height, decoded_data
+
+    except Exception as e:
+        # library callers report the error themselves, the CLI lists it with the failed file
+        raise Exception(f"convert_rrtex failed.\nException: {e}") from e
+
 
+def pixels_to_image(width: int, height: int, pixels) -> Image.Image:
+    """Creates an RGBA image from decoded BGRA pixels"""
+    return Image.frombytes("RGBA", (width, height), pixels, 'raw', ("BGRA"))
+
+
+def decode_rrtex_bytes(buff, file_name: str = "", mip_level: int = None, max_dimension: int = None,
+                       profile: dict = None) -> Image.Image:
+    """
+    Decodes a mip level of a .rrtex file already loaded in memory. Only the chunks of that mip level are decompressed.
+
+    Args:
+        buff (bytes, mmap or memoryview): The content of the .rrtex file.
+        file_name (str): Name of the file, a hint for mipped files without a mip table
+            and the name decompression fallbacks are recorded under (see `StrategyCache`).
+        mip_level (int): Mip level to decode (default: 0, the highest resolution).
+        max_dimension (int): Scale the image down so its larger side is at most this many pixels,
+            decoding the smallest mip level which is still large enough.
+        profile (dict): Optional dict created by `new_profile`. The time spent in every stage
+            (parse, inflate, decode, resize) and the texture details are added to it.
 
-def convert_rrtex(file_path_src: str, file_path_dest: str) -> None:
+    Returns:
+        Image.Image: The decoded RGBA image.
+    """
+    width, height, decoded_data = decode_rrtex_pixels(buff, file_name, mip_level, max_dimension, profile)
+    if profile is None:
+        return resize_image(pixels_to_image(width, height, decoded_data), max_dimension)
+
+    t = time.perf_counter()
+    dec_img = pixels_to_image(width, height, decoded_data)
+    t = lap(profile, 'decode', t)
+    dec_img = resize_image(dec_img, max_dimension)
+    lap(profile, 'resize', t)
+    return dec_img
+
+
+@contextmanager
+def map_file(file_path_src: str):
+    """
+    Opens a .rrtex file for decoding. Large files are memory-mapped, so the header is parsed and the
+    chunks are inflated straight from the page cache without reading the file into a bytes object first.
+
+    Yields:
+        mmap or bytes: The content of the file, only valid inside the with block.
+    """
     with open(file_path_src, "rb") as f:
-        # Read the entire file into a byte buffer
-        buff = f.read()  
-        # find the start and end of "DATATMAN" and "DATATDAT" sections
-        tman_start, tman_end = get_data_positions(buff, b"DATATMAN") 
-        tdat_start, tdat_end = get_data_positions(buff, b"DATATDAT")
-        # get the tman and tdat bytes
-        bytes_tman = buff[tman_end+12 : tdat_start]
-        bytes_tdat = buff[tdat_end:]
-
-        # Unpack the width and height from the byte data.
-        
-        # The new struct fields in version 6 can be ignored as the real issue
-        # happens when the zlib decompress step tries with the unused data with some files (no idea why).
-        
-        tman_header = struct.unpack("<iiiiiiiiiii", bytes_tman[:44]) # unpack to 11 * 32bit ints
-        uk1, width, height, _uk2, _uk3, texture_compression, mip_count, _uk4, mip_texture_count, size_uncompressed, size_compressed = tman_header
-    
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_MIN_SIZE:
+            # Read the entire file into a byte buffer
+            yield f.read()
+            return
+        buff = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield buff
+        finally:
+            try:
+                buff.close()
+            except BufferError:
+                # views of the mapping are still referenced (e.g. by an exception traceback),
+                # it is unmapped when they are released
+                pass
+
+
+def decode_rrtex(file_path_src: str, mip_level: int = None, max_dimension: int = None,
+                 profile: dict = None) -> Image.Image:
+    """
+    Reads a .rrtex file and decodes a mip level (default: the highest resolution).
+
+    Args:
+        file_path_src (str): Path of the .rrtex file.
+        mip_level (int): Mip level to decode.
+        max_dimension (int): Maximum size of the larger side of the image, see `decode_rrtex_bytes`.
+        profile (dict): Optional profile, see `decode_rrtex_bytes`. The read stage is added to it.
+
+    Returns:
+        Image.Image: The decoded RGBA image.
+    """
+    if profile is not None:
+        t = time.perf_counter()
+    with map_file(file_path_src) as buff:
+        if profile is not None:
+            lap(profile, 'read', t)
+            profile['bytes_read'] += len(buff)
+        return decode_rrtex_bytes(buff, file_path_src, mip_level, max_dimension, profile)
+
+
+def source_name(src_file) -> str:
+    """Name a .rrtex file path or .sga archive entry is decoded under, see `StrategyCache`"""
+    return src_file if isinstance(src_file, str) else src_file.path
+
+
+def open_source_buffer(src_file):
+    """
+    Opens the content of a .rrtex file path (memory-mapped if it is large, see `map_file`) or .sga archive entry.
+
+    Returns:
+        context manager: yields the content, only valid inside the with block.
+    """
+    return map_file(src_file) if isinstance(src_file, str) else nullcontext(src_file.read())
+
+
+def decode_source(src_file, decode_options: dict = None, profile: dict = None, pixels: bool = False):
+    """
+    Decodes a .rrtex file path or .sga archive entry (see sga_reader.SgaEntry).
+
+    Args:
+        src_file (str or SgaEntry): The .rrtex source file.
+        decode_options (dict): Arguments of the decoder (mip_level, max_dimension), see `decode_rrtex_bytes`.
+        profile (dict): Optional profile, the read stage and the stages of the decoder are added to it.
+        pixels (bool): Return the decoded BGRA pixels instead of an image, see `decode_rrtex_pixels`.
+
+    Returns:
+        Image.Image or tuple: The decoded RGBA image, or (width, height, pixels).
+    """
+    decode = decode_rrtex_pixels if pixels else decode_rrtex_bytes
+    if profile is not None:
+        t = time.perf_counter()
+    with open_source_buffer(src_file) as buff:
+        if profile is not None:
+            lap(profile, 'read', t)
+            profile['bytes_read'] += len(buff)
+        return decode(buff, source_name(src_file), profile=profile, **(decode_options or {}))
+
+
+def read_block_levels(buff, file_name: str = "", mip_level: int = None, max_dimension: int = None,
+                      mips: bool = False, profile: dict = None) -> tuple:
+    """
+    Decompresses the BC data of a .rrtex file without decoding it, for GPU containers.
+
+    Args:
+        buff (bytes, mmap or memoryview): The content of the .rrtex file.
+        file_name (str): Name of the file, see `decode_rrtex_bytes`.
+        mip_level (int): First mip level (default: 0, the highest resolution).
+        max_dimension (int): Start at the largest mip level whose larger side is at most this many pixels.
+        mips (bool): Also read the smaller mip levels, down to the smallest one stored in the file.
+        profile (dict): Optional profile, the parse and inflate stages are added to it.
+
+    Returns:
+        tuple: (header, first mip level, list of the BC data of the mip levels, largest first)
+    """
+    if profile is not None:
+        t = time.perf_counter()
+    header = parse_rrtex_header(buff)
+    if profile is not None:
+        t = lap(profile, 'parse', t)
+
+    if header['mip_chunks'] is not None:
+        available_levels = len(header['mip_chunks'])
+        first_level = fit_mip_level(header, mip_level, max_dimension, available_levels)
+        if mips and first_level + 1 < available_levels:
+            stored_levels = read_mip_levels(buff, header)
+            levels = [select_mip(stored_levels, header, level) for level in range(first_level, available_levels)]
+        else:
+            levels = [read_mip_level(buff, header, first_level)]
+    else:
+        first_level, data, strategy = decompress_level(buff, header, file_name, fit_mip_level(header, mip_level, max_dimension))
+        levels = [data]
+        # a texture read as 'single' has no smaller levels
+        last_level = max(1, header['mip_count']) if mips and strategy != 'single' else first_level + 1
+        for level in range(first_level + 1, last_level):
+            try:
+                levels.append(scan_mipped(buff, header, level, strategy))
+            except Exception:
+                # the scan found fewer levels than the header lists
+                break
+
+    if profile is not None:
+        lap(profile, 'inflate', t)
+        profile.update(width=header['width'], height=header['height'], mip_level=first_level,
+                       texture_compression=header['texture_compression'])
+    return header, first_level, levels
+
+
+def pack_rrtex_bytes(buff, container_format: str, file_name: str = "", mip_level: int = None, max_dimension: int = None,
+                     mips: bool = False, profile: dict = None) -> bytes:
+    """
+    Wraps the BC data of a .rrtex file in a GPU container (dds, ktx2), nothing is decoded.
+    See `read_block_levels` for the arguments, the encode stage is added to the profile.
+
+    Returns:
+        bytes: The container file content.
+    """
+    header, first_level, levels = read_block_levels(buff, file_name, mip_level, max_dimension, mips, profile)
+    if profile is not None:
+        t = time.perf_counter()
+    width, height = get_mip_dimensions(header, first_level)
+    container = pack_texture(container_format, COMPRESSION_NAMES.get(header['texture_compression']), width, height, levels)
+    if profile is not None:
+        lap(profile, 'encode', t)
+    return container
+
+
+def resize_image(dec_img: Image.Image, max_dimension: int = None) -> Image.Image:
+    """
+    Scales an image down (keeping its aspect ratio) so its larger side is at most `max_dimension` pixels.
+    Images which are already small enough are returned as they are.
+    """
+    width, height = dec_img.size
+    if max_dimension is None or max(width, height) <= max_dimension:
+        return dec_img
+    scale = max_dimension / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return dec_img.resize(size, Image.LANCZOS)
+
+
+def save_image(dec_img: Image.Image, file_path_dest, preset: str = DEFAULT_PRESET) -> None:
+    """
+    Saves a decoded image with format-specific options. The format is taken from the
+    extension of `file_path_dest`.
+
+    Args:
+        dec_img (Image.Image): The decoded image.
+        file_path_dest (str): Path of the output file.
+        preset (str): Encoder preset, see ENCODER_PRESETS.
+    """
+    file_ext = os.path.splitext(file_path_dest)[1].lower()
+    options = ENCODER_PRESETS[preset].get(file_ext[1:], {})
+    if file_ext == '.webp':
+        # Save as WebP with quality setting, preserving transparency
+        dec_img.save(file_path_dest, 'WEBP', **options)
+    else:
+        # For TGA, PNG and other formats, Pillow picks the format from the extension
+        dec_img.save(file_path_dest, **options)
+
+
+def encode_image(dec_img: Image.Image, image_format: str, preset: str = DEFAULT_PRESET) -> bytes:
+    """
+    Encodes a decoded image in memory, using the same options as `save_image`.
+
+    Args:
+        dec_img (Image.Image): The decoded image.
+        image_format (str): Output format (tga, png, webp).
+        preset (str): Encoder preset, see ENCODER_PRESETS.
+
+    Returns:
+        bytes: The encoded file content.
+    """
+    out = io.BytesIO()
+    dec_img.save(out, Image.registered_extensions()['.' + image_format], **ENCODER_PRESETS[preset].get(image_format, {}))
+    return out.getvalue()
+
+
+def tga_header(width: int, height: int) -> bytes:
+    """18 byte header of an uncompressed 32 bit TGA file, stored top row first (descriptor 0x28: 8 alpha bits, top-left origin)"""
+    return struct.pack('<BBBHHBHHHHBB', 0, 0, 2, 0, 0, 0, 0, 0, width, height, 32, 0x28)
+
+
+def encode_tga_pixels(width: int, height: int, pixels) -> bytes:
+    """
+    Encodes decoded BGRA pixels as an uncompressed TGA file. TGA stores BGRA as well, so the pixels are
+    written as they come from the BC decoder, without creating an image.
+
+    Returns:
+        bytes: The TGA file content.
+    """
+    return b''.join((tga_header(width, height), pixels, TGA_FOOTER))
+
+
+def save_tga_pixels(width: int, height: int, pixels, file_path_dest: str) -> None:
+    """Writes decoded BGRA pixels to an uncompressed TGA file, see `encode_tga_pixels`"""
+    with open(file_path_dest, 'wb') as f:
+        f.write(tga_header(width, height))
+        f.write(pixels)
+        f.write(TGA_FOOTER)
+
+
+def iter_chunk_pieces(chunk, size_uncompressed):
+    """
+    Decompresses one chunk of the mip table piece by piece, see `read_chunks`.
+
+    Yields:
+        bytes: the decompressed data, at most 16 * INFLATE_PIECE_SIZE bytes at a time.
+    """
+    if len(chunk) == size_uncompressed:
+        yield chunk
+        return
+    d = zlib.decompressobj()
+    for start in range(0, len(chunk), INFLATE_PIECE_SIZE):
+        data = chunk[start:start + INFLATE_PIECE_SIZE]
+        while data:
+            piece = d.decompress(data, 16 * INFLATE_PIECE_SIZE)
+            if piece:
+                yield piece
+            data = d.unconsumed_tail
+        if d.eof:
+            break
+    piece = d.flush()
+    if piece:
+        yield piece
+
+
+def iter_level_pieces(buff, header, mip_level):
+    """
+    Decompresses a single mip level using the mip table piece by piece, see `read_mip_level`.
+
+    Yields:
+        bytes: the data of the mip level (including the mip header) in pieces.
+    """
+    storage_index, offset = mip_level_offset(header, mip_level)
+    view = memoryview(buff)[header['tdat_start']:header['tdat_end']]
+    for size_uncompressed, size_compressed in header['mip_chunks'][storage_index]:
+        if offset + size_compressed > len(view):
+            raise Exception("TDAT data is shorter than the mip table")
+        yield from iter_chunk_pieces(view[offset:offset + size_compressed], size_uncompressed)
+        offset += size_compressed
+
+
+def split_bands(pieces, band_sizes):
+    """
+    Regroups the pieces of the BC data of a mip level into bands of `band_sizes` bytes.
+    Data missing at the end is padded with zeros like `select_mip` does, data beyond the last band is ignored.
+
+    Yields:
+        bytes: the BC data of every band.
+    """
+    pending = bytearray()
+    sizes = iter(band_sizes)
+    band_size = next(sizes, None)
+    for piece in pieces:
+        pending += piece
+        while band_size is not None and len(pending) >= band_size:
+            yield bytes(pending[:band_size])
+            del pending[:band_size]
+            band_size = next(sizes, None)
+        if band_size is None:
+            return
+    while band_size is not None:
+        yield bytes(pending[:band_size]) + bytes(max(0, band_size - len(pending)))
+        del pending[:band_size]
+        band_size = next(sizes, None)
+
+
+def band_sizes(header, mip_level, band_height):
+    """Sizes in bytes of the BC data of the bands of a mip level, every band is `band_height` rows but the last one"""
+    width, height = get_mip_dimensions(header, mip_level)
+    row_size = ((width + 3) // 4) * BLOCK_SIZES[header['texture_compression']]
+    return [row_size * ((min(band_height, height - y) + 3) // 4) for y in range(0, height, band_height)]
+
+
+def open_block_bands(buff, header, file_name, mip_level, band_height):
+    """
+    Decompresses the BC data of a mip level band by band. With a mip table the chunks are inflated while the
+    bands are read, so only a band of the level is held at a time; files without a mip table (or whose first
+    chunk is not the requested level) are decompressed at once by `decompress_level` and then split.
+
+    Returns:
+        tuple: (mip level read, strategy which worked, generator of the BC data of every band of `band_height` rows)
+    """
+    if header['mip_chunks'] is not None and header['texture_compression'] in BLOCK_SIZES:
+        try:
+            pieces = iter_level_pieces(buff, header, mip_level)
+            head = bytearray()
+            for piece in pieces:
+                head += piece
+                if len(head) >= MIP_HEADER_SIZE:
+                    break
+            found = struct.unpack_from('<III', head) if len(head) >= MIP_HEADER_SIZE else None
+        except Exception:
+            found = None
+        if found == (mip_level, *get_mip_dimensions(header, mip_level)):
+            chunks = itertools.chain([bytes(head[MIP_HEADER_SIZE:])], pieces)
+            return mip_level, 'mip_table', split_bands(chunks, band_sizes(header, mip_level, band_height))
+    level, data, strategy = decompress_level(buff, header, file_name, mip_level)
+    return level, strategy, split_bands([data], band_sizes(header, level, band_height))
+
+
+def decode_rrtex_bands(buff, file_name: str = "", mip_level: int = None, band_height: int = DEFAULT_BAND_HEIGHT,
+                       profile: dict = None) -> tuple:
+    """
+    Decodes a mip level of a .rrtex file in bands of rows instead of at once, for textures too large to
+    hold decoded (e.g. minimaps and terrain). The BC data is inflated and decoded one band at a time, so
+    the memory needed depends on the width and `band_height`, not on the height of the texture.
+
+    Args:
+        buff (bytes, mmap or memoryview): The content of the .rrtex file.
+        file_name (str): Name of the file, see `decode_rrtex_bytes`.
+        mip_level (int): Mip level to decode (default: 0, the highest resolution).
+        band_height (int): Rows per band, a multiple of 4 (the height of a block).
+        profile (dict): Optional profile, the parse, inflate and decode stages are added to it
+            while the bands are decoded.
+
+    Returns:
+        tuple: (width, height, generator of (rows, pixels in BGRA order) of every band, top band first)
+    """
+    if band_height <= 0 or band_height % 4:
+        raise ValueError(f"The band height must be a positive multiple of 4, got {band_height}")
+    if profile is not None:
+        t = time.perf_counter()
+    header = parse_rrtex_header(buff)
+    if header['texture_compression'] not in BLOCK_SIZES:
+        raise Exception(f"Unknown texture compression type: {header['texture_compression']}")
+    if profile is not None:
+        t = lap(profile, 'parse', t)
+    level, strategy, blocks = open_block_bands(buff, header, file_name, choose_mip_level(header, mip_level), band_height)
+    width, height = get_mip_dimensions(header, level)
+    if profile is not None:
+        lap(profile, 'inflate', t)
+        profile.update(width=header['width'], height=header['height'], mip_level=level,
+                       texture_compression=header['texture_compression'], strategy=strategy)
+
+    def bands():
+        t = time.perf_counter()
+        for y, data in zip(range(0, height, band_height), blocks):
+            rows = min(band_height, height - y)
+            if profile is not None:
+                t = lap(profile, 'inflate', t)
+            pixels = decode_block_data(data, width, rows, header['texture_compression'])
+            if profile is not None:
+                lap(profile, 'decode', t)
+            yield rows, pixels
+            t = time.perf_counter()
+
+    return width, height, bands()
+
+
+class TgaBandWriter:
+    """Writes an uncompressed TGA file band by band, the BGRA bands are stored as they are (see `encode_tga_pixels`)"""
+    def __init__(self, f, width: int, height: int):
+        self.f = f
+        f.write(tga_header(width, height))
+
+    def write(self, rows: int, pixels) -> None:
+        self.f.write(pixels)
+
+    def close(self) -> None:
+        self.f.write(TGA_FOOTER)
+
+
+class PngBandWriter:
+    """
+    Writes an RGBA PNG file band by band. All rows go through one zlib stream and are stored with the Up
+    filter (the difference to the row above, computed by Pillow), so only the last row of a band is kept.
+    """
+    def __init__(self, f, width: int, height: int, compress_level: int = 6):
+        self.f = f
+        self.width = width
+        self.stride = width * 4
+        self.previous_row = bytes(self.stride)
+        self.compressor = zlib.compressobj(compress_level)
+        f.write(PNG_SIGNATURE)
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+    def write(self, rows: int, pixels) -> None:
+        rgba = pixels_to_image(self.width, rows, pixels).tobytes()
+        current = Image.frombytes('L', (self.stride, rows), rgba)
+        above = Image.frombytes('L', (self.stride, rows), self.previous_row + rgba[:-self.stride])
+        filtered = ImageChops.subtract_modulo(current, above).tobytes()
+        self.previous_row = rgba[-self.stride:]
+        data = b''.join(PNG_FILTER_UP + filtered[i:i + self.stride] for i in range(0, len(filtered), self.stride))
+        self._chunk(b'IDAT', self.compressor.compress(data))
+
+    def close(self) -> None:
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+
+    def _chunk(self, kind, data):
+        if kind == b'IDAT' and not data:
+            return
+        self.f.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+
+def band_writer(image_format: str, f, width: int, height: int, preset: str = DEFAULT_PRESET):
+    """
+    Creates the writer of an output format which can be written band by band (BAND_FORMATS). TGA is written
+    uncompressed whatever the preset, PNG uses the compression level of the preset.
+    """
+    if image_format == 'tga':
+        return TgaBandWriter(f, width, height)
+    if image_format == 'png':
+        return PngBandWriter(f, width, height, ENCODER_PRESETS[preset]['png'].get('compress_level', 6))
+    raise Exception(f"Format {image_format} can not be written band by band, supported: {', '.join(BAND_FORMATS)}")
+
+
+def write_bands(width: int, height: int, bands, targets, preset: str = DEFAULT_PRESET, profile: dict = None) -> None:
+    """
+    Streams decoded bands (see `decode_rrtex_bands`) to one or more outputs, every band is decoded once.
+
+    Args:
+        width (int): width of the image.
+        height (int): height of the image.
+        bands (iterable): (rows, BGRA pixels) of every band, top band first.
+        targets (list): (image format, binary file object) of every output.
+        preset (str): Encoder preset, see `band_writer`.
+        profile (dict): Optional profile, the time spent in the writers is added to the encode stage.
+    """
+    writers = [band_writer(image_format, f, width, height, preset) for image_format, f in targets]
+    for rows, pixels in bands:
+        if profile is not None:
+            t = time.perf_counter()
+        for writer in writers:
+            writer.write(rows, pixels)
+        if profile is not None:
+            lap(profile, 'encode', t)
+    for writer in writers:
+        writer.close()
+
+
+def convert_rrtex_tiled(file_path_src: str, file_path_dest: str, mip_level: int = None,
+                        band_height: int = DEFAULT_BAND_HEIGHT, preset: str = DEFAULT_PRESET) -> None:
+    """Converts a .rrtex file to TGA or PNG (by the extension of `file_path_dest`) band by band, see `decode_rrtex_bands`"""
+    with map_file(file_path_src) as buff:
+        width, height, bands = decode_rrtex_bands(buff, file_path_src, mip_level, band_height)
+        with open(file_path_dest, 'wb') as f:
+            write_bands(width, height, bands, [(os.path.splitext(file_path_dest)[1].lower()[1:], f)], preset)
+
+
+def convert_rrtex(file_path_src: str, file_path_dest: str, mip_level: int = None, max_dimension: int = None) -> None:
+    with map_file(file_path_src) as buff:
+        dec_img = decode_rrtex_bytes(buff, file_path_src, mip_level, max_dimension)
+    try:
+        save_image(dec_img, file_path_dest)
+    except Exception as e:
+        error = f"convert_rrtex failed.\nException: {e}"
+        print(error)
+        raise Exception(error)
+
+
+def convert_rrtex_bytes(buff, file_path_dest: str, file_name: str = "", mip_level: int = None, max_dimension: int = None) -> None:
+    """
+    Converts a .rrtex file already loaded in memory (e.g. read from a .sga archive).
+
+    Args:
+        buff (bytes): The content of the .rrtex file.
+        file_path_dest (str): Path of the output file, its extension selects the format.
+        file_name (str): Name of the source file, used to detect mipped files without a mip table.
+        mip_level (int): Mip level to convert (default: 0, the highest resolution).
+        max_dimension (int): Maximum size of the larger side of the image, see `decode_rrtex_bytes`.
+    """
+    dec_img = decode_rrtex_bytes(buff, file_name, mip_level, max_dimension)
+    try:
+        save_image(dec_img, file_path_dest)
+    except Exception as e:
+        error = f"convert_rrtex failed.\nException: {e}"
+        print(error)
+        raise Exception(error)
+
+class RrtexTexture:
+    """
+    A .rrtex texture for use as a library, without writing files. The header is parsed when the
+    texture is created, the pixels are only decoded when they are asked for and cached on the object.
+
+    Example:
+        texture = RrtexTexture(data)             # bytes, bytearray, memoryview, a path or a binary file object
+        print(texture.width, texture.height, texture.compression)
+        image = texture.to_image()               # Pillow RGBA image
+        icon = texture.to_image(max_dimension=64)
+        pixels = texture.to_numpy()              # (height, width, 4) uint8 array, needs numpy
+        ktx2 = texture.pack('ktx2', mips=True)   # BC data in a KTX2 container, nothing is decoded
+    """
+    def __init__(self, source, file_name: str = ""):
+        """
+        Args:
+            source (bytes, bytearray, memoryview, mmap, str, os.PathLike or file object): The content of the
+                .rrtex file, its path, or an open binary file it is read from.
+            file_name (str): Name of the file, see `decode_rrtex_bytes`
+                (default: the path, or the name of the file object).
+        """
+        if isinstance(source, (str, os.PathLike)):
+            file_name = file_name or os.fspath(source)
+            with open(source, "rb") as f:
+                source = f.read()
+        elif hasattr(source, "read"):
+            file_name = file_name or getattr(source, "name", "")
+            source = source.read()
+        self.data = source
+        self.file_name = str(file_name)
+        self.header = parse_rrtex_header(source)
+        self._images = {}
+
+    @property
+    def version(self) -> int:
+        return self.header['version']
+
+    @property
+    def width(self) -> int:
+        return self.header['width']
+
+    @property
+    def height(self) -> int:
+        return self.header['height']
+
+    @property
+    def texture_compression(self) -> int:
+        return self.header['texture_compression']
+
+    @property
+    def compression(self) -> str:
+        """Name of the texture compression (bc1, bc3, bc7), None if it is not supported"""
+        return COMPRESSION_NAMES.get(self.header['texture_compression'])
+
+    @property
+    def mip_count(self) -> int:
+        return self.header['mip_count']
+
+    def mip_dimensions(self, mip_level: int = 0) -> tuple:
+        """Width and height of a mip level"""
+        return get_mip_dimensions(self.header, mip_level)
+
+    def to_image(self, mip_level: int = None, max_dimension: int = None) -> Image.Image:
+        """
+        Decodes the texture, see `decode_rrtex_bytes`. The image is cached per mip level and size,
+        copy it before modifying it.
+
+        Args:
+            mip_level (int): Mip level to decode (default: 0, the highest resolution).
+            max_dimension (int): Scale the image down so its larger side is at most this many pixels.
+
+        Returns:
+            Image.Image: The decoded RGBA image.
+        """
+        key = (mip_level, max_dimension)
+        if key not in self._images:
+            self._images[key] = decode_rrtex_bytes(self.data, self.file_name, mip_level, max_dimension)
+        return self._images[key]
+
+    def to_numpy(self, mip_level: int = None, max_dimension: int = None):
+        """
+        Decodes the texture to a NumPy array. numpy is optional and only imported here.
+
+        Returns:
+            numpy.ndarray: RGBA pixels, shape (height, width, 4), dtype uint8.
+        """
         try:
-            # Check if file is mipped first to determine decompression approach
-            is_mipped = os.path.basename(file_path_src).lower().endswith('_mipped.rrtex') or '_mipped.' in os.path.basename(file_path_src).lower()
-
-            if is_mipped:
-                # For mipped files, try multiple decompression strategies
-                first_chunk, unused_data = try_decompress_mipped(bytes_tdat)
-
-                # Process the first chunk - it might have a header
-                # Try to detect if there's a 16-byte header
-                if len(first_chunk) >= 16:
-                    # Check if first 12 bytes look like a mip header (mip_level, width, height)
-                    try:
-                        potential_mip_level, potential_width, potential_height = struct.unpack('<III', first_chunk[:12])
-                        # If values are reasonable, assume it's a header
-                        if potential_mip_level < 20 and potential_width <= 4096 and potential_height <= 4096:
-                            decompressed_chunks = [first_chunk[16:]]
-                        else:
-                            decompressed_chunks = [first_chunk]
-                    except:
-                        decompressed_chunks = [first_chunk]
-                else:
-                    decompressed_chunks = [first_chunk]
-
-                # Process remaining chunks
-                remaining_data = unused_data
-                chunk_count = 1
-                max_chunks = 20  # Safety limit
-
-                while len(remaining_data) > 0 and chunk_count < max_chunks:
-                    try:
-                        # Find the next zlib header
-                        found_header = False
-                        for i in range(len(remaining_data) - 1):
-                            if remaining_data[i] == 0x78 and remaining_data[i+1] in [0xda, 0x9c, 0x01, 0x5e]:
-                                if i > 0:
-                                    remaining_data = remaining_data[i:]
-                                found_header = True
-                                break
-
-                        if not found_header:
-                            break
-
-                        Next_decompressor = zlib.decompressobj()
-                        chunk = Next_decompressor.decompress(remaining_data)
-                        decompressed_chunks.append(chunk)
-                        remaining_data = Next_decompressor.unused_data
-                        chunk_count += 1
-
-                    except Exception:
-                        break
-
-                # Calculate the size of the first mipmap level (highest resolution)
-                if texture_compression == 28:  # BC7
-                    block_size = 16
-                elif texture_compression == 22:  # BC3
-                    block_size = 16
-                elif texture_compression == 19 or texture_compression == 18:  # BC1
-                    block_size = 8
-                else:
-                    raise Exception(f"Unknown texture compression type: {texture_compression}")
-
-                width_mip = max(1, width)
-                height_mip = max(1, height)
-                num_blocks = ((width_mip + 3) // 4) * ((height_mip + 3) // 4)
-                mip0_size = num_blocks * block_size
-
-                # Try to find mip level 0 chunk
-                mip0_chunk = None
-                for chunk in decompressed_chunks:
-                    if len(chunk) >= 16:
-                        try:
-                            mip_level, chunk_width, chunk_height = struct.unpack('<III', chunk[:12])
-                            if mip_level == 0 and chunk_width == width and chunk_height == height:
-                                mip0_chunk = chunk
-                                break
-                        except:
-                            continue
-
-                if mip0_chunk is not None:
-                    # Extract mip0 data (skip the 16-byte header)
-                    if len(mip0_chunk) >= 16 + mip0_size:
-                        decompressed_data = mip0_chunk[16:16 + mip0_size]
-                    else:
-                        decompressed_data = mip0_chunk[16:]
-                        if len(decompressed_data) < mip0_size:
-                            decompressed_data += b'\x00' * (mip0_size - len(decompressed_data))
-                else:
-                    # Fallback: use the first/largest chunk
-                    if len(decompressed_chunks) > 0:
-                        # Try first chunk
-                        if len(decompressed_chunks[0]) >= mip0_size:
-                            decompressed_data = decompressed_chunks[0][:mip0_size]
-                        else:
-                            # Concatenate all chunks and take what we need
-                            all_data = b''.join(decompressed_chunks)
-                            decompressed_data = all_data[:mip0_size]
-                            if len(decompressed_data) < mip0_size:
-                                decompressed_data += b'\x00' * (mip0_size - len(decompressed_data))
-
-            else:
-                # Original implementation for non-mipped files
-                Decompressor = zlib.decompressobj()
-                # get the first decompressed chunk
-                chunk = Decompressor.decompress(bytes_tdat[16:])    # magic shift by 16
-                decompressed_chunks = [chunk[16:]]                  # create list, another magic shift by 16
-                # unused compressed data
-                unused_data = Decompressor.unused_data
-
-                # while there are still unused_data(not decompressed), try decompressing them, otherwise assign it directly.
-                try:
-                    while len(unused_data) > 0:
-                        Next_decompressor = zlib.decompressobj()
-                        chunk = Next_decompressor.decompress(unused_data)
-                        decompressed_chunks.append(chunk)
-                        unused_data = Next_decompressor.unused_data
-
-                    # assemble decompressed_data from decompressed_chunks
-                    decompressed_data = b''
-                    for chunk in decompressed_chunks:
-                        decompressed_data += chunk
-                except:
-                    # assemble decompressed_data from decompressed_chunks
-                    decompressed_data = b''
-                    for chunk in decompressed_chunks:
-                        decompressed_data += chunk
-
-
-
-            # decode with correct texture compression. Data are decoded to BGRA
-            if texture_compression == 28:
-                decoded_data= texture2ddecoder.decode_bc7(decompressed_data, width, height)
-            elif texture_compression == 22:
-                decoded_data= texture2ddecoder.decode_bc3(decompressed_data, width, height)
-            elif texture_compression == 19:
-                decoded_data= texture2ddecoder.decode_bc1(decompressed_data, width, height) # Bc1
-            elif texture_compression == 18:
-                decoded_data= texture2ddecoder.decode_bc1(decompressed_data, width, height) # Bc1 with alpha?  
-            else:
-                # unsupported 2(R)
-                raise Exception(f"Unknown texture compression type: {texture_compression}")
-
-            dec_img = Image.frombytes("RGBA", (width, height), decoded_data, 'raw', ("BGRA"))
-
-            # Save with format-specific options
-            file_ext = os.path.splitext(file_path_dest)[1].lower()
-            if file_ext == '.webp':
-                # Save as WebP with quality setting, preserving transparency
-                dec_img.save(file_path_dest, 'WEBP', quality=WEBP_QUALITY, lossless=False)
-            else:
-                # For TGA, PNG and other formats, use default settings
-                dec_img.save(file_path_dest)
-
-        except Exception as e:      
-            error = f"convert_rrtex failed.\nException: {e}"
-            print(error)
-            raise Exception(error)
+            import numpy
+        except ImportError:
+            raise ImportError("RrtexTexture.to_numpy requires numpy (pip install numpy)")
+        return numpy.asarray(self.to_image(mip_level, max_dimension))
+
+    def encode(self, image_format: str, mip_level: int = None, max_dimension: int = None, preset: str = DEFAULT_PRESET) -> bytes:
+        """Encodes the texture in memory (tga, png, webp), see `encode_image`"""
+        return encode_image(self.to_image(mip_level, max_dimension), image_format, preset)
+
+    def pack(self, container_format: str, mip_level: int = None, max_dimension: int = None, mips: bool = False) -> bytes:
+        """Wraps the BC data in a GPU container (dds, ktx2) without decoding it, see `pack_rrtex_bytes`"""
+        return pack_rrtex_bytes(self.data, container_format, self.file_name, mip_level, max_dimension, mips)
+
+    def save(self, file_path_dest: str, mip_level: int = None, max_dimension: int = None, preset: str = DEFAULT_PRESET) -> None:
+        """Saves the texture, the extension of `file_path_dest` selects the format, see `save_image`"""
+        save_image(self.to_image(mip_level, max_dimension), file_path_dest, preset)
+
+    def clear_cache(self) -> None:
+        """Drops the decoded images"""
+        self._images.clear()
+
+    def __repr__(self):
+        return (f"RrtexTexture({self.file_name!r}, {self.width}x{self.height}, "
+                f"{self.compression or self.texture_compression}, {self.mip_count} mips)")
+
 
 # #################################
 # This is a test code
@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sga_reader import open_archive
+
+# Finds the .rrtex files of a source folder (main.py, tile_pyramid.py). The folders are listed with os.scandir on a
+# pool of threads: on network shares and slow disks a scan mostly waits for directory listings, and these overlap.
+# Files are yielded as soon as their folder is listed, so the conversion can start with the first folders
+# while the rest of the tree is still being scanned. Nothing is created in the destination folder, outputs
+# create their folder when they are written. A .sga archive is read from its table of contents instead.
+
+RRTEX_EXTENSION = '.rrtex'
+
+# Number of folders listed at the same time
+SCAN_THREADS = 8
+
+
+def list_folder(path):
+    """
+    Lists one folder. Like os.walk, symbolic links to folders are not followed and unreadable folders are skipped.
+
+    Returns:
+        tuple: (path, names of the .rrtex files, paths of the subfolders)
+    """
+    files = []
+    folders = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            folders.append(entry.path)
+                    elif entry.name.endswith(RRTEX_EXTENSION):
+                        files.append(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return path, files, folders
+
+
+def scan_tree(src_dir, dest_dir, num_threads=SCAN_THREADS):
+    """
+    Scans the source folder in parallel.
+
+    Args:
+        src_dir (str): the source folder.
+        dest_dir (str): the destination folder the source tree is mirrored to.
+        num_threads (int): number of folders listed at the same time.
+
+    Yields:
+        tuple: file_info (src_file, dest_subdir, file_name) of every .rrtex file, in no particular order.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        pending = {executor.submit(list_folder, src_dir)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dirpath, files, folders = future.result()
+                for folder in folders:
+                    pending.add(executor.submit(list_folder, folder))
+                dest_subdir = dirpath.replace(src_dir, dest_dir, 1)
+                for file in files:
+                    yield (os.path.join(dirpath, file), dest_subdir, file[:-len(RRTEX_EXTENSION)])
+
+
+def scan_archive(archive_path, dest_dir):
+    """
+    Read the table of contents of a .sga archive and yield a file_info tuple (SgaEntry, dest_subdir, file_name)
+    for every .rrtex entry
+    """
+    archive = open_archive(archive_path)
+    for entry in archive.entries:
+        folder, _, file = entry.path.rpartition('/')
+        file_name, _, file_extension = file.rpartition('.')
+        if file_name and file_extension.lower() == 'rrtex':
+            dest_subdir = os.path.join(dest_dir, *folder.split('/')) if folder else dest_dir
+            yield (entry, dest_subdir, file_name)
+
+
+def is_archive(src_dir):
+    """Whether the source is a .sga archive instead of a folder"""
+    return os.path.isfile(src_dir) and src_dir.lower().endswith('.sga')
+
+
+def scan_sources(src_dir, dest_dir, num_threads=SCAN_THREADS):
+    """
+    Yield file_info tuples for a source directory or .sga archive. Directories are scanned on `num_threads`
+    threads and the files of a folder are yielded as soon as it is listed, in no particular order (see scan_tree)
+    """
+    if is_archive(src_dir):
+        return scan_archive(src_dir, dest_dir)
+    return scan_tree(src_dir, dest_dir, num_threads)
@@ -0,0 +1,264 @@
+import os
+import sys
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+from rrtex_to_tga import SUPPORTED_FORMATS, encode_image, decode_source
+from manifest import stat_source, hash_source
+from sga_reader import open_archive
+
+# Local HTTP server converting .rrtex files on demand, instead of exporting every format and size up front.
+# The URL path selects the source file relative to --src (a folder or a .sga archive), the extension the
+# output format, and the query parameters the size and mip level:
+#
+#   http://localhost:8000/races/ausdefense_uk_icon_mipped.webp?size=64
+#   http://localhost:8000/icons/merit_mipped.png?mip=2
+#
+# Encoded results are kept in a size-bounded LRU cache. ETags are derived from the source hash and the requested
+# variant, so a revalidation is answered without converting anything and a patched source is converted again. Concurrent requests for the same output
+# are coalesced into a single conversion.
+#
+# Usage:
+#   python scripts/serve.py --src S:\coh3\ui --port 8000 --cache-size 256
+
+CONTENT_TYPES = {
+    'tga': 'image/x-tga',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+
+class LruCache:
+    """Thread-safe LRU cache of encoded images, bounded by the total size of the values in bytes"""
+    def __init__(self, max_bytes):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores a (etag, payload) value, evicting the least recently used entries"""
+        payload_size = len(value[1])
+        if payload_size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self.entries[key] = value
+            self.size += payload_size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[1])
+
+    def get_stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+class TextureService:
+    """Resolves request paths to sources and converts them, caching and coalescing the conversions"""
+    def __init__(self, src, cache_bytes):
+        self.src = os.path.abspath(src)
+        self.cache = LruCache(cache_bytes)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.digests = {}
+        self.archive_entries = None
+        if os.path.isfile(self.src) and self.src.lower().endswith('.sga'):
+            # entries by their path inside the archive without the extension, case-insensitive like the game
+            self.archive_entries = {
+                entry.path[:-len('.rrtex')].lower(): entry
+                for entry in open_archive(self.src).entries if entry.path.lower().endswith('.rrtex')
+            }
+
+    def resolve(self, path):
+        """
+        Maps a URL path without extension (e.g. "races/icon") to its source, None if there is no such file.
+        Paths leaving the source folder are rejected.
+        """
+        path = path.strip('/')
+        if not path:
+            return None
+        if self.archive_entries is not None:
+            return self.archive_entries.get(path.lower())
+        src_file = os.path.abspath(os.path.join(self.src, *path.split('/')) + '.rrtex')
+        if os.path.commonpath([self.src, src_file]) != self.src or not os.path.isfile(src_file):
+            return None
+        return src_file
+
+    def source_digest(self, src_file, src_stat):
+        """SHA-1 of the source, computed again only when its size or mtime changed"""
+        key = str(src_file)
+        stamp = (src_stat.st_size, src_stat.st_mtime_ns)
+        with self.lock:
+            cached = self.digests.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        digest = hash_source(src_file)
+        with self.lock:
+            self.digests[key] = (stamp, digest)
+        return digest
+
+    def describe(self, src_file, image_format, max_dimension=None, mip_level=None):
+        """
+        Identifies an output of a source without converting it.
+
+        Returns:
+            tuple: (cache key, etag)
+        """
+        digest = self.source_digest(src_file, stat_source(src_file))
+        variant = image_format
+        if mip_level is not None:
+            variant += f":mip{mip_level}"
+        if max_dimension is not None:
+            variant += f"@{max_dimension}"
+        # the digest is part of the key, a changed source is a new entry and the old one ages out
+        key = (str(src_file), digest, variant)
+        etag = f'"{digest[:20]}-{variant.replace(":", "-").replace("@", "-")}"'
+        return key, etag
+
+    def get(self, src_file, image_format, max_dimension=None, mip_level=None):
+        """
+        Returns the encoded image of a source, converting it on the first request.
+
+        Returns:
+            tuple: (etag, payload, cache_status) where cache_status is HIT, MISS (converted by this request)
+            or COALESCED (converted by a concurrent request for the same output)
+        """
+        key, etag = self.describe(src_file, image_format, max_dimension, mip_level)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[0], cached[1], 'HIT'
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+        if not owner:
+            # another request converts the same output, wait for its result
+            etag, payload = future.result()
+            return etag, payload, 'COALESCED'
+
+        try:
+            dec_img = decode_source(src_file, {'mip_level': mip_level, 'max_dimension': max_dimension})
+            payload = encode_image(dec_img, image_format)
+            self.cache.put(key, (etag, payload))
+            future.set_result((etag, payload))
+            return etag, payload, 'MISS'
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+def parse_int(query, name):
+    """Reads an optional non-negative integer query parameter, raises ValueError if it is invalid"""
+    values = query.get(name)
+    if not values:
+        return None
+    if not values[0].isdigit():
+        raise ValueError(f"Invalid {name} '{values[0]}'")
+    return int(values[0])
+
+
+class TextureRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET requests of the form /<path>.<format>?size=<pixels>&mip=<level>"""
+    service = None
+    max_age = 3600
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path, _, image_format = unquote(url.path).rpartition('.')
+        image_format = image_format.lower()
+        if image_format not in SUPPORTED_FORMATS:
+            self.send_error(404, f"Unsupported format, supported formats: {', '.join(SUPPORTED_FORMATS)}")
+            return
+        try:
+            query = parse_qs(url.query)
+            max_dimension = parse_int(query, 'size')
+            mip_level = parse_int(query, 'mip')
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        src_file = self.service.resolve(path)
+        if src_file is None:
+            self.send_error(404, "Texture not found")
+            return
+
+        try:
+            _, etag = self.service.describe(src_file, image_format, max_dimension, mip_level)
+            if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                # the client has this output already, nothing is converted
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', f'public, max-age={self.max_age}')
+                self.end_headers()
+                return
+            etag, payload, cache_status = self.service.get(src_file, image_format, max_dimension, mip_level)
+        except Exception as e:
+            self.log_error("Converting %s failed: %s", path, " ".join(str(e).split()))
+            self.send_error(500, str(e).splitlines()[-1])
+            return
+
+        cache_headers = {
+            'ETag': etag,
+            'Cache-Control': f'public, max-age={self.max_age}',
+            'X-Cache': cache_status,
+        }
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[image_format])
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in cache_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve rrtex files as images (TGA, PNG, WebP), converted on demand.')
+    parser.add_argument('--src', metavar='--src', type=str, required=True, help='path to source directory or .sga archive')
+    parser.add_argument('--host', metavar='host', type=str, default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', metavar='port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('--cache-size', metavar='cache_size', type=int, default=256,
+                        help='maximum size of the cached images in MB (default: 256)')
+    parser.add_argument('--max-age', metavar='max_age', type=int, default=3600,
+                        help='Cache-Control max-age of the responses in seconds (default: 3600)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.src):
+        print(f"Error: {args.src} does not exist")
+        sys.exit(1)
+
+    TextureRequestHandler.service = TextureService(args.src, args.cache_size * 1024 * 1024)
+    TextureRequestHandler.max_age = args.max_age
+    server = ThreadingHTTPServer((args.host, args.port), TextureRequestHandler)
+    print(f"Serving {args.src} on http://{args.host}:{args.port}/ (cache {args.cache_size} MB)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Cache: {TextureRequestHandler.service.cache.get_stats()}")
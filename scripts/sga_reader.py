@@ -0,0 +1,201 @@
+import os
+import mmap
+import struct
+import zlib
+import hashlib
+import threading
+from collections import namedtuple
+
+# Reader for Essence engine .sga archives (version 10, used by Company of Heroes 3).
+# The archive is memory-mapped, the table of contents is parsed once and every file entry
+# can be read straight into memory, so .rrtex files do not have to be exported with
+# EssenceEditor.exe before they can be converted.
+#
+# Layout (all integers little endian):
+#   magic "_ARCHIVE", version (uint16), product (uint16)
+#   header: name (64 UTF-16 chars), toc_pos (uint64), toc_size (uint32),
+#           data_pos (uint64), data_size (uint64), reserved (uint32), signature (256 bytes)
+#   toc header (at toc_pos): drive/folder/file/name table positions and counts (8 * uint32),
+#           positions are relative to toc_pos
+#   drive:  alias (64s), name (64s), first_folder, last_folder, first_file, last_file, root_folder
+#   folder: name_offset, first_folder, last_folder, first_file, last_file
+#   file:   name_offset, hash_offset, data_offset (uint64, relative to data_pos),
+#           size_compressed, size, verification_type (uint8), storage_type (uint8), crc
+
+SGA_MAGIC = b"_ARCHIVE"
+SGA_SUPPORTED_VERSIONS = (10,)
+
+HEADER_STRUCT = struct.Struct("<128sQIQQI")
+TOC_HEADER_STRUCT = struct.Struct("<8I")
+DRIVE_STRUCT = struct.Struct("<64s64s5I")
+FOLDER_STRUCT = struct.Struct("<5I")
+FILE_STRUCT = struct.Struct("<IIQIIBBI")
+
+# storage types of file entries
+STORAGE_STORE = 0
+STORAGE_STREAM_COMPRESS = 1
+STORAGE_BUFFER_COMPRESS = 2
+
+# the subset of os.stat_result used to detect changed sources
+SgaEntryStat = namedtuple("SgaEntryStat", ["st_size", "st_mtime_ns"])
+
+
+class SgaEntry:
+    """
+    A file stored in a .sga archive. Entries only hold offsets and the archive path,
+    so they can be sent to worker processes; the data is read through the archive
+    opened (and memory-mapped) once per process.
+    """
+    def __init__(self, archive_path, path, data_offset, size_compressed, size, storage_type, crc, mtime_ns):
+        self.archive_path = archive_path
+        self.path = path
+        self.data_offset = data_offset
+        self.size_compressed = size_compressed
+        self.size = size
+        self.storage_type = storage_type
+        self.crc = crc
+        self.mtime_ns = mtime_ns
+
+    def __str__(self):
+        return f"{self.archive_path}:{self.path}"
+
+    def read(self, max_size=None):
+        """Returns the (decompressed) content of the file, or only its first `max_size` bytes, see `SgaArchive.read`"""
+        return open_archive(self.archive_path).read(self, max_size)
+
+    def stat(self):
+        """Returns the size of the file and the mtime of the archive, like os.stat()"""
+        return SgaEntryStat(self.size, self.mtime_ns)
+
+    def sha1(self):
+        """Returns the SHA-1 hex digest of the file content"""
+        return hashlib.sha1(self.read()).hexdigest()
+
+
+class SgaArchive:
+    """Memory-mapped .sga archive"""
+    def __init__(self, archive_path):
+        self.path = os.path.abspath(archive_path)
+        self.file = open(self.path, "rb")
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.buffer)
+        except Exception:
+            self.file.close()
+            raise
+        self.mtime_ns = os.fstat(self.file.fileno()).st_mtime_ns
+        self.entries = []
+        try:
+            self._read_toc()
+        except struct.error as e:
+            self.close()
+            raise Exception(f"Invalid .sga archive {self.path}: {e}")
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        self.view.release()
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, entry, max_size=None):
+        """
+        Reads the content of a file entry.
+
+        Args:
+            entry (SgaEntry): The entry to read.
+            max_size (int): Only read (and decompress) the first `max_size` bytes.
+
+        Returns:
+            bytes or memoryview: The decompressed file content. Stored (uncompressed) files are returned
+            as a view of the memory-mapped archive, without copying them.
+        """
+        start = self.data_pos + entry.data_offset
+        if start + entry.size_compressed > len(self.buffer):
+            raise Exception(f"Data of {entry.path} is outside of the archive")
+        if entry.storage_type == STORAGE_STORE:
+            end = start + entry.size_compressed
+            if max_size is not None:
+                end = min(end, start + max_size)
+            return self.view[start:end]
+        data = self.view[start:start + entry.size_compressed]
+        if entry.storage_type in (STORAGE_STREAM_COMPRESS, STORAGE_BUFFER_COMPRESS):
+            if max_size is not None and max_size < entry.size:
+                return zlib.decompressobj().decompress(data, max_size)
+            data = zlib.decompress(data)
+            if len(data) != entry.size:
+                raise Exception(f"Decompressed size of {entry.path} does not match the archive: {len(data)} != {entry.size}")
+            return data
+        raise Exception(f"Unknown storage type {entry.storage_type} for {entry.path}")
+
+    def _read_toc(self):
+        buffer = self.buffer
+        if buffer[:8] != SGA_MAGIC:
+            raise Exception(f"{self.path} is not a .sga archive")
+        version, _product = struct.unpack_from("<HH", buffer, 8)
+        if version not in SGA_SUPPORTED_VERSIONS:
+            raise Exception(f"Unsupported .sga version {version} (supported: {SGA_SUPPORTED_VERSIONS})")
+
+        _name, toc_pos, _toc_size, data_pos, _data_size, _reserved = HEADER_STRUCT.unpack_from(buffer, 12)
+        self.data_pos = data_pos
+
+        (drive_pos, drive_count, folder_pos, folder_count,
+         file_pos, file_count, name_pos, _name_size) = TOC_HEADER_STRUCT.unpack_from(buffer, toc_pos)
+
+        def read_name(offset):
+            start = toc_pos + name_pos + offset
+            end = buffer.find(b"\x00", start)
+            return buffer[start:end].decode("utf-8", errors="replace")
+
+        folders = [FOLDER_STRUCT.unpack_from(buffer, toc_pos + folder_pos + i * FOLDER_STRUCT.size)
+                   for i in range(folder_count)]
+
+        for drive_index in range(drive_count):
+            drive = DRIVE_STRUCT.unpack_from(buffer, toc_pos + drive_pos + drive_index * DRIVE_STRUCT.size)
+            first_folder, last_folder = drive[2], drive[3]
+            for name_offset, _first_sub, _last_sub, first_file, last_file in folders[first_folder:last_folder]:
+                # folder names are full paths inside the archive, the root folder has an empty name
+                folder_name = read_name(name_offset).replace("\\", "/").strip("/")
+                for file_index in range(first_file, last_file):
+                    (file_name_offset, _hash_offset, data_offset, size_compressed, size,
+                     _verification_type, storage_type, crc) = FILE_STRUCT.unpack_from(
+                        buffer, toc_pos + file_pos + file_index * FILE_STRUCT.size)
+                    file_name = read_name(file_name_offset)
+                    path = folder_name + "/" + file_name if folder_name else file_name
+                    self.entries.append(SgaEntry(self.path, path, data_offset, size_compressed, size,
+                                                 storage_type, crc, self.mtime_ns))
+
+        if len(self.entries) != file_count:
+            # files not reachable from a drive are not listed, which would hint at a different layout
+            print(f"Warning: {len(self.entries)} of {file_count} files of {self.path} are listed in its folders")
+
+
+# Archives opened by this process, shared by all threads and reused across SgaEntry.read() calls
+_open_archives = {}
+_open_archives_lock = threading.Lock()
+
+
+def open_archive(archive_path):
+    """
+    Opens a .sga archive once per process.
+
+    Args:
+        archive_path (str): Path of the .sga archive.
+
+    Returns:
+        SgaArchive: The opened archive.
+    """
+    archive_path = os.path.abspath(archive_path)
+    with _open_archives_lock:
+        archive = _open_archives.get(archive_path)
+        if archive is None:
+            archive = SgaArchive(archive_path)
+            _open_archives[archive_path] = archive
+        return archive
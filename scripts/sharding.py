@@ -0,0 +1,50 @@
+import heapq
+import hashlib
+
+# Splits a conversion run across machines (--shard K/N). Every shard scans the same sources and computes
+# the same assignment, then converts only its own files. Files are assigned largest first to the shard with
+# the least bytes so far (longest processing time first), which balances the shards by cost rather than by
+# file count. Equal sizes are ordered by a hash of the path, so the assignment does not depend on the scan
+# order or on the machine.
+
+
+def parse_shard(shard_arg):
+    """
+    Parses a --shard argument "K/N" (shard K of N, 1-based).
+
+    Returns:
+        tuple: (K, N)
+    """
+    index, _, count = shard_arg.partition('/')
+    if not index.strip().isdigit() or not count.strip().isdigit():
+        raise ValueError(f"Invalid shard '{shard_arg}', expected K/N, e.g. 1/4")
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{shard_arg}', K must be between 1 and N")
+    return index, count
+
+
+def path_hash(key):
+    """Stable hash of a source key, independent of the Python hash seed"""
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def assign_shards(sizes, count):
+    """
+    Assigns the sources to shards, balancing the total size per shard.
+
+    Args:
+        sizes (dict): size in bytes by source key (path relative to the source folder or inside the archive).
+        count (int): number of shards.
+
+    Returns:
+        dict: shard (1-based) by source key.
+    """
+    order = sorted(sizes, key=lambda key: (-sizes[key], path_hash(key), key))
+    loads = [(0, shard) for shard in range(1, count + 1)]
+    assignment = {}
+    for key in order:
+        load, shard = heapq.heappop(loads)
+        assignment[key] = shard
+        heapq.heappush(loads, (load + sizes[key], shard))
+    return assignment
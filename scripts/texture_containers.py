@@ -0,0 +1,179 @@
+import struct
+
+# GPU texture containers for the BC compressed data of .rrtex files (--format dds / ktx2).
+# The blocks are written as they are stored in the .rrtex file, without decoding and re-encoding them,
+# so the output is exactly what the game uploads to the GPU. Mip levels are passed largest first.
+#
+# DDS:  https://learn.microsoft.com/en-us/windows/win32/direct3ddds/dds-header
+#       BC1 and BC3 use the legacy DXT1 / DXT5 FourCCs every reader supports, BC7 needs the DX10 header.
+# KTX2: https://registry.khronos.org/KTX/specs/2.0/ktxspec.v2.html
+#       with the Khronos Data Format descriptor of the block format, levels stored smallest first.
+
+CONTAINER_FORMATS = ['dds', 'ktx2']
+
+# Size in bytes of a 4x4 block by compression name
+BLOCK_SIZES = {
+    'bc1': 8,
+    'bc3': 16,
+    'bc7': 16,
+}
+
+# DDS header flags and capabilities, from ddraw.h / dds.h
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+DDS_DIMENSION_TEXTURE2D = 3
+
+# FourCC of the DDS pixel format, and the DXGI format written in the DX10 header for FourCC DX10
+DDS_FOURCCS = {
+    'bc1': b'DXT1',
+    'bc3': b'DXT5',
+    'bc7': b'DX10',
+}
+DXGI_FORMAT_BC7_UNORM = 98
+
+KTX2_IDENTIFIER = b'\xabKTX 20\xbb\r\n\x1a\n'
+KTX2_WRITER = b'coh3-image-extractor'
+
+# VkFormat of the blocks. BC1 may use its 1 bit alpha, so the RGBA variant is written
+KTX2_VK_FORMATS = {
+    'bc1': 133,  # VK_FORMAT_BC1_RGBA_UNORM_BLOCK
+    'bc3': 137,  # VK_FORMAT_BC3_UNORM_BLOCK
+    'bc7': 145,  # VK_FORMAT_BC7_UNORM_BLOCK
+}
+
+# Data format descriptor: color model and the (bit offset, bit length - 1, channel) of every sample of a block
+KTX2_DFD_MODELS = {
+    'bc1': (128, [(0, 63, 1)]),               # KHR_DF_MODEL_BC1A, alpha present
+    'bc3': (130, [(0, 63, 15), (64, 63, 0)]),  # KHR_DF_MODEL_BC3, alpha block then color block
+    'bc7': (134, [(0, 127, 0)]),              # KHR_DF_MODEL_BC7
+}
+KHR_DF_PRIMARIES_BT709 = 1
+KHR_DF_TRANSFER_LINEAR = 1
+
+
+def check_compression(compression):
+    if compression not in BLOCK_SIZES:
+        raise Exception(f"Unsupported texture compression for GPU containers: {compression}")
+
+
+def pack_dds(compression, width, height, levels):
+    """
+    Wraps BC data in a DDS file.
+
+    Args:
+        compression (str): bc1, bc3 or bc7.
+        width (int): width of the first level.
+        height (int): height of the first level.
+        levels (list): BC data of the mip levels, largest first.
+
+    Returns:
+        bytes: the DDS file.
+    """
+    check_compression(compression)
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE
+    caps = DDSCAPS_TEXTURE
+    if len(levels) > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+    fourcc = DDS_FOURCCS[compression]
+
+    parts = [
+        b'DDS ',
+        struct.pack('<7I', 124, flags, height, width, len(levels[0]), 0, len(levels)),
+        bytes(11 * 4),  # reserved
+        struct.pack('<2I4s5I', 32, DDPF_FOURCC, fourcc, 0, 0, 0, 0, 0),
+        struct.pack('<5I', caps, 0, 0, 0, 0),
+    ]
+    if fourcc == b'DX10':
+        parts.append(struct.pack('<5I', DXGI_FORMAT_BC7_UNORM, DDS_DIMENSION_TEXTURE2D, 0, 1, 0))
+    parts.extend(levels)
+    return b''.join(parts)
+
+
+def ktx2_dfd(compression):
+    """Data format descriptor of a block format: its total size followed by one basic descriptor block"""
+    model, samples = KTX2_DFD_MODELS[compression]
+    block_size = 24 + 16 * len(samples)
+    dfd = [
+        struct.pack('<I', 4 + block_size),
+        struct.pack('<IHH', 0, 2, block_size),  # vendor Khronos, basic descriptor type, version 2
+        struct.pack('<4B', model, KHR_DF_PRIMARIES_BT709, KHR_DF_TRANSFER_LINEAR, 0),
+        struct.pack('<4B', 3, 3, 0, 0),  # 4x4 texel block (dimensions minus 1)
+        struct.pack('<8B', BLOCK_SIZES[compression], 0, 0, 0, 0, 0, 0, 0),
+    ]
+    for bit_offset, bit_length, channel in samples:
+        dfd.append(struct.pack('<HBB4BII', bit_offset, bit_length, channel, 0, 0, 0, 0, 0, 0xFFFFFFFF))
+    return b''.join(dfd)
+
+
+def ktx2_key_values(pairs):
+    """Key/value data: every pair is its length, the NUL terminated key and value, padded to 4 bytes"""
+    data = bytearray()
+    for key, value in pairs:
+        entry = key + b'\0' + value + b'\0'
+        data += struct.pack('<I', len(entry)) + entry
+        data += bytes(-len(data) % 4)
+    return bytes(data)
+
+
+def pack_ktx2(compression, width, height, levels):
+    """
+    Wraps BC data in a KTX2 file (no supercompression).
+
+    Args:
+        compression (str): bc1, bc3 or bc7.
+        width (int): width of the first level.
+        height (int): height of the first level.
+        levels (list): BC data of the mip levels, largest first.
+
+    Returns:
+        bytes: the KTX2 file.
+    """
+    check_compression(compression)
+    alignment = BLOCK_SIZES[compression]  # lcm(block size, 4)
+    dfd = ktx2_dfd(compression)
+    key_values = ktx2_key_values([(b'KTXwriter', KTX2_WRITER)])
+
+    dfd_offset = 80 + 24 * len(levels)
+    kvd_offset = dfd_offset + len(dfd)
+    offset = kvd_offset + len(key_values)
+
+    # the level index lists the largest level first, the data stores the smallest level first
+    data = []
+    level_index = [None] * len(levels)
+    for index in reversed(range(len(levels))):
+        padding = -offset % alignment
+        data.append(bytes(padding))
+        offset += padding
+        level_index[index] = struct.pack('<3Q', offset, len(levels[index]), len(levels[index]))
+        data.append(levels[index])
+        offset += len(levels[index])
+
+    parts = [
+        KTX2_IDENTIFIER,
+        # vkFormat, typeSize, pixelWidth, pixelHeight, pixelDepth, layerCount, faceCount, levelCount, supercompressionScheme
+        struct.pack('<9I', KTX2_VK_FORMATS[compression], 1, width, height, 0, 0, 1, len(levels), 0),
+        struct.pack('<4I2Q', dfd_offset, len(dfd), kvd_offset, len(key_values), 0, 0),
+    ]
+    parts.extend(level_index)
+    parts.append(dfd)
+    parts.append(key_values)
+    parts.extend(data)
+    return b''.join(parts)
+
+
+def pack_texture(container_format, compression, width, height, levels):
+    """Wraps BC data in the given container format (dds, ktx2), see `pack_dds` and `pack_ktx2`"""
+    if container_format == 'dds':
+        return pack_dds(compression, width, height, levels)
+    if container_format == 'ktx2':
+        return pack_ktx2(compression, width, height, levels)
+    raise Exception(f"Unknown container format: {container_format}")
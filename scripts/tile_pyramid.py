@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+from rrtex_to_tga import (ENCODER_PRESETS, DEFAULT_PRESET, SUPPORTED_FORMATS, decode_rrtex_bands, pixels_to_image, save_image,
+                          open_source_buffer, source_name)
+from rrtex_index import read_source_header
+from scanner import scan_sources
+
+# Cuts large .rrtex textures (maps, minimaps, terrain) into a tile pyramid for map viewers such as Leaflet or
+# OpenLayers, instead of writing one huge image. Mip level 0 is decoded in bands of one row of tiles (see
+# rrtex_to_tga.decode_rrtex_bands): every band is cut into the tiles of the highest zoom level and scaled down
+# 2x into the next zoom level, which cuts its tiles as soon as it has a full row of them. Only a band and one
+# row of tiles per zoom level are held, so the memory depends on the width of a texture and the tile size,
+# not on its height, and many large textures can be tiled at once on a pool of processes.
+#
+# Every texture gets a folder named like the texture, mirroring the source tree:
+#   <dst>/<folder>/<name>/{z}/{x}/{y}.<format>   zoom 0 is a single tile of the whole texture
+#   <dst>/<folder>/<name>/tiles.json             texture size, tile size, format and zoom levels
+# Tiles at the right and bottom edges are padded with transparent pixels to the full tile size.
+#
+# Usage:
+#   python scripts/tile_pyramid.py --src S:\coh3\scenarios --dst tiles --tile-size 256 --format webp
+
+DEFAULT_TILE_SIZE = 256
+
+# Smaller textures fit a single image, they are skipped unless --min-dimension is lowered
+DEFAULT_MIN_DIMENSION = 1024
+
+
+def get_max_zoom(width, height, tile_size):
+    """Highest zoom level: the texture at full resolution, every zoom level below halves it until it fits one tile"""
+    return max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+
+
+class ZoomLevel:
+    """
+    Collects the rows of one zoom level. Whenever a row of tiles is complete its tiles are written,
+    and the row is scaled down 2x and passed on to the next lower zoom level.
+    """
+    def __init__(self, zoom, tile_size, write_tile, lower):
+        """
+        Args:
+            zoom (int): the zoom level.
+            tile_size (int): width and height of a tile.
+            write_tile (function): called with (zoom, x, y, tile image) for every tile.
+            lower (ZoomLevel): the next lower zoom level, None for zoom 0.
+        """
+        self.zoom = zoom
+        self.tile_size = tile_size
+        self.write_tile = write_tile
+        self.lower = lower
+        self.pending = None
+        self.row = 0
+
+    def add(self, strip):
+        """Appends rows (an RGBA image as wide as the zoom level) below the rows added before"""
+        if self.pending is not None:
+            combined = Image.new('RGBA', (strip.width, self.pending.height + strip.height))
+            combined.paste(self.pending, (0, 0))
+            combined.paste(strip, (0, self.pending.height))
+            strip = combined
+        while strip.height >= self.tile_size:
+            self.emit(strip.crop((0, 0, strip.width, self.tile_size)))
+            strip = strip.crop((0, self.tile_size, strip.width, strip.height))
+        self.pending = strip if strip.height else None
+
+    def flush(self):
+        """Writes the last, partial row of tiles of this and the lower zoom levels"""
+        if self.pending is not None:
+            self.emit(self.pending)
+            self.pending = None
+        if self.lower is not None:
+            self.lower.flush()
+
+    def emit(self, row):
+        for x in range(0, row.width, self.tile_size):
+            # cropping beyond the row pads the edge tiles with transparent pixels
+            self.write_tile(self.zoom, x // self.tile_size, self.row, row.crop((x, 0, x + self.tile_size, self.tile_size)))
+        self.row += 1
+        if self.lower is not None:
+            self.lower.add(row.reduce(2))
+
+
+def tile_texture(file_info, tile_size=DEFAULT_TILE_SIZE, image_format='png', preset=DEFAULT_PRESET):
+    """
+    Writes the tile pyramid of one .rrtex file path or .sga archive entry (runs in a worker process)
+
+    Args:
+        file_info: tuple of (src_file, dest_subdir, file_name), the tiles go to dest_subdir/file_name
+        tile_size: width and height of a tile, a multiple of 4
+        image_format: format of the tiles (tga, png, webp)
+        preset: encoder preset of the tiles, see ENCODER_PRESETS
+
+    Returns:
+        dict: the tiles.json content
+    """
+    src_file, dest_subdir, file_name = file_info
+    out_dir = os.path.join(dest_subdir, file_name)
+    created_dirs = set()
+    tile_count = 0
+
+    def write_tile(zoom, x, y, tile):
+        nonlocal tile_count
+        folder = os.path.join(out_dir, str(zoom), str(x))
+        if folder not in created_dirs:
+            os.makedirs(folder, exist_ok=True)
+            created_dirs.add(folder)
+        save_image(tile, os.path.join(folder, f"{y}.{image_format}"), preset)
+        tile_count += 1
+
+    with open_source_buffer(src_file) as buff:
+        width, height, bands = decode_rrtex_bands(buff, source_name(src_file), 0, tile_size)
+        max_zoom = get_max_zoom(width, height, tile_size)
+        level = None
+        for zoom in range(max_zoom + 1):
+            level = ZoomLevel(zoom, tile_size, write_tile, level)
+        for rows, pixels in bands:
+            level.add(pixels_to_image(width, rows, pixels))
+        level.flush()
+
+    info = {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'format': image_format,
+        'min_zoom': 0,
+        'max_zoom': max_zoom,
+        'tiles': tile_count,
+    }
+    with open(os.path.join(out_dir, 'tiles.json'), 'w') as f:
+        json.dump(info, f, indent=4)
+    return info
+
+
+def find_textures(src, dst, min_dimension):
+    """
+    Yields the file_info tuples of the textures to tile: a single .rrtex file, or the .rrtex files of a folder
+    or .sga archive whose larger side is at least min_dimension pixels
+    """
+    if os.path.isfile(src) and src.lower().endswith('.rrtex'):
+        yield (src, dst, os.path.splitext(os.path.basename(src))[0])
+        return
+    for file_info in scan_sources(src, dst):
+        try:
+            header = read_source_header(file_info[0])
+        except Exception:
+            continue
+        if max(header['width'], header['height']) >= min_dimension:
+            yield file_info
+
+
+if __name__ == "__main__":
+    default_workers = os.cpu_count() or 4
+
+    parser = argparse.ArgumentParser(description='Cut large rrtex textures into tile pyramids for map viewers.')
+    parser.add_argument('--src', metavar='--src', type=str, required=True,
+                        help='path to a .rrtex file, a source directory or a .sga archive')
+    parser.add_argument('--dst', '--destination', metavar='destination', type=str, default='tiles',
+                        help='destination directory, every texture gets a folder of tiles (default: tiles)')
+    parser.add_argument('--tile-size', metavar='tile_size', type=int, default=DEFAULT_TILE_SIZE,
+                        help=f'width and height of the tiles in pixels, a multiple of 4 (default: {DEFAULT_TILE_SIZE})')
+    parser.add_argument('--format', metavar='format', type=str, default='png', choices=SUPPORTED_FORMATS,
+                        help='format of the tiles: tga, png or webp (default: png)')
+    parser.add_argument('--preset', metavar='preset', type=str, default=DEFAULT_PRESET, choices=list(ENCODER_PRESETS),
+                        help=f'encoder preset of the tiles: fast, balanced or smallest (default: {DEFAULT_PRESET})')
+    parser.add_argument('--min-dimension', metavar='min_dimension', type=int, default=DEFAULT_MIN_DIMENSION,
+                        help=f'only tile textures whose larger side is at least this many pixels, ignored for a single '
+                             f'.rrtex file (default: {DEFAULT_MIN_DIMENSION})')
+    parser.add_argument('--workers', metavar='workers', type=int, default=default_workers,
+                        help=f'number of textures tiled at the same time in worker processes '
+                             f'(default: {default_workers} - detected CPU cores)')
+    args = parser.parse_args()
+
+    if args.tile_size <= 0 or args.tile_size % 4:
+        print(f"Error: --tile-size must be a positive multiple of 4, got {args.tile_size}")
+        sys.exit(1)
+    if not os.path.exists(args.src):
+        print(f"Error: {args.src} does not exist")
+        sys.exit(1)
+
+    dest_dir = os.path.abspath(args.dst)
+    os.makedirs(dest_dir, exist_ok=True)
+    print(f"Tiling {args.src} into {dest_dir} ({args.tile_size}px {args.format} tiles, {args.workers} workers)")
+
+    start_time = time.time()
+    tiled = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(tile_texture, file_info, args.tile_size, args.format, args.preset): file_info
+                   for file_info in find_textures(args.src, dest_dir, args.min_dimension)}
+        for future in as_completed(futures):
+            name = source_name(futures[future][0])
+            try:
+                info = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"✗ {name}: {e}")
+                continue
+            tiled += 1
+            print(f"✓ {name}: {info['width']}x{info['height']}, zoom 0-{info['max_zoom']}, {info['tiles']} tiles")
+
+    print(f"Tiled {tiled} textures, {failed} failed in {time.time() - start_time:.2f} seconds")
+    if failed:
+        sys.exit(1)
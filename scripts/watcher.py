@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# Watches a source folder for new, changed and deleted .rrtex files (main.py --watch).
+# On Linux inotify is used through ctypes, so changes are seen as soon as a file is closed after writing.
+# Elsewhere, or if inotify is not available, the folder is scanned every --poll-interval seconds and
+# compared with the previous scan. Bursts of changes (e.g. an export of many files) are debounced:
+# the changes are handed over once no further change arrived for a short time.
+
+RRTEX_EXTENSION = '.rrtex'
+
+# inotify constants, from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_STRUCT = struct.Struct('iIII')
+
+
+def is_rrtex(path):
+    return path.endswith(RRTEX_EXTENSION)
+
+
+def list_rrtex(src_dir):
+    """Returns the paths of all .rrtex files below `src_dir`"""
+    return [os.path.join(dirpath, file) for dirpath, _, filenames in os.walk(src_dir)
+            for file in filenames if is_rrtex(file)]
+
+
+class PollingWatcher:
+    """Detects changes by comparing the size and mtime of all .rrtex files between scans"""
+    def __init__(self, src_dir, poll_interval=1.0):
+        self.src_dir = src_dir
+        self.poll_interval = poll_interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for path in list_rrtex(self.src_dir):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read_events(self, timeout=None):
+        """
+        Waits up to `timeout` seconds (None: until something changed) for changes.
+
+        Returns:
+            list: ('changed' or 'removed', path) tuples.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.poll_interval if deadline is None else max(0.0, min(self.poll_interval, deadline - time.monotonic()))
+            time.sleep(delay)
+            snapshot = self._scan()
+            events = [('changed', path) for path, stamp in snapshot.items() if self.snapshot.get(path) != stamp]
+            events += [('removed', path) for path in self.snapshot if path not in snapshot]
+            self.snapshot = snapshot
+            if events or (deadline is not None and time.monotonic() >= deadline):
+                return events
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Linux inotify watches on the source folder and all its subfolders. The .rrtex files below the folder
+    are tracked, so the files of a folder moved out of the tree are reported as removed.
+    """
+    def __init__(self, src_dir):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.src_dir = src_dir
+        self.watches = {}
+        self.files = set()
+        try:
+            self._add_tree(src_dir)
+        except Exception:
+            self.close()
+            raise
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOENT:
+                return
+            raise OSError(error, f"inotify_add_watch failed for {path} (raise fs.inotify.max_user_watches or use --poll-interval)")
+        self.watches[wd] = path
+
+    def _add_tree(self, path):
+        """Watches a folder and its subfolders, returns the .rrtex files already in it"""
+        found = []
+        for dirpath, _, filenames in os.walk(path):
+            self._add_watch(dirpath)
+            found.extend(os.path.join(dirpath, file) for file in filenames if is_rrtex(file))
+        self.files.update(found)
+        return found
+
+    def read_events(self, timeout=None):
+        """
+        Waits up to `timeout` seconds (None: until something changed) for changes.
+
+        Returns:
+            list: ('changed' or 'removed', path) tuples.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT_STRUCT.size <= len(data):
+            wd, mask, _cookie, name_length = EVENT_STRUCT.unpack_from(data, offset)
+            name = data[offset + EVENT_STRUCT.size:offset + EVENT_STRUCT.size + name_length].rstrip(b'\0')
+            offset += EVENT_STRUCT.size + name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost: every file may have changed, unchanged ones are skipped by the manifest
+                found = set(list_rrtex(self.src_dir))
+                events.extend(('removed', path) for path in self.files - found)
+                events.extend(('changed', path) for path in found)
+                self.files = found
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files may have been written before the watch of the new folder was added
+                    events.extend(('changed', found) for found in self._add_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    prefix = path + os.sep
+                    self.watches = {key: value for key, value in self.watches.items()
+                                    if value != path and not value.startswith(prefix)}
+                    # a folder moved out of the tree gets no events for its files
+                    gone = [known for known in self.files if known.startswith(prefix)]
+                    self.files.difference_update(gone)
+                    events.extend(('removed', known) for known in gone)
+                continue
+            if not is_rrtex(path):
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.files.add(path)
+                events.append(('changed', path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.files.discard(path)
+                events.append(('removed', path))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(src_dir, poll_interval=None):
+    """
+    Creates an inotify watcher on Linux, a polling watcher elsewhere or when `poll_interval` is given.
+
+    Returns:
+        InotifyWatcher or PollingWatcher
+    """
+    if poll_interval is None and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(src_dir)
+        except (OSError, AttributeError) as e:
+            print(f"inotify not available ({e}), polling for changes every second")
+    return PollingWatcher(src_dir, poll_interval or 1.0)
+
+
+def wait_for_changes(watcher, debounce=0.2, max_delay=2.0):
+    """
+    Blocks until files changed and no further change arrived for `debounce` seconds
+    (or changes kept arriving for `max_delay` seconds).
+
+    Returns:
+        tuple: (set of changed paths, set of removed paths)
+    """
+    changed, removed = set(), set()
+    events = watcher.read_events(None)
+    start = time.monotonic()
+    while events:
+        for kind, path in events:
+            if kind == 'changed':
+                changed.add(path)
+                removed.discard(path)
+            else:
+                removed.add(path)
+                changed.discard(path)
+        if time.monotonic() - start >= max_delay:
+            break
+        events = watcher.read_events(debounce)
+    return changed, removed